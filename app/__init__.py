@@ -1,5 +1,4 @@
 import logging
-from logging.handlers import RotatingFileHandler
 import os
 import sys
 from flask import Flask, jsonify, request
@@ -10,19 +9,24 @@ from flask_limiter.util import get_remote_address
 import google.generativeai as genai
 
 from .config import Config
+from .log_handlers import (
+    ProcessSafeRotatingFileHandler, SamplingFilter, attach_handlers, make_formatter, parse_sample_rates,
+)
+from .metrics import timed_pool_class
 from .models import db
 
+_sample_rates = parse_sample_rates(Config.LOG_SAMPLE_RATES)
+
 def setup_logger(name, log_file, level=logging.INFO):
-    """Function to set up a logger."""
-    log_directory = 'logs'
+    """Function to set up a logger (see log_handlers for the queue, sampling and rotation)."""
+    log_directory = Config.LOG_DIR
     if not os.path.exists(log_directory):
-        os.makedirs(log_directory)
+        os.makedirs(log_directory, exist_ok=True)
 
-    handler = RotatingFileHandler(f'{log_directory}/{log_file}', maxBytes=10485760, backupCount=5)
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s [in %(pathname)s:%(lineno)d]',
-        datefmt='%Y-%m-%d %H:%M:%S'
+    handler = ProcessSafeRotatingFileHandler(
+        os.path.join(log_directory, log_file), maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT
     )
+    formatter = make_formatter(Config.LOG_FORMAT)
     handler.setFormatter(formatter)
     
     stream_handler = logging.StreamHandler(sys.stdout)
@@ -30,8 +34,9 @@ def setup_logger(name, log_file, level=logging.INFO):
 
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    logger.addHandler(handler)
-    logger.addHandler(stream_handler)
+    if name in _sample_rates and _sample_rates[name] < 1:
+        logger.addFilter(SamplingFilter(_sample_rates[name]))
+    attach_handlers(logger, [handler, stream_handler], Config.LOG_QUEUE_ENABLED)
     logger.propagate = False
     return logger
 
@@ -45,9 +50,12 @@ cors = CORS()
 jwt = JWTManager()
 limiter = Limiter(key_func=get_remote_address)
 
-def create_app():
+def create_app(start_background_tasks: bool = True, warm_up: bool = True):
     """
     Application factory function to create and configure the Flask app.
+    Maintenance commands pass start_background_tasks=False to skip the index
+    builder, the embedded ingestion workers and the warm-up; the standalone
+    ingestion worker passes warm_up=False.
     """
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -63,6 +71,7 @@ def create_app():
     
     app.config['SQLALCHEMY_DATABASE_URI'] = Config.DATABASE_URL
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': timed_pool_class('app')}
     db.init_app(app)
 
     cors.init_app(app, origins="*", supports_credentials=True)
@@ -74,13 +83,31 @@ def create_app():
 
     with app.app_context():
         try:
-            db.create_all()
-            app_logger.info("Database tables created or already exist.")
+            if Config.SCHEMA_SETUP_ON_STARTUP:
+                from .schema import setup_schema
+                setup_schema()
+                app_logger.info("Database tables created or already exist.")
+            if start_background_tasks:
+                from .vector_index import build_vector_index_in_background
+                build_vector_index_in_background(app)
+                if Config.VECTOR_MIRROR_ENABLED:
+                    from .vector_mirror import vector_mirror
+                    vector_mirror.start(app)
         except Exception as e:
             app_logger.critical(f"FATAL: Database table creation failed: {e}", exc_info=True)
             error_logger.critical(f"Database creation error. Did you remember to run 'CREATE EXTENSION IF NOT EXISTS vector;' in PostgreSQL?", exc_info=True)
 
 
+    if start_background_tasks and Config.INGESTION_WORKER_MODE == "embedded":
+        from .job_queue import start_ingestion_workers
+        start_ingestion_workers(app)
+
+    from .warmup import mark_ready, start_warm_up
+    if start_background_tasks and warm_up:
+        start_warm_up(app)
+    else:
+        mark_ready()
+
     @app.errorhandler(404)
     def handle_not_found(e):
         return jsonify({"error": "Resource not found"}), 404
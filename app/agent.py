@@ -1,18 +1,36 @@
 import os
 import asyncio
+import threading
+from typing import Optional
 from google.adk.agents import Agent
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.tools.tool_context import ToolContext
 from dotenv import load_dotenv
 import logging
 from sqlalchemy import text
 import google.generativeai as genai
 from .config import Config
+from .metrics import RETRIEVAL_STAGE_SECONDS, timed, before_model_callback, after_model_callback
 from .prompts import return_instructions_root
 from .models import db
+from .cache import embedding_cache, pack_vector, unpack_vector
+from .single_flight import SingleFlight, Codec, flight_key
+from .embedding_batcher import query_embedding_batcher
+from .vector_index import apply_search_params
+from .vector_search import similarity_query, chunk_contents_query, vector_search
+from .vector_mirror import vector_mirror
+from .partitions import normalize_collection
 
 load_dotenv()
 logger = logging.getLogger('app')
 
+# Session state key holding the collection an /ask request was scoped to.
+COLLECTION_STATE_KEY = "retrieval_collection"
+
+# Identical concurrent query embeddings (across workers) and retrievals (per worker) run once.
+embedding_flight = SingleFlight("embedding")
+retrieval_flight = SingleFlight("retrieval")
+_VECTOR_CODEC = Codec(encode=pack_vector, decode=unpack_vector)
+
 # --- Environment Variable Checks ---
 GENAI_MODEL_NAME = os.getenv("GOOGLE_MODEL_NAME")
 
@@ -24,29 +42,49 @@ if not Config.GOOGLE_API_KEY:
 
 
 def _get_sync_embedding(query: str) -> list[float] | None:
-    logger.info("Executing synchronous embedding generation in thread pool...")
+    if Config.EMBEDDING_CACHE_ENABLED:
+        cached = embedding_cache.get(query)
+        if cached is not None:
+            logger.debug("Query embedding served from cache.")
+            return cached
+
+    return embedding_flight.do(embedding_cache.key(query), lambda: _embed_query(query), codec=_VECTOR_CODEC)
+
+
+def _embed_query(query: str) -> list[float] | None:
     try:
-        embed_result = genai.embed_content(
-            model=Config.EMBEDDING_MODEL_NAME,
-            content=query,
-            task_type="retrieval_query",
-            output_dimensionality=Config.PG_EMBEDDING_DIMENSION 
-        )
-        return embed_result['embedding']
+        if Config.QUERY_EMBEDDING_BATCHING_ENABLED:
+            embedding = query_embedding_batcher.embed(query, timeout=Config.QUERY_EMBEDDING_TIMEOUT_SECONDS)
+        else:
+            logger.info("Executing synchronous embedding generation in thread pool...")
+            embed_result = genai.embed_content(
+                model=Config.EMBEDDING_MODEL_NAME,
+                content=query,
+                task_type="retrieval_query",
+                output_dimensionality=Config.PG_EMBEDDING_DIMENSION 
+            )
+            embedding = embed_result['embedding']
+        if Config.EMBEDDING_CACHE_ENABLED:
+            embedding_cache.set(query, embedding)
+        return embedding
     except Exception as e:
         logger.error(f"Error during synchronous embedding generation: {e}", exc_info=True)
         return None
 
 
 
-def _execute_db_query(sql_query: text, query_vector: list[float]) -> list[str]:
+def _execute_db_query(sql_query: text, query_vector: list[float], collection: str | None = None) -> list[str]:
     """
     Synchronous helper to run the blocking DB query in a separate thread.
     """
     logger.info("Executing synchronous DB query in thread pool...")
     try:
-        with db.engine.connect() as conn:
-            results = conn.execute(sql_query, {"query_vec": str(query_vector)})
+        with db.engine.begin() as conn:
+            apply_search_params(conn)
+            params = {"query_vec": str(query_vector)}
+            if collection:
+                params["collection"] = collection
+            results = conn.execute(sql_query, params)
             context_chunks = [row[0] for row in results.fetchall()]
         logger.info(f"DB query thread pool task finished, found {len(context_chunks)} chunks.")
         return context_chunks
@@ -55,30 +93,94 @@ def _execute_db_query(sql_query: text, query_vector: list[float]) -> list[str]:
         return []
 
 
-async def retrieve_pgvector_documents(query: str) -> dict:
+def _fetch_chunk_contents_sync(ids: list[int]) -> dict[int, str]:
+    with db.engine.connect() as conn:
+        rows = conn.execute(text(chunk_contents_query(":ids")), {"ids": ids}).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+async def _search_mirror(query_vector: list[float], collection: str | None) -> list[str]:
+    """Ranks chunks in the in-process vector mirror and fetches only their text from the database."""
+    ids = vector_mirror.search(query_vector, Config.RETRIEVAL_TOP_K, collection)
+    if not ids:
+        return []
+    if Config.RETRIEVAL_BACKEND == "asyncpg":
+        contents = await vector_search.fetch_contents(ids)
+    else:
+        contents = await asyncio.to_thread(_fetch_chunk_contents_sync, ids)
+    return [contents[chunk_id] for chunk_id in ids if chunk_id in contents]
+
+
+async def _search_chunks(query_vector: list[float], collection: str | None = None) -> list[str]:
+    """Similarity search, shared with any identical search already in flight in this worker."""
+    key = flight_key(pack_vector(query_vector).hex(), collection)
+    return await retrieval_flight.do_async(key, lambda: _run_search(query_vector, collection))
+
+
+async def _run_search(query_vector: list[float], collection: str | None) -> list[str]:
+    """Runs the similarity search on the vector mirror or the configured backend, falling back to SQLAlchemy."""
+    if vector_mirror.ready():
+        try:
+            return await _search_mirror(query_vector, collection)
+        except Exception as e:
+            logger.error(f"Vector mirror search failed, falling back to the database: {e}", exc_info=True)
+
+    if Config.RETRIEVAL_BACKEND == "asyncpg":
+        try:
+            return await vector_search.search(query_vector, collection)
+        except Exception as e:
+            logger.error(f"asyncpg similarity search failed, falling back to SQLAlchemy: {e}", exc_info=True)
+
+    sql_query = text(similarity_query(":query_vec", ":collection" if collection else None))
+    return await asyncio.to_thread(_execute_db_query, sql_query, query_vector, collection)
+
+
+def _requested_collection(tool_context: ToolContext | None, collection: str | None) -> tuple[str | None, bool]:
+    """
+    Returns (collection to search, whether it was chosen by the model). A collection
+    the /ask request was scoped to always wins over the one the model asked for.
+    """
+    scoped = tool_context.state.get(COLLECTION_STATE_KEY) if tool_context else None
+    if scoped:
+        return scoped, False
+    try:
+        return normalize_collection(collection), True
+    except ValueError:
+        logger.warning(f"Ignoring invalid collection '{collection}' requested by the model.")
+        return None, False
+
+
+async def retrieve_pgvector_documents(
+    query: str, tool_context: ToolContext, collection: Optional[str] = None
+) -> dict:
     """
     (Async) Retrieves relevant document chunks from the pgvector database based on a user query.
-    This function runs both blocking I/O calls (embedding and DB query) in separate threads.
+    The embedding call runs in a thread; the DB query runs on the async retrieval backend.
+
+    Args:
+        query: The question or keywords to search the knowledge base for.
+        collection: Optional ERP module to search, e.g. "fees", "library" or "exam_control".
+            Leave empty to search the whole knowledge base.
     """
-    logger.info(f"Async Tool executing: retrieve_pgvector_documents with query: '{query}'")
+    collection, model_chosen = _requested_collection(tool_context, collection)
+    logger.info(
+        f"Async Tool executing: retrieve_pgvector_documents with query: '{query}'"
+        f" (collection: {collection or 'all'})"
+    )
     try:
-        query_vector = await asyncio.to_thread(_get_sync_embedding, query)
-
-        if query_vector is None:
-            raise Exception("Embedding generation failed. Check error logs.")
-
-        sql_query = text(
-            f"""
-            SELECT {Config.PG_CONTENT_COLUMN} 
-            FROM {Config.PG_TABLE_NAME}
-            ORDER BY {Config.PG_VECTOR_COLUMN} <=> :query_vec 
-            LIMIT 6
-            """
-        )
-        
-        context_chunks = await asyncio.to_thread(
-            _execute_db_query, sql_query, query_vector
-        )
+        with timed(RETRIEVAL_STAGE_SECONDS, stage="total"):
+            with timed(RETRIEVAL_STAGE_SECONDS, stage="query_embedding"):
+                query_vector = await asyncio.to_thread(_get_sync_embedding, query)
+
+            if query_vector is None:
+                raise Exception("Embedding generation failed. Check error logs.")
+
+            with timed(RETRIEVAL_STAGE_SECONDS, stage="vector_search"):
+                context_chunks = await _search_chunks(query_vector, collection)
+                if not context_chunks and model_chosen and collection:
+                    # The model may name a module that has no documents of its own.
+                    logger.info(f"No chunks in collection '{collection}', searching the whole knowledge base.")
+                    context_chunks = await _search_chunks(query_vector)
 
         if not context_chunks:
             logger.warning("PGVector tool ran but found no matching documents.")
@@ -106,17 +208,35 @@ def create_rag_agent(model_instance, name: str) -> Agent:
         model=model_instance,
         name=name,
         instruction=return_instructions_root(),
-        tools=[retrieve_pgvector_documents] 
+        tools=[retrieve_pgvector_documents],
+        before_model_callback=before_model_callback,
+        after_model_callback=after_model_callback
     )
 
 
-agents = {
-    "gemini": create_rag_agent(
-        model_instance=GENAI_MODEL_NAME,
-        name='ask_rag_agent_gemini'
-    ),
-    "openai": create_rag_agent(
-        model_instance=LiteLlm(model=os.getenv("OPENAI_MODEL_NAME", "openai/gpt-4o")),
-        name='ask_rag_agent_openai'
-    )
-}
\ No newline at end of file
+def _lite_llm(model: str):
+    # litellm is a large import tree; only deployments that use these agents pay for it.
+    from google.adk.models.lite_llm import LiteLlm
+    return LiteLlm(model=model)
+
+
+# Model of each agent, resolved when the agent is first used.
+AGENT_MODELS = {
+    "gemini": lambda: GENAI_MODEL_NAME,
+    "openai": lambda: _lite_llm(os.getenv("OPENAI_MODEL_NAME", "openai/gpt-4o")),
+}
+
+agents = {}
+_agents_lock = threading.Lock()
+
+
+def get_agent(name: str) -> Agent | None:
+    """Returns the agent for a model choice, building it on first use; None if there is no such agent."""
+    rag_agent = agents.get(name)
+    if rag_agent is not None or name not in AGENT_MODELS:
+        return rag_agent
+    with _agents_lock:
+        if name not in agents:
+            agents[name] = create_rag_agent(model_instance=AGENT_MODELS[name](), name=f'ask_rag_agent_{name}')
+            logger.info(f"Agent '{name}' created.")
+    return agents[name]
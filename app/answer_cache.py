@@ -0,0 +1,112 @@
+import logging
+from sqlalchemy import text
+
+from .config import Config
+from .models import db
+from .vector_storage import pgvector_version
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+# hnsw.iterative_scan: the index scan continues until enough rows pass the filters.
+_ITERATIVE_SCAN_PGVECTOR_VERSION = (0, 8)
+_iterative_scan = None
+
+# The knowledge base version is read in the same round trip as the lookup so the
+# answer generated after a miss can be stored under the version it was based on.
+# {distance} is the ORDER BY expression: the plain distance uses the HNSW index,
+# "+ 0" hides it from the planner for an exact scan.
+_LOOKUP_SQL = """
+    SELECT v.version, hit.answer, hit.similarity
+    FROM (
+        SELECT COALESCE((SELECT version FROM knowledge_base_state WHERE id = 1), 1) AS version
+    ) v
+    LEFT JOIN LATERAL (
+        SELECT answer, 1 - (question_embedding <=> CAST(:query_vec AS vector)) AS similarity
+        FROM answer_cache
+        WHERE model = :model
+          AND collection IS NOT DISTINCT FROM :collection
+          AND kb_version = v.version
+          AND created_at > now() - make_interval(secs => :max_age)
+        ORDER BY {distance}
+        LIMIT 1
+    ) hit ON true
+    """
+_ANN_LOOKUP_SQL = text(_LOOKUP_SQL.format(distance="question_embedding <=> CAST(:query_vec AS vector)"))
+_EXACT_LOOKUP_SQL = text(_LOOKUP_SQL.format(distance="(question_embedding <=> CAST(:query_vec AS vector)) + 0"))
+
+_STORE_SQL = text(
+    """
+    INSERT INTO answer_cache (question_embedding, model, collection, kb_version, answer)
+    VALUES (CAST(:query_vec AS vector), :model, :collection, :kb_version, :answer)
+    """
+)
+
+
+def _iterative_scan_supported(conn) -> bool:
+    global _iterative_scan
+    if _iterative_scan is None:
+        version = pgvector_version(conn)
+        _iterative_scan = version is not None and version >= _ITERATIVE_SCAN_PGVECTOR_VERSION
+    return _iterative_scan
+
+
+def _find_answer(conn, question_vector: list[float], model: str, collection: str | None):
+    """
+    (kb version, closest answer, similarity) of the entries for this model,
+    collection and version. Must run inside a transaction (SET LOCAL semantics).
+
+    The filters apply after the HNSW scan, so when other models or collections
+    dominate the table the ef_search candidates can all be filtered out. With
+    pgvector >= 0.8 an iterative scan keeps going until a row passes; older
+    versions repeat a miss as an exact scan of the matching entries.
+    """
+    iterative = _iterative_scan_supported(conn)
+    conn.execute(text("SELECT set_config('hnsw.ef_search', :value, true)"),
+                 {"value": str(Config.ANSWER_CACHE_EF_SEARCH)})
+    if iterative:
+        conn.execute(text("SELECT set_config('hnsw.iterative_scan', 'strict_order', true)"))
+    params = {
+        "query_vec": str(question_vector),
+        "model": model,
+        "collection": collection,
+        "max_age": Config.ANSWER_CACHE_MAX_AGE_SECONDS,
+    }
+    row = conn.execute(_ANN_LOOKUP_SQL, params).one()
+    if row[1] is None and not iterative:
+        row = conn.execute(_EXACT_LOOKUP_SQL, params).one()
+    return row
+
+
+def lookup_answer(question_vector: list[float], model: str, collection: str | None = None) -> tuple[str | None, int | None]:
+    """
+    Returns (cached answer or None, current knowledge base version).
+    A hit requires cosine similarity >= ANSWER_CACHE_SIMILARITY_THRESHOLD and the
+    same collection scope.
+    """
+    try:
+        with db.engine.begin() as conn:
+            version, answer, similarity = _find_answer(conn, question_vector, model, collection)
+        if answer is not None and similarity >= Config.ANSWER_CACHE_SIMILARITY_THRESHOLD:
+            app_logger.info(f"Answer cache hit for model '{model}' (similarity {similarity:.4f}).")
+            return answer, version
+        return None, version
+    except Exception as e:
+        error_logger.error(f"Answer cache lookup failed: {e}", exc_info=True)
+        return None, None
+
+
+def store_answer(question_vector: list[float], model: str, kb_version: int, answer: str,
+                 collection: str | None = None) -> None:
+    """Caches a final answer under the knowledge base version it was generated against."""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(_STORE_SQL, {
+                "query_vec": str(question_vector),
+                "model": model,
+                "collection": collection,
+                "kb_version": kb_version,
+                "answer": answer,
+            })
+    except Exception as e:
+        error_logger.error(f"Failed to store answer in cache: {e}", exc_info=True)
@@ -0,0 +1,171 @@
+import hashlib
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from .config import Config
+from .metrics import EMBEDDING_CACHE_LOOKUPS
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Small thread-safe in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_memcached_client = None
+_memcached_lock = threading.Lock()
+
+
+def _parse_memcached_servers(url: str) -> list[tuple[str, int]]:
+    """Parses 'memcached://host:port[,host:port]' into a server list."""
+    parsed = urlparse(url)
+    if parsed.scheme != "memcached":
+        return []
+    servers = []
+    for server in parsed.netloc.split(","):
+        host, _, port = server.partition(":")
+        if host:
+            servers.append((host, int(port or 11211)))
+    return servers
+
+
+def get_memcached_client():
+    """
+    Returns the process-wide memcached client, or None if MEMCACHED_URL is not a
+    memcached:// URL. Errors are swallowed by the client (ignore_exc) so a cache
+    outage degrades to misses instead of failed requests.
+    """
+    global _memcached_client
+    if _memcached_client is not None:
+        return _memcached_client or None
+    with _memcached_lock:
+        if _memcached_client is None:
+            servers = _parse_memcached_servers(Config.MEMCACHED_URL)
+            if not servers:
+                _memcached_client = False
+            else:
+                from pymemcache.client.hash import HashClient
+                _memcached_client = HashClient(
+                    servers,
+                    connect_timeout=Config.MEMCACHED_TIMEOUT_SECONDS,
+                    timeout=Config.MEMCACHED_TIMEOUT_SECONDS,
+                    ignore_exc=True,
+                    no_delay=True,
+                    retry_attempts=1,
+                    dead_timeout=30,
+                )
+    return _memcached_client or None
+
+
+def normalize_query(query: str) -> str:
+    """Case-folds and collapses whitespace so trivially different questions share a key."""
+    return " ".join(query.casefold().split())
+
+
+def pack_vector(vector: list[float]) -> bytes:
+    """Encodes a vector as little-endian float32 bytes."""
+    packed = array('f', vector)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_vector(data: bytes) -> list[float]:
+    """Decodes bytes produced by pack_vector."""
+    packed = array('f')
+    packed.frombytes(data)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tolist()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings: an in-process LRU in front of memcached.
+    Keys cover the embedding model, output dimensionality and normalized query
+    text; values are stored in memcached as packed float32.
+    """
+
+    def __init__(self, local_size: int, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUCache(local_size, ttl_seconds)
+        self._lookups = {
+            result: EMBEDDING_CACHE_LOOKUPS.labels(result=result) for result in ("local_hit", "remote_hit", "miss")
+        }
+
+    def key(self, query: str) -> str:
+        raw = f"{Config.EMBEDDING_MODEL_NAME}|{Config.PG_EMBEDDING_DIMENSION}|{normalize_query(query)}"
+        return "emb:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, query: str) -> list[float] | None:
+        key = self.key(query)
+        vector = self.local.get(key)
+        if vector is not None:
+            self._lookups["local_hit"].inc()
+            return vector
+
+        client = get_memcached_client()
+        data = client.get(key) if client else None
+        if data and len(data) == Config.PG_EMBEDDING_DIMENSION * 4:
+            vector = unpack_vector(data)
+            self.local.set(key, vector)
+            self._lookups["remote_hit"].inc()
+            return vector
+
+        self._lookups["miss"].inc()
+        return None
+
+    def set(self, query: str, vector: list[float]) -> None:
+        key = self.key(query)
+        self.local.set(key, vector)
+        client = get_memcached_client()
+        if client:
+            client.set(key, pack_vector(vector), expire=self.ttl_seconds, noreply=True)
+
+
+embedding_cache = EmbeddingCache(
+    local_size=Config.EMBEDDING_CACHE_LOCAL_SIZE,
+    ttl_seconds=Config.EMBEDDING_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,131 @@
+import hashlib
+import io
+import logging
+import struct
+import uuid
+
+from .config import Config
+from .models import DocumentChunk, DEFAULT_COLLECTION
+from .vector_index import storage_type
+
+error_logger = logging.getLogger('error')
+
+COPY_COLUMNS = ("content", "content_hash", "embedding", "document_id", "collection")
+
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_INT16 = struct.Struct(">h")
+_INT32 = struct.Struct(">i")
+
+
+def chunk_content_hash(content: str) -> str:
+    """Hash used to recognise unchanged chunks across re-ingestions."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def encode_vector_binary(vector: list[float], storage: str = "vector") -> bytes:
+    """
+    pgvector's binary wire format: int16 dimension, int16 unused, then
+    big-endian float4 values (vector) or float2 values (halfvec).
+    """
+    value_format = "e" if storage == "halfvec" else "f"
+    return struct.pack(f">hh{len(vector)}{value_format}", len(vector), 0, *vector)
+
+
+def encode_copy_binary(rows) -> io.BytesIO:
+    """Encodes (content, content_hash, embedding, document_id, collection) rows as a PostgreSQL binary COPY stream."""
+    buf = io.BytesIO()
+    buf.write(_COPY_SIGNATURE)
+    buf.write(_INT32.pack(0))  # flags
+    buf.write(_INT32.pack(0))  # header extension length
+    field_count = _INT16.pack(len(COPY_COLUMNS))
+    storage = storage_type()
+    for content, content_hash, embedding, document_id, collection in rows:
+        buf.write(field_count)
+        content_bytes = content.encode("utf-8")
+        buf.write(_INT32.pack(len(content_bytes)))
+        buf.write(content_bytes)
+        hash_bytes = content_hash.encode("ascii")
+        buf.write(_INT32.pack(len(hash_bytes)))
+        buf.write(hash_bytes)
+        vector_bytes = encode_vector_binary(embedding, storage)
+        buf.write(_INT32.pack(len(vector_bytes)))
+        buf.write(vector_bytes)
+        buf.write(_INT32.pack(16))
+        buf.write(uuid.UUID(str(document_id)).bytes)
+        collection_bytes = collection.encode("utf-8")
+        buf.write(_INT32.pack(len(collection_bytes)))
+        buf.write(collection_bytes)
+    buf.write(_INT16.pack(-1))
+    buf.seek(0)
+    return buf
+
+
+def _copy_rows(cursor, rows) -> None:
+    cursor.copy_expert(
+        f"COPY {Config.PG_TABLE_NAME} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+        encode_copy_binary(rows)
+    )
+
+
+def _executemany_rows(cursor, rows) -> None:
+    from psycopg2.extras import execute_values
+    execute_values(
+        cursor,
+        f"INSERT INTO {Config.PG_TABLE_NAME} ({', '.join(COPY_COLUMNS)}) VALUES %s",
+        [
+            (content, content_hash, str(embedding), str(document_id), collection)
+            for content, content_hash, embedding, document_id, collection in rows
+        ],
+        template=f"(%s, %s, %s::{storage_type()}, %s::uuid, %s)",
+        page_size=Config.CHUNK_WRITE_PAGE_SIZE
+    )
+
+
+def _orm_rows(session, rows) -> None:
+    session.bulk_save_objects([
+        DocumentChunk(
+            content=content, content_hash=content_hash, embedding=embedding,
+            document_id=document_id, collection=collection
+        )
+        for content, content_hash, embedding, document_id, collection in rows
+    ])
+
+
+def write_chunks(session, document_id, chunks: list[str], embeddings: list[list[float]],
+                 mode: str | None = None, collection: str = DEFAULT_COLLECTION) -> None:
+    """
+    Inserts chunk rows inside the session's current transaction.
+    Modes (CHUNK_WRITE_MODE): "copy" streams a binary COPY and falls back to
+    "executemany" (batched multi-row INSERT) if COPY fails; "orm" uses
+    bulk_save_objects.
+    """
+    mode = mode or Config.CHUNK_WRITE_MODE
+    rows = [
+        (content, chunk_content_hash(content), embedding, document_id, collection)
+        for content, embedding in zip(chunks, embeddings)
+    ]
+    if not rows:
+        return
+
+    if mode == "orm":
+        _orm_rows(session, rows)
+        return
+
+    if mode == "copy":
+        try:
+            # The savepoint keeps the surrounding transaction usable if COPY fails.
+            with session.begin_nested():
+                cursor = session.connection().connection.cursor()
+                try:
+                    _copy_rows(cursor, rows)
+                finally:
+                    cursor.close()
+            return
+        except Exception as e:
+            error_logger.warning(f"Binary COPY of {len(rows)} chunks failed, falling back to executemany: {e}")
+
+    cursor = session.connection().connection.cursor()
+    try:
+        _executemany_rows(cursor, rows)
+    finally:
+        cursor.close()
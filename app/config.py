@@ -1,6 +1,7 @@
 # file: config.py
 import os
 import secrets
+import tempfile
 import logging
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -27,8 +28,12 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES_HOURS", "1")))
 
     
+    # Memcached (shared by rate limiting and the caches)
+    MEMCACHED_URL = os.getenv("MEMCACHED_URL", "memcached://memcached:11211")
+    MEMCACHED_TIMEOUT_SECONDS = float(os.getenv("MEMCACHED_TIMEOUT_SECONDS", "0.2"))
+
     # Rate Limiting
-    RATELIMIT_STORAGE_URI = os.getenv("MEMCACHED_URL","memcached://memcached:11211")
+    RATELIMIT_STORAGE_URI = MEMCACHED_URL
 
     # Database
     DATABASE_URL = os.getenv("DATABASE_URL")
@@ -52,6 +57,159 @@ class Config:
     PG_VECTOR_COLUMN = os.getenv("PG_VECTOR_COLUMN", "embedding") 
     PG_CONTENT_COLUMN = os.getenv("PG_CONTENT_COLUMN", "content") 
     PG_EMBEDDING_DIMENSION = int(os.getenv("PG_EMBEDDING_DIMENSION", "768"))
+    # Storage precision of chunk embeddings: "vector" (float32) or "halfvec" (float16, half the size).
+    # Changing it for an existing table needs `python -m app.vector_storage migrate`.
+    PG_VECTOR_STORAGE = os.getenv("PG_VECTOR_STORAGE", "vector").lower()
+
+    # Ingestion embedding batches (provider limits: 100 texts per request)
+    EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "100"))
+    EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", "60000"))
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+    EMBEDDING_RETRY_BASE_SECONDS = float(os.getenv("EMBEDDING_RETRY_BASE_SECONDS", "1"))
+    EMBEDDING_RETRY_MAX_SECONDS = float(os.getenv("EMBEDDING_RETRY_MAX_SECONDS", "30"))
+
+    # Multi-process PDF text extraction (0 workers = one per CPU, 1 = disabled)
+    PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "200"))
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))
+
+    # Bounded queue depth (in batches) between ingestion pipeline stages
+    INGESTION_QUEUE_DEPTH = int(os.getenv("INGESTION_QUEUE_DEPTH", "4"))
+
+    # Persistent content-addressed store of document embeddings
+    EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() == "true"
+    # Prune keeps entries younger than this: a running ingestion stores them before its chunks commit
+    EMBEDDING_STORE_PRUNE_GRACE_SECONDS = float(os.getenv("EMBEDDING_STORE_PRUNE_GRACE_SECONDS", "86400"))
+
+    # How ingestion writes chunk rows: "copy" (binary COPY), "executemany" or "orm"
+    CHUNK_WRITE_MODE = os.getenv("CHUNK_WRITE_MODE", "copy").lower()
+    CHUNK_WRITE_PAGE_SIZE = int(os.getenv("CHUNK_WRITE_PAGE_SIZE", "500"))
+
+    # Query embedding cache (in-process LRU in front of memcached)
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_LOCAL_SIZE = int(os.getenv("EMBEDDING_CACHE_LOCAL_SIZE", "1024"))
+    EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+
+    # Micro-batching of retrieval-time query embeddings: queries arriving within the window of
+    # the first queued one (up to the max size) share one embed_content call.
+    QUERY_EMBEDDING_BATCHING_ENABLED = os.getenv("QUERY_EMBEDDING_BATCHING_ENABLED", "true").lower() == "true"
+    QUERY_EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("QUERY_EMBEDDING_BATCH_WINDOW_MS", "5"))
+    QUERY_EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("QUERY_EMBEDDING_BATCH_MAX_SIZE", "32"))
+    QUERY_EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("QUERY_EMBEDDING_BATCH_CONCURRENCY", "4"))
+    QUERY_EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("QUERY_EMBEDDING_TIMEOUT_SECONDS", "30"))
+
+    # Ingestion job queue: "embedded" runs workers inside each API process,
+    # "external" leaves ingestion to `python -m app.worker`.
+    INGESTION_WORKER_MODE = os.getenv("INGESTION_WORKER_MODE", "embedded").lower()
+    INGESTION_WORKER_CONCURRENCY = int(os.getenv("INGESTION_WORKER_CONCURRENCY", "2"))
+    INGESTION_POLL_INTERVAL_SECONDS = float(os.getenv("INGESTION_POLL_INTERVAL_SECONDS", "5"))
+    INGESTION_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("INGESTION_VISIBILITY_TIMEOUT_SECONDS", "1800"))
+    INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+    INGESTION_RETRY_BASE_SECONDS = float(os.getenv("INGESTION_RETRY_BASE_SECONDS", "30"))
+    INGESTION_RETRY_MAX_SECONDS = float(os.getenv("INGESTION_RETRY_MAX_SECONDS", "900"))
+
+    # Single-flight coalescing of identical concurrent work (query embeddings, retrievals and,
+    # optionally, answers): per worker always, across workers through a memcached lease whose
+    # holder publishes its result for SINGLE_FLIGHT_RESULT_TTL_SECONDS.
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    SINGLE_FLIGHT_CROSS_WORKER = os.getenv("SINGLE_FLIGHT_CROSS_WORKER", "true").lower() == "true"
+    SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "30"))
+    SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "20"))
+    SINGLE_FLIGHT_POLL_SECONDS = float(os.getenv("SINGLE_FLIGHT_POLL_SECONDS", "0.05"))
+    SINGLE_FLIGHT_RESULT_TTL_SECONDS = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL_SECONDS", "10"))
+    # Also share one agent run among identical concurrent /ask questions (off by default:
+    # like cached answers, a shared answer ignores the followers' session history)
+    ANSWER_COALESCING_ENABLED = os.getenv("ANSWER_COALESCING_ENABLED", "false").lower() == "true"
+
+    # Semantic answer cache for /ask (off by default: cached answers ignore session history)
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    ANSWER_CACHE_MAX_AGE_SECONDS = int(os.getenv("ANSWER_CACHE_MAX_AGE_SECONDS", "86400"))
+    # HNSW candidates per lookup; the model, collection and version filters apply after the index scan
+    ANSWER_CACHE_EF_SEARCH = int(os.getenv("ANSWER_CACHE_EF_SEARCH", "200"))
+
+    # Session metadata cache (in-process LRU in front of memcached): lets /ask check that a
+    # session exists without a database round trip. A session deleted by another worker can
+    # still pass that check for up to SESSION_CACHE_LOCAL_TTL_SECONDS.
+    SESSION_CACHE_ENABLED = os.getenv("SESSION_CACHE_ENABLED", "true").lower() == "true"
+    SESSION_CACHE_LOCAL_SIZE = int(os.getenv("SESSION_CACHE_LOCAL_SIZE", "4096"))
+    SESSION_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("SESSION_CACHE_LOCAL_TTL_SECONDS", "30"))
+    SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "86400"))
+
+    # Session compaction: once a session has more than SESSION_COMPACTION_MAX_TURNS turns, a
+    # background thread replaces all but the last SESSION_COMPACTION_KEEP_TURNS with one summary
+    # event and blanks the retrieved context of tool results older than SESSION_KEEP_TOOL_OUTPUT_TURNS.
+    SESSION_COMPACTION_ENABLED = os.getenv("SESSION_COMPACTION_ENABLED", "true").lower() == "true"
+    SESSION_COMPACTION_MAX_TURNS = int(os.getenv("SESSION_COMPACTION_MAX_TURNS", "12"))
+    SESSION_COMPACTION_KEEP_TURNS = int(os.getenv("SESSION_COMPACTION_KEEP_TURNS", "4"))
+    SESSION_KEEP_TOOL_OUTPUT_TURNS = int(os.getenv("SESSION_KEEP_TOOL_OUTPUT_TURNS", "1"))
+    # "llm" (summarized by SESSION_COMPACTION_MODEL) or "extractive" (condensed transcript)
+    SESSION_COMPACTION_SUMMARIZER = os.getenv("SESSION_COMPACTION_SUMMARIZER", "llm").lower()
+    SESSION_COMPACTION_MODEL = os.getenv("SESSION_COMPACTION_MODEL", os.getenv("GOOGLE_MODEL_NAME", ""))
+    SESSION_COMPACTION_SUMMARY_MAX_CHARS = int(os.getenv("SESSION_COMPACTION_SUMMARY_MAX_CHARS", "2000"))
+
+    # Retrieval
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+    # Backend for the agent's similarity search: "asyncpg" (native async pool) or "sqlalchemy"
+    RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "asyncpg").lower()
+    ASYNC_DB_POOL_MIN_SIZE = int(os.getenv("ASYNC_DB_POOL_MIN_SIZE", "1"))
+    ASYNC_DB_POOL_MAX_SIZE = int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", "10"))
+    ASYNC_DB_COMMAND_TIMEOUT_SECONDS = float(os.getenv("ASYNC_DB_COMMAND_TIMEOUT_SECONDS", "10"))
+
+    # How retrieval searches: "direct" (ANN index over the embeddings), "binary_rescore"
+    # (Hamming-distance candidate pass over binary-quantized embeddings) or "matryoshka"
+    # (candidate pass over the first RETRIEVAL_PREFIX_DIMENSION dimensions); the two-stage
+    # modes re-rank their candidates by the full embeddings.
+    RETRIEVAL_SEARCH_MODE = os.getenv("RETRIEVAL_SEARCH_MODE", "direct").lower()
+    RETRIEVAL_RERANK_CANDIDATES = int(os.getenv("RETRIEVAL_RERANK_CANDIDATES", "200"))
+    RETRIEVAL_PREFIX_DIMENSION = int(os.getenv("RETRIEVAL_PREFIX_DIMENSION", "256"))
+
+    # In-process mirror of the chunk vectors (exact cosine top-k in NumPy, memory-mapped
+    # snapshots shared by the workers of a host); retrieval then only fetches chunk text.
+    VECTOR_MIRROR_ENABLED = os.getenv("VECTOR_MIRROR_ENABLED", "false").lower() == "true"
+    VECTOR_MIRROR_DIR = os.getenv("VECTOR_MIRROR_DIR", os.path.join(tempfile.gettempdir(), "college_rag_vector_mirror"))
+    VECTOR_MIRROR_REFRESH_SECONDS = float(os.getenv("VECTOR_MIRROR_REFRESH_SECONDS", "5"))
+
+    # ANN index on the vector column: "hnsw", "ivfflat" or "none" (exact scan)
+    PG_VECTOR_INDEX_TYPE = os.getenv("PG_VECTOR_INDEX_TYPE", "hnsw").lower()
+    PG_HNSW_M = int(os.getenv("PG_HNSW_M", "16"))
+    PG_HNSW_EF_CONSTRUCTION = int(os.getenv("PG_HNSW_EF_CONSTRUCTION", "64"))
+    PG_HNSW_EF_SEARCH = int(os.getenv("PG_HNSW_EF_SEARCH", "40"))
+    # 0 lets the index builder derive the list count from the table size
+    PG_IVFFLAT_LISTS = int(os.getenv("PG_IVFFLAT_LISTS", "0"))
+    PG_IVFFLAT_PROBES = int(os.getenv("PG_IVFFLAT_PROBES", "10"))
+    # Optional override for index builds, e.g. "1GB"
+    PG_INDEX_MAINTENANCE_WORK_MEM = os.getenv("PG_INDEX_MAINTENANCE_WORK_MEM", "")
+
+    # Prometheus metrics at /metrics, summed over the worker processes of a host through
+    # files in PROMETHEUS_MULTIPROC_DIR (wiped when the host or container starts).
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "college_rag_metrics"))
+    # If set, /metrics requires "Authorization: Bearer <token>"
+    METRICS_BEARER_TOKEN = os.getenv("METRICS_BEARER_TOKEN", "")
+    # Port of the standalone ingestion worker's metrics server (0 = off)
+    METRICS_WORKER_PORT = int(os.getenv("METRICS_WORKER_PORT", "9100"))
+
+    # Logging: files in LOG_DIR rotate at LOG_MAX_BYTES, and rotation is safe with several
+    # worker processes. With LOG_QUEUE_ENABLED, handler I/O runs on a background thread.
+    LOG_DIR = os.getenv("LOG_DIR", "logs")
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", "10485760"))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"
+    # "text" or "json" (one JSON object per line)
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+    # Fraction of INFO/DEBUG records kept per logger, e.g. "access=0.1"; warnings are always kept
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+    # Start-up: every worker runs db.create_all() and the schema upgrades, one at a time (workers
+    # starting together skip theirs). Set false when `python -m app.schema` runs at deploy time.
+    SCHEMA_SETUP_ON_STARTUP = os.getenv("SCHEMA_SETUP_ON_STARTUP", "true").lower() == "true"
+    # Warm-up before /health reports ready: database pools, ANN index pages (pg_prewarm),
+    # a sample search and the runners of WARMUP_MODELS. Other agents are built on first use.
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_MODELS = [name.strip() for name in os.getenv("WARMUP_MODELS", "gemini").split(",") if name.strip()]
+    WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
 
 
     if not SECRET_KEY:
@@ -0,0 +1,118 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import google.generativeai as genai
+
+from .config import Config
+from .exceptions import ExternalApiError
+from .metrics import QUERY_EMBEDDING_BATCH_SIZE, QUERY_EMBEDDING_QUEUE_DELAY_SECONDS
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+
+class _PendingQuery:
+    __slots__ = ("text", "future", "enqueued_at")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class QueryEmbeddingBatcher:
+    """
+    Micro-batches retrieval-time query embeddings. Queries that arrive within
+    QUERY_EMBEDDING_BATCH_WINDOW_MS of the first queued one (up to
+    QUERY_EMBEDDING_BATCH_MAX_SIZE) are sent as one retrieval_query
+    embed_content call, and each caller's future gets its own vector. Batches
+    are dispatched on a small pool, so the next batch collects while earlier
+    ones are in flight.
+    """
+
+    def __init__(self, window_ms: float, max_size: int, concurrency: int):
+        self.window_seconds = window_ms / 1000
+        self.max_size = max(1, min(max_size, Config.EMBEDDING_BATCH_MAX_ITEMS))
+        self.concurrency = max(1, concurrency)
+        self._queue = queue.Queue()
+        self._executor = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="query-embedding")
+                thread = threading.Thread(target=self._collect, name="query-embedding-batcher", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def submit(self, text: str) -> Future:
+        """Queues a query; the future resolves to its embedding."""
+        self._ensure_started()
+        pending = _PendingQuery(text)
+        self._queue.put(pending)
+        return pending.future
+
+    def embed(self, text: str, timeout: float | None = None) -> list[float]:
+        """Blocking helper: embeds one query as part of the next batch."""
+        return self.submit(text).result(timeout)
+
+    def _collect(self) -> None:
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            chars = len(first.text)
+            deadline = first.enqueued_at + self.window_seconds
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if chars + len(pending.text) > Config.EMBEDDING_BATCH_MAX_CHARS:
+                    self._executor.submit(self._dispatch, batch)
+                    batch, chars = [], 0
+                batch.append(pending)
+                chars += len(pending.text)
+            self._executor.submit(self._dispatch, batch)
+
+    def _record(self, batch: list[_PendingQuery], dispatched_at: float) -> None:
+        QUERY_EMBEDDING_BATCH_SIZE.observe(len(batch))
+        for pending in batch:
+            QUERY_EMBEDDING_QUEUE_DELAY_SECONDS.observe(dispatched_at - pending.enqueued_at)
+
+    def _dispatch(self, batch: list[_PendingQuery]) -> None:
+        dispatched_at = time.monotonic()
+        self._record(batch, dispatched_at)
+        try:
+            result = genai.embed_content(
+                model=Config.EMBEDDING_MODEL_NAME,
+                content=[pending.text for pending in batch],
+                task_type="retrieval_query",
+                output_dimensionality=Config.PG_EMBEDDING_DIMENSION
+            )
+            embeddings = result['embedding']
+            if len(embeddings) != len(batch):
+                raise ExternalApiError(f"Embedding service returned {len(embeddings)} vectors for {len(batch)} queries.")
+        except Exception as e:
+            error_logger.error(f"Query embedding batch of {len(batch)} failed: {e}")
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+        for pending, embedding in zip(batch, embeddings):
+            pending.future.set_result(embedding)
+
+
+query_embedding_batcher = QueryEmbeddingBatcher(
+    window_ms=Config.QUERY_EMBEDDING_BATCH_WINDOW_MS,
+    max_size=Config.QUERY_EMBEDDING_BATCH_MAX_SIZE,
+    concurrency=Config.QUERY_EMBEDDING_BATCH_CONCURRENCY
+)
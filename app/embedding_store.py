@@ -0,0 +1,101 @@
+"""
+Content-addressed store of document embeddings keyed by
+(embedding model, output dimensionality, sha256 of the chunk text).
+
+Maintenance:
+
+    python -m app.embedding_store prune   # drop entries no DocumentChunk references (older than the grace period)
+    python -m app.embedding_store stats
+"""
+import argparse
+import logging
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from .config import Config
+from .models import db, EmbeddingStoreEntry
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+LOOKUP_BATCH_SIZE = 1000
+
+
+def lookup_embeddings(hashes: list[str], model_name: str, dimension: int) -> dict[str, list[float]]:
+    """Returns the stored embeddings for whichever of the given text hashes are present."""
+    found = {}
+    unique_hashes = list(dict.fromkeys(hashes))
+    with db.engine.connect() as conn:
+        for start in range(0, len(unique_hashes), LOOKUP_BATCH_SIZE):
+            rows = conn.execute(
+                select(EmbeddingStoreEntry.text_hash, EmbeddingStoreEntry.embedding).where(
+                    EmbeddingStoreEntry.model_name == model_name,
+                    EmbeddingStoreEntry.dimension == dimension,
+                    EmbeddingStoreEntry.text_hash.in_(unique_hashes[start:start + LOOKUP_BATCH_SIZE])
+                )
+            )
+            for text_hash, embedding in rows:
+                found[text_hash] = embedding.tolist()
+    return found
+
+
+def store_embeddings(embeddings: dict[str, list[float]], model_name: str, dimension: int) -> None:
+    """Writes new entries; entries stored concurrently by another job are left as they are."""
+    if not embeddings:
+        return
+    statement = insert(EmbeddingStoreEntry).values([
+        {"model_name": model_name, "dimension": dimension, "text_hash": text_hash, "embedding": embedding}
+        for text_hash, embedding in embeddings.items()
+    ]).on_conflict_do_nothing()
+    with db.engine.begin() as conn:
+        conn.execute(statement)
+
+
+def prune_embedding_store(grace_seconds: float | None = None) -> int:
+    """
+    Deletes entries whose text hash is not referenced by any DocumentChunk. Returns the count.
+    Entries younger than grace_seconds (default EMBEDDING_STORE_PRUNE_GRACE_SECONDS) are kept:
+    a running ingestion stores its embeddings before it commits the chunks that reference them.
+    """
+    if grace_seconds is None:
+        grace_seconds = Config.EMBEDDING_STORE_PRUNE_GRACE_SECONDS
+    with db.engine.begin() as conn:
+        result = conn.execute(text(
+            f"""
+            DELETE FROM embedding_store e
+            WHERE e.created_at < now() - make_interval(secs => :grace)
+              AND NOT EXISTS (
+                  SELECT 1 FROM {Config.PG_TABLE_NAME} c WHERE c.content_hash = e.text_hash
+              )
+            """
+        ), {"grace": grace_seconds})
+    app_logger.info(f"Pruned {result.rowcount} unreferenced embedding store entries.")
+    return result.rowcount
+
+
+def embedding_store_stats() -> dict:
+    with db.engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT model_name, dimension, count(*) FROM embedding_store GROUP BY model_name, dimension"
+        )).fetchall()
+    return {f"{model_name}/{dimension}": count for model_name, dimension, count in rows}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Embedding store maintenance.")
+    parser.add_argument("command", choices=("prune", "stats"))
+    parser.add_argument("--grace-seconds", type=float, help="prune: keep entries younger than this")
+    args = parser.parse_args()
+
+    from . import create_app
+    app = create_app(start_background_tasks=False)
+    with app.app_context():
+        if args.command == "prune":
+            print(f"Pruned {prune_embedding_store(args.grace_seconds)} entries.")
+        else:
+            for key, count in embedding_store_stats().items():
+                print(f"{key}: {count}")
+
+
+if __name__ == "__main__":
+    main()
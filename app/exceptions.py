@@ -4,4 +4,8 @@ class AgentError(Exception):
 
 class ExternalApiError(Exception):
     """Custom exception for errors related to external services (like embedding APIs)."""
-    pass
\ No newline at end of file
+    pass
+
+class PermanentIngestionError(Exception):
+    """Custom exception for ingestion failures that a retry cannot fix (e.g. a PDF without text)."""
+    pass
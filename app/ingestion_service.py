@@ -1,15 +1,33 @@
 import requests
-import io
 import fitz 
+import hashlib
 import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import random
+import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterable, Iterator
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, OperationalError
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from flask import current_app
 
 from .config import Config
-from .exceptions import ExternalApiError
-from .models import db, Document, DocumentChunk
+from .exceptions import ExternalApiError, PermanentIngestionError
+from .metrics import INGESTION_STAGE_SECONDS, INGESTION_DOCUMENT_SECONDS, timed
+from .models import db, Document
+from .vector_index import ensure_vector_index
+from .partitions import ensure_collection_partition
+from .chunk_writer import write_chunks, chunk_content_hash
+from .embedding_store import lookup_embeddings, store_embeddings
 
 
 error_logger = logging.getLogger('error')
@@ -17,27 +35,99 @@ app_logger = logging.getLogger('app')
 
 
 
-def get_pdf_text(pdf_url: str) -> str | None:
-    """Downloads a PDF from a URL and extracts its text content using PyMuPDF."""
-    try:
-        response = requests.get(pdf_url, timeout=30)
-        response.raise_for_status() 
-        pdf_file = io.BytesIO(response.content)
-        
-        text = ""
-        with fitz.open(stream=pdf_file, filetype="pdf") as doc:
-            text = "".join(page.get_text() for page in doc)
-        
-        repaired_text = text.encode('utf-16', 'surrogatepass').decode('utf-16')
-        clean_text = repaired_text.replace('\x00', '')
-        
-        return clean_text
-    except requests.exceptions.RequestException as e:
-        error_logger.error(f"Error downloading PDF from {pdf_url}: {e}")
-        return None
-    except Exception as e:
-        error_logger.error(f"Error processing PDF from {pdf_url}: {e}")
-        return None
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+def download_pdf(pdf_url: str, dest_file) -> tuple[int, str]:
+    """
+    Streams a PDF from a URL into an open binary file.
+    Returns the number of bytes written and their sha256 hex digest.
+    """
+    written = 0
+    digest = hashlib.sha256()
+    with requests.get(pdf_url, timeout=30, stream=True) as response:
+        response.raise_for_status()
+        for block in response.iter_content(chunk_size=DOWNLOAD_BLOCK_SIZE):
+            dest_file.write(block)
+            digest.update(block)
+            written += len(block)
+    dest_file.flush()
+    return written, digest.hexdigest()
+
+
+def clean_page_text(text: str) -> str:
+    """Repairs lone surrogates and strips NUL bytes, which PostgreSQL text columns reject."""
+    repaired_text = text.encode('utf-16', 'surrogatepass').decode('utf-16')
+    return repaired_text.replace('\x00', '')
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> list[str]:
+    """Extracts the cleaned text of pages [start, stop). Runs in extraction worker processes."""
+    with fitz.open(pdf_path) as doc:
+        return [clean_page_text(doc[number].get_text()) for number in range(start, stop)]
+
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+
+def pdf_extract_workers() -> int:
+    """Configured extraction process count (0 means one per CPU)."""
+    return Config.PDF_EXTRACT_WORKERS or os.cpu_count() or 1
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by all ingestion jobs in this process. Uses 'spawn' because
+    forking a process that runs gRPC and DB client threads is unsafe.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=pdf_extract_workers(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+    return _extraction_pool
+
+
+def iter_pdf_pages_parallel(pdf_path: str, page_count: int, workers: int) -> Iterator[str]:
+    """
+    Extracts pages across the process pool: each task opens the file itself and
+    returns a contiguous page range. Yields page texts in order, keeping at most
+    two tasks per worker in flight so memory stays bounded.
+    """
+    pool = get_extraction_pool()
+    pages_per_task = max(1, min(Config.PDF_PAGES_PER_TASK, -(-page_count // workers)))
+    ranges = iter((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+
+    in_flight = deque()
+    for start, stop in ranges:
+        in_flight.append(pool.submit(extract_page_range, pdf_path, start, stop))
+        if len(in_flight) >= workers * 2:
+            break
+    while in_flight:
+        yield from in_flight.popleft().result()
+        next_range = next(ranges, None)
+        if next_range:
+            in_flight.append(pool.submit(extract_page_range, pdf_path, *next_range))
+
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[str]:
+    """
+    Yields the cleaned text of each page of a PDF file, in order. Documents with at
+    least PDF_PARALLEL_MIN_PAGES pages are extracted by a process pool.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        workers = pdf_extract_workers()
+        if workers <= 1 or page_count < Config.PDF_PARALLEL_MIN_PAGES:
+            for page in doc:
+                yield clean_page_text(page.get_text())
+            return
+
+    app_logger.info(f"Extracting {page_count} pages with {workers} processes.")
+    yield from iter_pdf_pages_parallel(pdf_path, page_count, workers)
 
 
 def get_text_chunks(text: str, chunk_size: int, chunk_overlap: int) -> list[str]:
@@ -51,84 +141,454 @@ def get_text_chunks(text: str, chunk_size: int, chunk_overlap: int) -> list[str]
     return chunks
 
 
+def iter_text_chunks(pages: Iterable[str], chunk_size: int, chunk_overlap: int) -> Iterator[str]:
+    """
+    Incrementally chunks a stream of page texts. Text is buffered until it spans
+    several chunks; all but the last chunk are emitted and the last one is kept as
+    the start of the buffer, since it may continue on the next page.
+    """
+    flush_at = chunk_size * 8
+    buffer = ""
+    for page_text in pages:
+        buffer += page_text
+        if len(buffer) >= flush_at:
+            chunks = get_text_chunks(buffer, chunk_size, chunk_overlap)
+            yield from chunks[:-1]
+            buffer = chunks[-1] if chunks else ""
+    if buffer:
+        yield from get_text_chunks(buffer, chunk_size, chunk_overlap)
+
+
+# Errors worth retrying: throttling, timeouts and transient server-side failures.
+RETRYABLE_EMBEDDING_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+# Shared by every ingestion job in this process, so concurrent documents
+# together never exceed EMBEDDING_MAX_CONCURRENCY in-flight provider calls.
+_embedding_semaphore = threading.BoundedSemaphore(Config.EMBEDDING_MAX_CONCURRENCY)
+
+
+def split_into_batches(texts: list[str], max_items: int, max_chars: int) -> list[list[str]]:
+    """Groups texts, in order, into batches bounded by item count and total characters."""
+    batches, current, current_chars = [], [], 0
+    for text in texts:
+        if current and (len(current) >= max_items or current_chars + len(text) > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(text)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_with_retry(texts: list[str], model_name: str, dimension: int) -> list[list[float]]:
+    """Embeds one provider-sized batch, retrying retryable errors with jittered exponential backoff."""
+    attempt = 0
+    while True:
+        try:
+            with _embedding_semaphore:
+                result = genai.embed_content(
+                    model=model_name,
+                    content=texts,
+                    task_type="retrieval_document",
+                    output_dimensionality=dimension
+                )
+            embeddings = result['embedding']
+            if len(embeddings) != len(texts):
+                raise ExternalApiError(f"Embedding service returned {len(embeddings)} vectors for {len(texts)} texts.")
+            return embeddings
+        except RETRYABLE_EMBEDDING_ERRORS as e:
+            attempt += 1
+            if attempt > Config.EMBEDDING_MAX_RETRIES:
+                raise
+            ceiling = min(Config.EMBEDDING_RETRY_MAX_SECONDS, Config.EMBEDDING_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+            delay = random.uniform(0, ceiling)
+            app_logger.warning(
+                f"Retryable embedding error ({type(e).__name__}), attempt {attempt}/{Config.EMBEDDING_MAX_RETRIES}, "
+                f"retrying in {delay:.1f}s: {e}"
+            )
+            time.sleep(delay)
+
+
+def get_embeddings_with_store(texts: list[str]) -> list[list[float]]:
+    """
+    Like get_embeddings_batch, but looks texts up in the content-addressed
+    embedding store first and only sends the misses (deduplicated) to the provider.
+    """
+    if not Config.EMBEDDING_STORE_ENABLED:
+        return get_embeddings_batch(texts)
+
+    model_name = current_app.config.get("EMBEDDING_MODEL_NAME")
+    dimension = current_app.config.get("PG_EMBEDDING_DIMENSION")
+    hashes = [chunk_content_hash(text) for text in texts]
+    try:
+        found = lookup_embeddings(hashes, model_name, dimension)
+    except Exception as e:
+        error_logger.error(f"Embedding store lookup failed, embedding everything: {e}", exc_info=True)
+        found = {}
+
+    missing = {}
+    for text_hash, text in zip(hashes, texts):
+        if text_hash not in found:
+            missing.setdefault(text_hash, text)
+    if missing:
+        new_embeddings = dict(zip(missing.keys(), get_embeddings_batch(list(missing.values()))))
+        try:
+            store_embeddings(new_embeddings, model_name, dimension)
+        except Exception as e:
+            error_logger.error(f"Failed to write to the embedding store: {e}", exc_info=True)
+        found.update(new_embeddings)
+
+    app_logger.info(f"Embedding store: {len(texts) - len(missing)} of {len(texts)} chunks reused.")
+    return [found[text_hash] for text_hash in hashes]
+
 
 def get_embeddings_batch(texts: list[str]) -> list[list[float]]:
+    """
+    Embeds texts in provider-sized sub-batches that run concurrently, bounded by
+    EMBEDDING_MAX_CONCURRENCY. The result is in the same order as the input.
+    """
+    if not texts:
+        return []
     try:
         model_name = current_app.config.get("EMBEDDING_MODEL_NAME")
-        result = genai.embed_content(
-            model=model_name,
-            content=texts,
-            task_type="retrieval_document",
-            output_dimensionality=current_app.config.get("PG_EMBEDDING_DIMENSION")
-        )
-        return result['embedding']
+        dimension = current_app.config.get("PG_EMBEDDING_DIMENSION")
+        batches = split_into_batches(texts, Config.EMBEDDING_BATCH_MAX_ITEMS, Config.EMBEDDING_BATCH_MAX_CHARS)
+        if len(batches) == 1:
+            return _embed_with_retry(batches[0], model_name, dimension)
+
+        app_logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches.")
+        with ThreadPoolExecutor(max_workers=min(len(batches), Config.EMBEDDING_MAX_CONCURRENCY)) as executor:
+            results = executor.map(lambda batch: _embed_with_retry(batch, model_name, dimension), batches)
+            return [embedding for batch_result in results for embedding in batch_result]
     except Exception as e:
         error_logger.error(f"Error getting batch embedding from GenAI: {e}", exc_info=True)
         raise ExternalApiError("The embedding service failed.") from e
 
 
 
+class _PipelineAborted(Exception):
+    """Raised inside a pipeline stage when another stage has failed."""
+
+
+def _put(q: queue.Queue, item, abort: threading.Event) -> None:
+    """Blocking put that gives up once the pipeline is aborted (avoids deadlocks on failure)."""
+    while True:
+        if abort.is_set():
+            raise _PipelineAborted()
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, abort: threading.Event):
+    while True:
+        if abort.is_set():
+            raise _PipelineAborted()
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+
+_END = object()
+
+
+class IngestionPipeline:
+    """
+    Runs extraction/chunking, embedding and saving as concurrent stages joined by
+    bounded queues, so memory stays flat and the stages overlap:
+
+        pages -> chunk batches -> [N embedding threads] -> (chunks, embeddings) -> save
+
+    The save stage runs in the calling thread.
+    `existing` maps content hashes to the ids of chunks already stored for the
+    document; matching chunks are kept (ids collected in kept_ids) instead of
+    being embedded again.
+    """
+
+    def __init__(self, app, pdf_path: str, chunk_size: int, chunk_overlap: int,
+                 existing: dict[str, list[int]] | None = None):
+        self.app = app
+        self.existing = existing or {}
+        self.kept_ids = []
+        self.pdf_path = pdf_path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = Config.EMBEDDING_BATCH_MAX_ITEMS
+        self.embed_workers = max(1, Config.EMBEDDING_MAX_CONCURRENCY)
+        self.chunk_queue = queue.Queue(maxsize=Config.INGESTION_QUEUE_DEPTH)
+        self.save_queue = queue.Queue(maxsize=Config.INGESTION_QUEUE_DEPTH)
+        self.abort = threading.Event()
+        self.errors = []
+
+    def _fail(self, e: Exception) -> None:
+        if not isinstance(e, _PipelineAborted):
+            self.errors.append(e)
+        self.abort.set()
+
+    def _produce_chunks(self) -> None:
+        start = time.perf_counter()
+        try:
+            batch = []
+            for chunk in iter_text_chunks(iter_pdf_pages(self.pdf_path), self.chunk_size, self.chunk_overlap):
+                matching_ids = self.existing.get(chunk_content_hash(chunk))
+                if matching_ids:
+                    self.kept_ids.append(matching_ids.pop())
+                    continue
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    _put(self.chunk_queue, batch, self.abort)
+                    batch = []
+            if batch:
+                _put(self.chunk_queue, batch, self.abort)
+            _put(self.chunk_queue, _END, self.abort)
+            # Includes waits for the embedding stage to take batches.
+            INGESTION_STAGE_SECONDS.labels(stage="chunk").observe(time.perf_counter() - start)
+        except Exception as e:
+            self._fail(e)
+
+    def _embed_chunks(self) -> None:
+        try:
+            with self.app.app_context():
+                while True:
+                    batch = _get(self.chunk_queue, self.abort)
+                    if batch is _END:
+                        # Let the other embedding threads see the end marker too.
+                        _put(self.chunk_queue, _END, self.abort)
+                        break
+                    with timed(INGESTION_STAGE_SECONDS, stage="embed"):
+                        embeddings = get_embeddings_with_store(batch)
+                    _put(self.save_queue, (batch, embeddings), self.abort)
+            _put(self.save_queue, _END, self.abort)
+        except Exception as e:
+            self._fail(e)
+
+    def run(self, save_batch) -> int:
+        """Runs the pipeline, calling save_batch(chunks, embeddings) per batch. Returns the number of new chunks."""
+        threads = [threading.Thread(target=self._produce_chunks, name="ingest-chunker", daemon=True)]
+        threads += [
+            threading.Thread(target=self._embed_chunks, name=f"ingest-embedder-{i}", daemon=True)
+            for i in range(self.embed_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        saved = 0
+        finished_embedders = 0
+        try:
+            while finished_embedders < self.embed_workers:
+                item = _get(self.save_queue, self.abort)
+                if item is _END:
+                    finished_embedders += 1
+                    continue
+                chunks, embeddings = item
+                save_batch(chunks, embeddings)
+                saved += len(chunks)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+        return saved
+
+
+class ChunkSpool:
+    """
+    Keeps the embedded batches of a pipeline run in a temporary file, so the
+    chunk rows are written in one short transaction after the run instead of
+    one that holds a connection (and locks) while the document is embedded.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.batches = 0
+
+    def add(self, chunks: list[str], embeddings: list[list[float]]) -> None:
+        pickle.dump((chunks, embeddings), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.batches += 1
+
+    def __iter__(self) -> Iterator[tuple[list[str], list[list[float]]]]:
+        self.file.seek(0)
+        for _ in range(self.batches):
+            yield pickle.load(self.file)
+
+    def __enter__(self) -> "ChunkSpool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.file.close()
+
+
+def load_existing_chunk_hashes(document_id, collection: str) -> dict[str, list[int]]:
+    """
+    Maps content hash -> chunk ids for the chunks currently stored for a document.
+    Rows written before content hashes existed are hashed (and backfilled) here.
+    """
+    rows = db.session.execute(
+        text(
+            f"""
+            SELECT id, content_hash, CASE WHEN content_hash IS NULL THEN content END
+            FROM {Config.PG_TABLE_NAME} WHERE document_id = :document_id AND collection = :collection
+            """
+        ),
+        {"document_id": document_id, "collection": collection}
+    ).fetchall()
+    existing, backfill = {}, []
+    for chunk_id, content_hash, content in rows:
+        if content_hash is None:
+            content_hash = chunk_content_hash(content)
+            backfill.append({"id": chunk_id, "content_hash": content_hash, "collection": collection})
+        existing.setdefault(content_hash, []).append(chunk_id)
+    if backfill:
+        db.session.execute(
+            text(
+                f"UPDATE {Config.PG_TABLE_NAME} SET content_hash = :content_hash "
+                f"WHERE id = :id AND collection = :collection"
+            ),
+            backfill
+        )
+    return existing
+
+
+def is_retryable_ingestion_error(error: Exception) -> bool:
+    """
+    Whether a failed ingestion may succeed on a later attempt: download and
+    embedding service errors and lost database connections. Anything else
+    (PermanentIngestionError, unreadable PDFs, bugs) fails the document at once.
+    """
+    if isinstance(error, PermanentIngestionError):
+        return False
+    if isinstance(error, ExternalApiError):
+        return True
+    if isinstance(error, DBAPIError):
+        return isinstance(error, OperationalError) or error.connection_invalidated
+    return False
+
+
 def process_and_store_document(document: Document) -> None:
     """
     Orchestrator function: takes a Document object, processes it,
     and stores chunks in the database. Updates the document status.
+    The download is streamed to a temporary file, then pages are extracted,
+    chunked and embedded by a concurrent pipeline, which spools the embedded
+    batches to disk. The chunks are written afterwards and committed together
+    with the final status, so a failed run leaves no partial chunks and the
+    transaction is not kept open while the document is embedded.
+
+    Re-ingestion is incremental: an unchanged source file is skipped entirely,
+    otherwise only new or changed chunks are embedded and inserted, and chunks
+    that no longer occur are deleted.
     """
     start_time = time.monotonic()
+    completed = False
     
     try:
         app_logger.info(f"Starting ingestion for doc ID: {document.id} ({document.display_name})")
+        collection = document.collection
+        # Before any write in this session: creating a partition locks `documents`.
+        ensure_collection_partition(collection)
         
-        # 1. Get Text
-        document.processing_status = "FETCHING"
-        db.session.commit()
-        raw_text = get_pdf_text(document.source_url)
-        if not raw_text:
-            raise ValueError("Failed to extract text from PDF (empty content).")
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file, ChunkSpool() as spool:
+            # 1. Download
+            document.processing_status = "FETCHING"
+            db.session.commit()
+            try:
+                with timed(INGESTION_STAGE_SECONDS, stage="fetch"):
+                    size, source_hash = download_pdf(document.source_url, pdf_file)
+            except requests.exceptions.RequestException as e:
+                raise ExternalApiError(f"Error downloading PDF from {document.source_url}: {e}") from e
+            if not size:
+                raise PermanentIngestionError("Failed to extract text from PDF (empty content).")
 
-        # 2. Get Chunks
-        document.processing_status = "CHUNKING"
-        db.session.commit()
+            document_id = document.id
+            existing = load_existing_chunk_hashes(document_id, collection)
+            if existing and document.source_hash == source_hash:
+                app_logger.info(f"Source file unchanged for doc ID: {document_id}, skipping re-ingestion.")
+                document.chunks_unchanged = True
+                document.processing_status = "COMPLETED"
+                document.processing_time_ms = int((time.monotonic() - start_time) * 1000)
+                document.processing_error = None
+                return
 
-        
-        chunk_size = current_app.config['TEXT_CHUNK_SIZE']
-        chunk_overlap = current_app.config['TEXT_CHUNK_OVERLAP']
-        chunks = get_text_chunks(raw_text, chunk_size, chunk_overlap)
+            # 2. Extract, chunk and embed (pipelined)
+            document.processing_status = "EMBEDDING"
+            db.session.commit()
 
-        if not chunks:
-            raise ValueError("Text was extracted but resulted in no chunks.")
-        app_logger.info(f"Created {len(chunks)} chunks for doc ID: {document.id}")
+            pipeline = IngestionPipeline(
+                current_app._get_current_object(),
+                pdf_file.name,
+                current_app.config['TEXT_CHUNK_SIZE'],
+                current_app.config['TEXT_CHUNK_OVERLAP'],
+                existing=existing
+            )
+            new_count = pipeline.run(spool.add)
 
-        # 3. Get Embeddings (Batch)
-        document.processing_status = "EMBEDDING"
-        db.session.commit()
-        embeddings = get_embeddings_batch(chunks)
+            # 3. Save the new chunks (committed below, with the final status)
+            with timed(INGESTION_STAGE_SECONDS, stage="save"):
+                for chunks, embeddings in spool:
+                    write_chunks(db.session, document_id, chunks, embeddings, collection=collection)
 
-        # 4. Create DocumentChunk objects
-        document.processing_status = "SAVING"
-        db.session.commit()
-        chunks_to_add = []
-        for content, embedding in zip(chunks, embeddings):
-            chunk_obj = DocumentChunk(
-                content=content,
-                embedding=embedding,
-                document_id=document.id
-            )
-            chunks_to_add.append(chunk_obj)
+        kept_count = len(pipeline.kept_ids)
+        if not new_count and not kept_count:
+            raise PermanentIngestionError("Text was extracted but resulted in no chunks.")
 
-        # 5. Bulk-save chunks
-        db.session.bulk_save_objects(chunks_to_add)
+        # 4. Delete chunks that no longer occur in the document
+        removed_ids = [chunk_id for ids in existing.values() for chunk_id in ids]
+        if removed_ids:
+            db.session.execute(
+                text(f"DELETE FROM {Config.PG_TABLE_NAME} WHERE id = ANY(:ids) AND collection = :collection"),
+                {"ids": removed_ids, "collection": collection}
+            )
+        app_logger.info(
+            f"Doc ID {document_id}: {new_count} new chunks embedded, {kept_count} unchanged kept, "
+            f"{len(removed_ids)} removed."
+        )
+        document.chunks_unchanged = not new_count and not removed_ids
         
-        # 6. Mark as complete
+        # 5. Mark as complete
+        document.source_hash = source_hash
         end_time = time.monotonic()
         document.processing_status = "COMPLETED"
         document.processing_time_ms = int((end_time - start_time) * 1000)
         document.processing_error = None
+        completed = True
         app_logger.info(f"Successfully completed ingestion for doc ID: {document.id}")
 
     except (ValueError, ExternalApiError, Exception) as e:
         error_logger.error(f"Ingestion FAILED for doc ID {document.id}: {e}", exc_info=True)
+        # Discard chunks saved by this run; only the failure status is committed.
+        db.session.rollback()
         document.processing_status = "FAILED"
         document.processing_error = str(e)
+        if not is_retryable_ingestion_error(e):
+            # Uses up the remaining attempts, so the job queue does not schedule a retry.
+            document.attempts = max(document.attempts or 0, Config.INGESTION_MAX_ATTEMPTS)
     
     finally:
-        db.session.commit()
\ No newline at end of file
+        # Read before the commit expires it (see below).
+        final_status = document.processing_status
+        db.session.commit()
+        INGESTION_DOCUMENT_SECONDS.labels(status=final_status.lower()).observe(time.monotonic() - start_time)
+
+    if completed:
+        # No-op once the index exists; builds it (concurrently) after the first bulk load.
+        # Uses the local flag: touching `document` here would open a new transaction,
+        # which CREATE INDEX CONCURRENTLY would wait on forever.
+        ensure_vector_index()
\ No newline at end of file
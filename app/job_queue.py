@@ -0,0 +1,257 @@
+import logging
+import os
+import random
+import socket
+import threading
+from sqlalchemy import text
+
+from .config import Config
+from .models import db, Document
+from .ingestion_service import process_and_store_document
+from .metrics import INGESTION_JOBS_IN_FLIGHT
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+# Documents waiting to be picked up by a worker.
+QUEUED_STATUSES = ("PENDING", "PENDING_REINGEST", "RETRYING")
+# Documents a worker is currently processing (set by process_and_store_document).
+IN_FLIGHT_STATUSES = ("FETCHING", "EMBEDDING")
+
+_CLAIM_SQL = text(
+    """
+    WITH next_job AS (
+        SELECT id FROM documents
+        WHERE processing_status IN ('PENDING', 'PENDING_REINGEST', 'RETRYING')
+          AND (next_attempt_at IS NULL OR next_attempt_at <= now())
+        ORDER BY created_at
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    UPDATE documents d
+    SET processing_status = 'FETCHING',
+        locked_by = :worker_id,
+        locked_at = now(),
+        attempts = d.attempts + 1
+    FROM next_job
+    WHERE d.id = next_job.id
+    RETURNING d.id, d.attempts
+    """
+)
+
+_RECLAIM_SQL = text(
+    """
+    UPDATE documents
+    SET processing_status = CASE WHEN attempts >= :max_attempts THEN 'FAILED' ELSE 'RETRYING' END,
+        processing_error = 'Ingestion job was abandoned by its worker (timed out or restarted).',
+        locked_by = NULL,
+        locked_at = NULL,
+        next_attempt_at = now()
+    WHERE processing_status IN ('FETCHING', 'EMBEDDING')
+      AND (locked_at IS NULL OR locked_at < now() - make_interval(secs => :timeout))
+    RETURNING id
+    """
+)
+
+_FINISH_SQL = text(
+    """
+    UPDATE documents
+    SET processing_status = CASE
+            WHEN processing_status = 'FAILED' AND attempts < :max_attempts THEN 'RETRYING'
+            ELSE processing_status END,
+        next_attempt_at = CASE
+            WHEN processing_status = 'FAILED' AND attempts < :max_attempts
+            THEN now() + make_interval(secs => :retry_delay)
+            ELSE NULL END,
+        locked_by = NULL,
+        locked_at = NULL
+    WHERE id = :doc_id AND locked_by = :worker_id
+    RETURNING processing_status
+    """
+)
+
+_HEARTBEAT_SQL = text(
+    "UPDATE documents SET locked_at = now() WHERE id = :doc_id AND locked_by = :worker_id"
+)
+
+
+def enqueue_document(document: Document, status: str = "PENDING") -> None:
+    """Marks a document as queued for ingestion. The caller commits the session."""
+    document.processing_status = status
+    document.processing_error = None
+    document.attempts = 0
+    document.next_attempt_at = None
+    document.locked_by = None
+    document.locked_at = None
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Exponential backoff with full jitter for the given number of failed attempts."""
+    ceiling = min(Config.INGESTION_RETRY_MAX_SECONDS, Config.INGESTION_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim_next_job(worker_id: str) -> tuple | None:
+    """Atomically claims the oldest runnable document. Returns (doc_id, attempts) or None."""
+    with db.engine.begin() as conn:
+        row = conn.execute(_CLAIM_SQL, {"worker_id": worker_id}).first()
+    return (row[0], row[1]) if row else None
+
+
+def reclaim_stale_jobs() -> int:
+    """Requeues (or fails, after too many attempts) in-flight documents whose worker stopped heart-beating."""
+    with db.engine.begin() as conn:
+        rows = conn.execute(_RECLAIM_SQL, {
+            "max_attempts": Config.INGESTION_MAX_ATTEMPTS,
+            "timeout": Config.INGESTION_VISIBILITY_TIMEOUT_SECONDS,
+        }).fetchall()
+    if rows:
+        app_logger.warning(f"Reclaimed {len(rows)} stale ingestion job(s): {[str(r[0]) for r in rows]}")
+    return len(rows)
+
+
+def finish_job(doc_id, worker_id: str, attempts: int) -> str | None:
+    """Releases a claimed job, scheduling a retry with backoff if it failed."""
+    with db.engine.begin() as conn:
+        row = conn.execute(_FINISH_SQL, {
+            "doc_id": doc_id,
+            "worker_id": worker_id,
+            "max_attempts": Config.INGESTION_MAX_ATTEMPTS,
+            "retry_delay": retry_delay_seconds(attempts),
+        }).first()
+    return row[0] if row else None
+
+
+def run_job(doc_id) -> None:
+    """Runs one claimed ingestion job in the current app context."""
+    try:
+        doc = db.session.get(Document, doc_id)
+        if not doc:
+            error_logger.error(f"[JOB] Failed to find Document {doc_id} to start ingestion.")
+            return
+        with INGESTION_JOBS_IN_FLIGHT.track_inprogress():
+            process_and_store_document(doc)
+
+    except Exception as e:
+        error_logger.error(f"[JOB] Ingestion failed for {doc_id}: {e}", exc_info=True)
+        try:
+            db.session.rollback()
+            doc_to_fail = db.session.get(Document, doc_id)
+            if doc_to_fail:
+                doc_to_fail.processing_status = "FAILED"
+                doc_to_fail.processing_error = f"Background task error: {str(e)}"
+                db.session.commit()
+        except Exception as db_e:
+            error_logger.error(f"[JOB] FATAL: Failed to even update error status for {doc_id}: {db_e}")
+    finally:
+        db.session.remove()
+
+
+class IngestionWorkerPool:
+    """
+    Fixed-size pool of threads that claim documents from the Postgres job queue
+    (SELECT ... FOR UPDATE SKIP LOCKED), so any number of processes can share it.
+    A heartbeat keeps locked_at fresh for running jobs; jobs whose heartbeat is
+    older than the visibility timeout are reclaimed.
+    """
+
+    def __init__(self, app, size: int):
+        self.app = app
+        self.size = size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self.app.app_context():
+            try:
+                reclaim_stale_jobs()
+            except Exception as e:
+                error_logger.error(f"Failed to reclaim stale ingestion jobs: {e}", exc_info=True)
+
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="ingestion-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        app_logger.info(f"Started {self.size} ingestion worker thread(s) as '{self.worker_id}'.")
+
+    def wake(self) -> None:
+        """Wakes idle workers immediately instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self) -> None:
+        thread_worker_id = f"{self.worker_id}:{threading.current_thread().name}"
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    job = claim_next_job(thread_worker_id)
+                except Exception as e:
+                    error_logger.error(f"Failed to claim ingestion job: {e}", exc_info=True)
+                    job = None
+
+                if job is None:
+                    self._wakeup.wait(Config.INGESTION_POLL_INTERVAL_SECONDS)
+                    self._wakeup.clear()
+                    continue
+
+                doc_id, attempts = job
+                with self._running_lock:
+                    self._running[doc_id] = thread_worker_id
+                try:
+                    app_logger.info(f"[JOB] {thread_worker_id} claimed doc {doc_id} (attempt {attempts}).")
+                    run_job(doc_id)
+                finally:
+                    with self._running_lock:
+                        self._running.pop(doc_id, None)
+                    try:
+                        status = finish_job(doc_id, thread_worker_id, attempts)
+                        if status == "RETRYING":
+                            app_logger.warning(f"[JOB] Doc {doc_id} failed on attempt {attempts}, retry scheduled.")
+                    except Exception as e:
+                        error_logger.error(f"Failed to release ingestion job {doc_id}: {e}", exc_info=True)
+
+    def _heartbeat(self) -> None:
+        interval = max(1.0, Config.INGESTION_VISIBILITY_TIMEOUT_SECONDS / 3)
+        with self.app.app_context():
+            while not self._stopping.wait(interval):
+                try:
+                    with self._running_lock:
+                        running = dict(self._running)
+                    with db.engine.begin() as conn:
+                        for doc_id, worker_id in running.items():
+                            conn.execute(_HEARTBEAT_SQL, {"doc_id": doc_id, "worker_id": worker_id})
+                    reclaim_stale_jobs()
+                except Exception as e:
+                    error_logger.error(f"Ingestion heartbeat failed: {e}", exc_info=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_ingestion_workers(app) -> IngestionWorkerPool:
+    """Starts this process's worker pool once; later calls return the running pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = IngestionWorkerPool(app, Config.INGESTION_WORKER_CONCURRENCY)
+            _pool.start()
+    return _pool
+
+
+def notify_ingestion_workers() -> None:
+    """Wakes this process's workers, if it runs any, after a job was enqueued."""
+    if _pool is not None:
+        _pool.wake()
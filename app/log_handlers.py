@@ -0,0 +1,180 @@
+"""
+Logging pipeline: formatters, access-log sampling and process-safe rotation.
+
+With LOG_QUEUE_ENABLED a logger only has a QueueHandler, which puts records on
+an in-memory queue, and a QueueListener thread per logger does the
+formatting and the file and stdout writes. A request thread never waits for
+disk I/O.
+
+Every hypercorn worker appends to the same files. ProcessSafeRotatingFileHandler
+writes and rotates while holding an fcntl lock on '<file>.lock'. It also
+reopens the file when another process has rotated it, so only one process
+rotates and no process keeps writing to a renamed backup.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, plain rotation
+    fcntl = None
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s [in %(pathname)s:%(lineno)d]'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "pathname": record.pathname,
+            "lineno": record.lineno,
+            "process": record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def make_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random fraction of the records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def parse_sample_rates(value: str) -> dict[str, float]:
+    """Parses "access=0.1,app=0.5" into {logger name: rate}."""
+    rates = {}
+    for item in value.split(","):
+        name, sep, rate = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logging.getLogger('error').error(f"Ignoring invalid log sample rate '{item.strip()}'.")
+    return rates
+
+
+class ProcessSafeRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler whose writes and rotations are serialized across processes."""
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding=None):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+        self._lock_file = open(f"{self.baseFilename}.lock", "a") if fcntl else None
+
+    def _rotated_elsewhere(self) -> bool:
+        if self.stream is None:
+            return False
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def emit(self, record):
+        if self._lock_file is None:
+            return super().emit(record)
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except OSError:
+            self.handleError(record)
+            return
+        try:
+            if self._rotated_elsewhere():
+                self.stream.close()
+                self.stream = None
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """
+    Only renders the message and traceback on the calling thread (the
+    arguments and traceback may not outlive it). The listener's handlers apply
+    the text or JSON format.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def attach_handlers(logger: logging.Logger, handlers: list[logging.Handler], use_queue: bool) -> None:
+    """Attaches the handlers directly, or behind a queue drained by a listener thread."""
+    if not use_queue:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    logger.addHandler(_PreparedQueueHandler(log_queue))
+
+
+def stop_listeners() -> None:
+    """Writes out queued records and stops the listener threads."""
+    while _listeners:
+        listener = _listeners.pop()
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def _restart_listeners_after_fork() -> None:
+    """A forked child has the queues but not the listener threads; the parent writes what was queued."""
+    for listener in _listeners:
+        while True:
+            try:
+                listener.queue.get_nowait()
+            except queue.Empty:
+                break
+        listener._thread = None
+        listener.start()
+
+
+atexit.register(stop_listeners)
+os.register_at_fork(after_in_child=_restart_listeners_after_fork)
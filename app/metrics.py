@@ -0,0 +1,214 @@
+"""
+Prometheus metrics, aggregated across worker processes.
+
+hypercorn runs several worker processes, so every metric is written to
+memory-mapped files in PROMETHEUS_MULTIPROC_DIR (prometheus_client's
+multiprocess mode) and /metrics sums the files of all processes. The
+directory must be set before prometheus_client is imported, which is why it
+is set up at the top of this module. Gauges only count live processes; files
+left by dead processes are removed when a process starts.
+
+The standalone ingestion worker (python -m app.worker) serves the same
+metrics on METRICS_WORKER_PORT.
+"""
+import atexit
+import glob
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import Config
+
+if Config.METRICS_ENABLED:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", Config.METRICS_MULTIPROC_DIR)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    start_http_server,
+)
+from sqlalchemy.pool import QueuePool
+
+
+def multiprocess_enabled() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_dead_process_files() -> None:
+    """Drops the live-gauge files of processes that no longer exist (e.g. after a restart)."""
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "gauge_live*_*.db")):
+        match = re.search(r"_(\d+)\.db$", path)
+        if match and not _pid_alive(int(match.group(1))):
+            multiprocess.mark_process_dead(int(match.group(1)))
+
+
+if multiprocess_enabled():
+    remove_dead_process_files()
+    # A restarted worker may get the pid of a dead one; its gauges start from zero.
+    multiprocess.mark_process_dead(os.getpid())
+    atexit.register(multiprocess.mark_process_dead, os.getpid())
+
+# Seconds; LLM calls and ingestion stages need the long tail.
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+AGENT_TURN_SECONDS = Histogram(
+    "chatbot_agent_turn_seconds",
+    "Duration of a whole agent turn (run_agent_async / stream_agent_async).",
+    ["model", "streaming"], buckets=_SLOW_BUCKETS,
+)
+SESSION_OPERATION_SECONDS = Histogram(
+    "chatbot_session_operation_seconds",
+    "Duration of session store operations (exists, create, load, append).",
+    ["operation"], buckets=_FAST_BUCKETS,
+)
+LLM_CALL_SECONDS = Histogram(
+    "chatbot_llm_call_seconds",
+    "Duration of one model call; call is 'tool_call' when the model asked for a tool, else 'final'.",
+    ["model", "call"], buckets=_SLOW_BUCKETS,
+)
+RETRIEVAL_STAGE_SECONDS = Histogram(
+    "chatbot_retrieval_stage_seconds",
+    "Duration of the stages of retrieve_pgvector_documents (query_embedding, vector_search, total).",
+    ["stage"], buckets=_FAST_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens",
+    "Tokens reported by the model provider.",
+    ["model", "kind"],
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "chatbot_db_pool_wait_seconds",
+    "Time spent waiting to check a connection out of a database pool.",
+    ["pool"], buckets=_FAST_BUCKETS,
+)
+INGESTION_STAGE_SECONDS = Histogram(
+    "chatbot_ingestion_stage_seconds",
+    "Duration of the ingestion stages: fetch per document, chunk per document, embed and save per batch.",
+    ["stage"], buckets=_SLOW_BUCKETS,
+)
+INGESTION_DOCUMENT_SECONDS = Histogram(
+    "chatbot_ingestion_document_seconds",
+    "Total ingestion time of a document by its final status.",
+    ["status"], buckets=_SLOW_BUCKETS,
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "chatbot_single_flight_calls",
+    "Coalesced calls by flight (embedding, retrieval, answer) and role: 'leader' ran the work, "
+    "'follower' shared a leader's result in the same worker, 'remote_hit' used another worker's result.",
+    ["flight", "role"],
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    "chatbot_embedding_cache_lookups",
+    "Query embedding cache lookups by result: 'local_hit', 'remote_hit' (memcached) or 'miss'.",
+    ["result"],
+)
+QUERY_EMBEDDING_BATCH_SIZE = Histogram(
+    "chatbot_query_embedding_batch_size",
+    "Queries per micro-batched retrieval_query embedding call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 100),
+)
+QUERY_EMBEDDING_QUEUE_DELAY_SECONDS = Histogram(
+    "chatbot_query_embedding_queue_delay_seconds",
+    "Time a query waited in the embedding batcher before its batch was dispatched.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+INGESTION_JOBS_IN_FLIGHT = Gauge(
+    "chatbot_ingestion_jobs_in_flight",
+    "Ingestion jobs currently being processed.",
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """Observes the duration of the block, also when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def timed_pool_class(name: str) -> type[QueuePool]:
+    """QueuePool subclass that records its checkout wait under pool=name (pass as poolclass=)."""
+
+    class TimedQueuePool(QueuePool):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                DB_POOL_WAIT_SECONDS.labels(pool=name).observe(time.perf_counter() - start)
+
+    TimedQueuePool.__name__ = f"TimedQueuePool_{name}"
+    return TimedQueuePool
+
+
+# Start time and model of the model call in flight per invocation (an
+# invocation's calls are sequential). A context variable would not do: the
+# streaming route resumes the agent's generator in a new task for every event.
+_llm_calls = {}
+_llm_calls_lock = threading.Lock()
+_MAX_TRACKED_LLM_CALLS = 10000
+
+
+def before_model_callback(callback_context, llm_request):
+    with _llm_calls_lock:
+        if len(_llm_calls) >= _MAX_TRACKED_LLM_CALLS:
+            # Calls that failed never reach the after callback.
+            _llm_calls.pop(next(iter(_llm_calls)))
+        _llm_calls[callback_context.invocation_id] = (time.perf_counter(), llm_request.model or "unknown")
+    return None
+
+
+def after_model_callback(callback_context, llm_response):
+    """Records the call when its last (non-partial) response arrives."""
+    if llm_response.partial:
+        return None
+    with _llm_calls_lock:
+        started = _llm_calls.pop(callback_context.invocation_id, None)
+    if started is None:
+        return None
+    start, model = started
+    elapsed = time.perf_counter() - start
+    parts = llm_response.content.parts if llm_response.content and llm_response.content.parts else []
+    call = "tool_call" if any(part.function_call for part in parts) else "final"
+    LLM_CALL_SECONDS.labels(model=model, call=call).observe(elapsed)
+    usage = llm_response.usage_metadata
+    if usage:
+        if usage.prompt_token_count:
+            LLM_TOKENS.labels(model=model, kind="prompt").inc(usage.prompt_token_count)
+        if usage.candidates_token_count:
+            LLM_TOKENS.labels(model=model, kind="completion").inc(usage.candidates_token_count)
+    return None
+
+
+def _registry() -> CollectorRegistry:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """(body, content type) of the metrics of every worker process."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def serve_worker_metrics() -> None:
+    """Serves /metrics of the standalone ingestion worker on METRICS_WORKER_PORT."""
+    if multiprocess_enabled() and Config.METRICS_WORKER_PORT:
+        start_http_server(Config.METRICS_WORKER_PORT, registry=_registry())
+
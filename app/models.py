@@ -1,12 +1,17 @@
 import uuid 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Boolean, Index, event, inspect, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
+
+from .config import Config
 
 db = SQLAlchemy()
 
+# Collection of documents created without one.
+DEFAULT_COLLECTION = "general"
+
 class Document(db.Model):
     """(RAG Table) The parent record for a processed PDF."""
     __tablename__ = "documents"
@@ -17,6 +22,15 @@ class Document(db.Model):
     processing_status = Column(String(20), default='PENDING', nullable=False)
     processing_time_ms = Column(Integer, nullable=True)
     processing_error = Column(Text, nullable=True)
+    # sha256 of the last successfully ingested source file
+    source_hash = Column(String(64), nullable=True)
+    # Ingestion job queue bookkeeping (see job_queue.py)
+    attempts = Column(Integer, default=0, nullable=False, server_default="0")
+    locked_by = Column(String(100), nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    # ERP module the document belongs to; document_chunks is partitioned by it (see partitions.py)
+    collection = Column(String(50), nullable=False, default=DEFAULT_COLLECTION, server_default=DEFAULT_COLLECTION, index=True)
     chunks = db.relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
     def __str__(self):
         return f"{self.display_name} ({self.id})"
@@ -25,8 +39,89 @@ class Document(db.Model):
 class DocumentChunk(db.Model):
     """(RAG Table) Stores the actual text chunk and its queryable vector."""
     __tablename__ = "document_chunks"
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(768))
-    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False)
-    document = db.relationship("Document", back_populates="chunks")
\ No newline at end of file
+    # sha256 of content; lets re-ingestion keep unchanged chunks and their embeddings
+    content_hash = Column(String(64), nullable=True, index=True)
+    embedding = Column(
+        HALFVEC(Config.PG_EMBEDDING_DIMENSION) if Config.PG_VECTOR_STORAGE == "halfvec"
+        else Vector(Config.PG_EMBEDDING_DIMENSION)
+    )
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False, index=True)
+    # Copy of Document.collection; the partition key, so it is part of the primary key.
+    collection = Column(String(50), primary_key=True, default=DEFAULT_COLLECTION, server_default=DEFAULT_COLLECTION)
+    document = db.relationship("Document", back_populates="chunks")
+    __table_args__ = {"postgresql_partition_by": "LIST (collection)"}
+
+
+class EmbeddingStoreEntry(db.Model):
+    """(Cache Table) Content-addressed document embeddings, shared across documents and re-ingests."""
+    __tablename__ = "embedding_store"
+    model_name = Column(String(100), primary_key=True)
+    dimension = Column(Integer, primary_key=True)
+    text_hash = Column(String(64), primary_key=True)
+    embedding = Column(Vector(), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class KnowledgeBaseState(db.Model):
+    """Single-row version counter, bumped whenever the set of searchable chunks changes."""
+    __tablename__ = "knowledge_base_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1)
+
+
+class AnswerCacheEntry(db.Model):
+    """(Cache Table) Final answers keyed by question embedding, model and knowledge base version."""
+    __tablename__ = "answer_cache"
+    id = Column(Integer, primary_key=True)
+    question_embedding = Column(Vector(Config.PG_EMBEDDING_DIMENSION), nullable=False)
+    model = Column(String(50), nullable=False)
+    kb_version = Column(BigInteger, nullable=False)
+    # Collection the question was scoped to (NULL = whole knowledge base)
+    collection = Column(String(50), nullable=True)
+    answer = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    __table_args__ = (
+        Index(
+            "answer_cache_question_embedding_hnsw_idx",
+            "question_embedding",
+            postgresql_using="hnsw",
+            postgresql_ops={"question_embedding": "vector_cosine_ops"},
+        ),
+    )
+
+
+# Statuses after which the chunks of a document differ from what earlier answers saw.
+# A queued re-ingest keeps the old chunks until its job completes.
+KB_CHANGING_STATUSES = ("COMPLETED",)
+
+
+def bump_kb_version(connection) -> None:
+    """Increments the knowledge base version and drops answers cached for older versions."""
+    connection.execute(text(
+        """
+        INSERT INTO knowledge_base_state (id, version) VALUES (1, 2)
+        ON CONFLICT (id) DO UPDATE SET version = knowledge_base_state.version + 1
+        """
+    ))
+    connection.execute(text(
+        "DELETE FROM answer_cache WHERE kb_version < (SELECT version FROM knowledge_base_state WHERE id = 1)"
+    ))
+
+
+@event.listens_for(Document, "after_insert")
+@event.listens_for(Document, "after_delete")
+def _document_created_or_deleted(mapper, connection, target):
+    bump_kb_version(connection)
+
+
+@event.listens_for(Document, "after_update")
+def _document_status_changed(mapper, connection, target):
+    # Set by ingestion when a re-ingest found nothing to change.
+    if getattr(target, "chunks_unchanged", False):
+        return
+    history = inspect(target).attrs.processing_status.history
+    if history.has_changes() and target.processing_status in KB_CHANGING_STATUSES:
+        bump_kb_version(connection)
+
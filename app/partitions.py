@@ -0,0 +1,242 @@
+"""
+Collections and the list-partitioned chunk table.
+
+Every Document belongs to a collection (an ERP module such as "fees" or
+"library") and document_chunks is LIST-partitioned by it, one partition per
+collection, each with its own ANN index (see vector_index.py). Searches scoped
+to a collection only touch that partition, and a collection can be dropped
+without locking the others.
+
+Maintenance:
+
+    python -m app.partitions migrate            # convert an existing unpartitioned table
+    python -m app.partitions list
+    python -m app.partitions drop <collection>  # delete a collection and its documents
+"""
+import argparse
+import logging
+import re
+from sqlalchemy import text
+
+from .config import Config
+from .models import db, DocumentChunk, DEFAULT_COLLECTION, bump_kb_version
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+# Collection names end up in partition and index names, so they are kept short
+# and identifier-safe.
+_COLLECTION_RE = re.compile(r"^[a-z][a-z0-9_]{0,23}$")
+
+
+def normalize_collection(name: str | None) -> str | None:
+    """
+    Normalizes a user- or model-supplied collection name ("Exam Control" -> "exam_control").
+    Returns None for an empty name; raises ValueError for one that cannot be a collection.
+    """
+    if name is None:
+        return None
+    normalized = re.sub(r"[\s\-]+", "_", name.strip().lower())
+    if not normalized:
+        return None
+    if not _COLLECTION_RE.match(normalized):
+        raise ValueError(
+            f"Invalid collection '{name}': use up to 24 letters, digits or underscores, starting with a letter."
+        )
+    return normalized
+
+
+def partition_name(collection: str) -> str:
+    return f"{Config.PG_TABLE_NAME}_{collection}"
+
+
+def is_partitioned(conn) -> bool:
+    """True if the chunk table is a partitioned table."""
+    return bool(conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": Config.PG_TABLE_NAME}
+    ).scalar())
+
+
+def list_partitions(conn) -> list[tuple[str, int, int]]:
+    """Returns (partition name, estimated rows, total bytes) for each partition of the chunk table."""
+    return conn.execute(
+        text(
+            """
+            SELECT c.relname, GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+            ORDER BY c.relname
+            """
+        ),
+        {"table": Config.PG_TABLE_NAME}
+    ).fetchall()
+
+
+def _partition_state(conn, name: str) -> str | None:
+    """"attached", "detaching" (interrupted DETACH ... CONCURRENTLY), "detached" or None if the table is missing."""
+    return conn.execute(
+        text(
+            """
+            SELECT CASE WHEN i.inhrelid IS NULL THEN 'detached'
+                        WHEN i.inhdetachpending THEN 'detaching'
+                        ELSE 'attached' END
+            FROM (SELECT to_regclass(:name) AS oid) t
+            LEFT JOIN pg_inherits i ON i.inhrelid = t.oid
+            WHERE t.oid IS NOT NULL
+            """
+        ),
+        {"name": name}
+    ).scalar()
+
+
+def _create_partition(conn, collection: str) -> None:
+    name = partition_name(collection)
+    state = _partition_state(conn, name)
+    if state == "attached":
+        return
+    if state is not None:
+        raise ValueError(
+            f"Table '{name}' exists but is not an attached partition (interrupted drop?); "
+            f"run `python -m app.partitions drop {collection}` first."
+        )
+    # Created standalone and then attached: ATTACH PARTITION only takes a SHARE
+    # UPDATE EXCLUSIVE lock on the parent, CREATE TABLE ... PARTITION OF an
+    # ACCESS EXCLUSIVE one that would stall searches on every collection.
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {Config.PG_TABLE_NAME} INCLUDING DEFAULTS)"))
+    conn.execute(text(f"ALTER TABLE {Config.PG_TABLE_NAME} ATTACH PARTITION {name} FOR VALUES IN ('{collection}')"))
+
+
+def ensure_collection_partition(collection: str) -> None:
+    """
+    Creates the partition for a collection if it does not exist yet. Must run
+    before the collection's first chunks are written, outside any transaction
+    that has written to documents (the partition's foreign key locks it).
+    """
+    collection = normalize_collection(collection)
+    with db.engine.begin() as conn:
+        if not is_partitioned(conn):
+            return
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": partition_name(collection)})
+        _create_partition(conn, collection)
+
+
+def migrate_to_partitioned() -> bool:
+    """
+    Rebuilds an unpartitioned chunk table as a partitioned one, copying every
+    chunk into its document's collection partition. Runs in one transaction and
+    holds an exclusive lock on the table while it copies. Returns False if the
+    table was already partitioned.
+    """
+    table = Config.PG_TABLE_NAME
+    legacy = f"{table}_premigration"
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_upgrade'))"))
+        if is_partitioned(conn):
+            return False
+
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+
+        # Index and sequence names are schema-wide; free them for the new table.
+        indexes = conn.execute(
+            text(
+                """
+                SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = to_regclass(:table) AND NOT i.indisprimary
+                """
+            ),
+            {"table": legacy}
+        ).scalars().all()
+        for index in indexes:
+            conn.execute(text(f"DROP INDEX {index}"))
+        primary_key = conn.execute(
+            text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'"),
+            {"table": legacy}
+        ).scalar()
+        if primary_key:
+            conn.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {primary_key} TO {legacy}_pkey"))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": legacy}).scalar()
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {legacy}_id_seq"))
+
+        DocumentChunk.__table__.create(conn)
+        collections = conn.execute(
+            text("SELECT DISTINCT collection FROM documents UNION SELECT :default"),
+            {"default": DEFAULT_COLLECTION}
+        ).scalars().all()
+        for collection in collections:
+            _create_partition(conn, collection)
+
+        copied = conn.execute(text(
+            f"""
+            INSERT INTO {table} (id, content, content_hash, embedding, document_id, collection)
+            SELECT c.id, c.content, c.content_hash, c.embedding, c.document_id, d.collection
+            FROM {legacy} c JOIN documents d ON d.id = c.document_id
+            """
+        )).rowcount
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)"
+        ))
+        conn.execute(text(f"DROP TABLE {legacy}"))
+    app_logger.info(f"Partitioned '{table}' into {len(collections)} collection(s), {copied} chunks copied.")
+    return True
+
+
+def drop_collection(collection: str) -> int:
+    """
+    Deletes a collection: detaches and drops its partition (without blocking
+    searches on other collections), then deletes its documents. Returns the
+    number of documents deleted.
+    """
+    collection = normalize_collection(collection)
+    name = partition_name(collection)
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        state = _partition_state(conn, name)
+        if state == "attached":
+            conn.execute(text(f"ALTER TABLE {Config.PG_TABLE_NAME} DETACH PARTITION {name} CONCURRENTLY"))
+        elif state == "detaching":
+            conn.execute(text(f"ALTER TABLE {Config.PG_TABLE_NAME} DETACH PARTITION {name} FINALIZE"))
+
+    with db.engine.begin() as conn:
+        if state is not None:
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        # Still needed while the chunk table is unpartitioned.
+        conn.execute(text(f"DELETE FROM {Config.PG_TABLE_NAME} WHERE collection = :collection"), {"collection": collection})
+        deleted = conn.execute(
+            text("DELETE FROM documents WHERE collection = :collection"), {"collection": collection}
+        ).rowcount
+        bump_kb_version(conn)
+    app_logger.info(f"Dropped collection '{collection}' ({deleted} documents).")
+    return deleted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chunk table partition maintenance.")
+    parser.add_argument("command", choices=("migrate", "list", "drop"))
+    parser.add_argument("collection", nargs="?")
+    args = parser.parse_args()
+    if args.command == "drop" and not args.collection:
+        parser.error("drop requires a collection")
+
+    from . import create_app
+    app = create_app(start_background_tasks=False)
+    with app.app_context():
+        if args.command == "migrate":
+            if migrate_to_partitioned():
+                print(f"'{Config.PG_TABLE_NAME}' is now partitioned by collection.")
+            else:
+                print(f"'{Config.PG_TABLE_NAME}' is already partitioned.")
+        elif args.command == "list":
+            with db.engine.connect() as conn:
+                if not is_partitioned(conn):
+                    print(f"'{Config.PG_TABLE_NAME}' is not partitioned; run `python -m app.partitions migrate`.")
+                for name, rows, size in list_partitions(conn):
+                    print(f"{name}: ~{rows} rows, {size / 1024 / 1024:.1f} MiB")
+        else:
+            print(f"Deleted {drop_collection(args.collection)} documents.")
+
+
+if __name__ == "__main__":
+    main()
@@ -93,4 +93,17 @@ Always after every response make sure that you cleared the users doubt, or else
 <ol> <li>Always respond in English only.</li> <li>Use the retrieval tool for Online TCS-related queries.</li> <li>Stay within ERP-related topics and modules only.</li> <li>Format every reply using clean HTML.</li> <li>Ask clarifying questions when needed.</li> <li>Refer to your data as a “knowledge base.”</li> <li>Provide empathetic guidance and suggest contacting support if necessary.</li> <li>Maintain professionalism, warmth, and clarity at all times.</li> </ol>
 
 """
-    return instruction_prompt_v1
\ No newline at end of file
+    return instruction_prompt_v1
+
+def return_instructions_compaction(max_chars: int) -> str:
+
+    instruction_prompt = f"""
+You condense an earlier part of a support conversation between a user and the Online TCS AI Support Assistant.
+The summary replaces those turns in the assistant's memory, so keep everything a later answer may depend on:
+the user's role and goal, the ERP modules, screens and records discussed, steps already tried, answers and
+instructions already given, and any open questions. Drop greetings and repetition. If the transcript starts
+with an earlier summary, merge it in.
+
+Write plain text (no HTML), at most {max_chars} characters, in the third person ("The user asked ...").
+"""
+    return instruction_prompt
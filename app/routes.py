@@ -1,22 +1,27 @@
 # file: app/routes.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from marshmallow import ValidationError
 from flask_jwt_extended import (
     jwt_required, create_access_token, get_jwt_identity, get_jwt
 )
+import asyncio
+import hmac
+import json
 import logging
 import uuid
-import threading  # <-- ADDED IMPORT
 from functools import wraps 
 
 from . import limiter
 from .schemas import LoginSchema, SessionSchema, QuestionSchema
-from .services import run_agent_async, get_session_service
+from .services import answer_question, stream_answer, get_session_service
 from .exceptions import AgentError
 from .config import Config 
+from .metrics import render_metrics
+from .warmup import is_ready
 
-from .models import db, Document, DocumentChunk
-from .ingestion_service import process_and_store_document
+from .models import db, Document, DEFAULT_COLLECTION
+from .partitions import normalize_collection
+from .job_queue import enqueue_document, notify_ingestion_workers, IN_FLIGHT_STATUSES
 
 # Get the loggers
 app_logger = logging.getLogger('app')
@@ -24,7 +29,6 @@ security_logger = logging.getLogger('security')
 error_logger = logging.getLogger('error')
 
 api_bp = Blueprint('api', __name__)
-session_service = get_session_service()
 
 
 def admin_required(fn):
@@ -44,8 +48,22 @@ def admin_required(fn):
 
 @api_bp.route("/health", methods=["GET"])
 def health_check():
+    if not is_ready():
+        return jsonify({"status": "warming_up"}), 503
     return jsonify({"status": "ok"}), 200
 
+@api_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics of every worker process on this host."""
+    if not Config.METRICS_ENABLED:
+        return jsonify({"error": "Resource not found"}), 404
+    if Config.METRICS_BEARER_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), Config.METRICS_BEARER_TOKEN.encode()):
+            return jsonify({"error": "Unauthorized"}), 401
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @api_bp.route("/login", methods=["POST"])
 @limiter.limit("10 per minute")
 def login():
@@ -83,17 +101,11 @@ async def start_session():
         session_name = data["session_name"]
         if username != current_user:
             return jsonify({"error": "Forbidden"}), 403
-        try:
-            existing_session = await session_service.get_session( 
-                app_name=Config.APP_NAME, user_id=username, session_id=session_name
-            )
-            if existing_session:
-                return jsonify({"message": "Session already exists"}), 200
-        except Exception as e:
-            if "Session not found" not in str(e): raise e
-        await session_service.create_session(
+        created = await get_session_service().create_session_if_absent(
             app_name=Config.APP_NAME, user_id=username, session_id=session_name
         )
+        if not created:
+            return jsonify({"message": "Session already exists"}), 200
         return jsonify({"message": "Session created"}), 201
     except ValidationError as err:
         return jsonify({"error": err.messages}), 400
@@ -104,6 +116,9 @@ async def start_session():
 @api_bp.route("/ask", methods=["POST"])
 @jwt_required()
 async def ask():
+    if request.accept_mimetypes.best == "text/event-stream":
+        return await _stream_ask_response()
+
     current_user = get_jwt_identity() 
     model_choice = ""
     try:
@@ -115,20 +130,21 @@ async def ask():
         if username != current_user:
             return jsonify({"error": "Forbidden"}), 403
         
+        # Existence only; the runner loads the session itself.
         try:
-            session = await session_service.get_session(
+            session_exists = await get_session_service().session_exists(
                 app_name=current_app.config['APP_NAME'],
                 user_id=username,
                 session_id=session_name
             )
-            if not session:
+            if not session_exists:
                 return jsonify({"error": f"Session '{session_name}' not found."}), 404
         except Exception as e:
-            error_logger.error(f"Error during get_session for user '{username}': {e}", exc_info=True)
+            error_logger.error(f"Error during session lookup for user '{username}': {e}", exc_info=True)
             return jsonify({"error": "An error occurred while retrieving the session."}), 500
         
-        response_text = await run_agent_async(
-            username, session_name, data["question"], model=model_choice
+        response_text = await answer_question(
+            username, session_name, data["question"], model=model_choice, collection=data["collection"]
         )
         return jsonify({"response": response_text})
     except ValidationError as err:
@@ -139,6 +155,81 @@ async def ask():
         error_logger.error(f"Ask endpoint error: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred"}), 500
 
+def _sse_event(name: str, payload: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _sse_stream(agen):
+    """
+    Drives an async generator of (event_name, payload) tuples from the (sync) response
+    iterator on a private event loop and formats each item as a Server-Sent Event.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                name, payload = loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+            except AgentError as e:
+                yield _sse_event("error", {"error": str(e)})
+                break
+            except Exception as e:
+                error_logger.error(f"Ask stream error: {e}", exc_info=True)
+                yield _sse_event("error", {"error": "An internal server error occurred"})
+                break
+            yield _sse_event(name, payload)
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
+async def _stream_ask_response():
+    current_user = get_jwt_identity()
+    try:
+        data = QuestionSchema().load(request.json)
+        username = data["username"]
+        session_name = data["session_name"]
+
+        if username != current_user:
+            return jsonify({"error": "Forbidden"}), 403
+
+        # Existence only; the runner loads the session itself.
+        try:
+            session_exists = await get_session_service().session_exists(
+                app_name=current_app.config['APP_NAME'],
+                user_id=username,
+                session_id=session_name
+            )
+            if not session_exists:
+                return jsonify({"error": f"Session '{session_name}' not found."}), 404
+        except Exception as e:
+            error_logger.error(f"Error during session lookup for user '{username}': {e}", exc_info=True)
+            return jsonify({"error": "An error occurred while retrieving the session."}), 500
+
+        events = stream_answer(
+            username, session_name, data["question"], model=data["model"], collection=data["collection"]
+        )
+        return Response(
+            stream_with_context(_sse_stream(events)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    except ValidationError as err:
+        return jsonify({"error": err.messages}), 400
+    except Exception as e:
+        error_logger.error(f"Ask stream endpoint error: {e}", exc_info=True)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+@api_bp.route("/ask/stream", methods=["POST"])
+@jwt_required()
+async def ask_stream():
+    """
+    Streaming variant of /ask. Responds with text/event-stream and emits 'delta',
+    'tool_call', 'tool_result' and finally 'final' (or 'error') events.
+    """
+    return await _stream_ask_response()
+
 @api_bp.route("/end_session", methods=["POST"])
 @jwt_required()
 async def end_session():
@@ -149,7 +240,7 @@ async def end_session():
         session_name = data["session_name"]
         if username != current_user:
             return jsonify({"error": "Forbidden"}), 403
-        await session_service.delete_session( 
+        await get_session_service().delete_session( 
             app_name=Config.APP_NAME, user_id=username, session_id=session_name
         )
         return jsonify({"message": "Session deleted"}), 200
@@ -161,65 +252,38 @@ async def end_session():
 
 
 
-def run_ingestion_in_background(app, doc_id):
-    """
-    Runs the blocking ingestion process in a new thread with its own app context
-    to avoid blocking the main ASGI server.
-    """
-    with app.app_context():
-        try:
-            doc = Document.query.get(doc_id)
-            if not doc:
-                error_logger.error(f"[BG_JOB] Failed to find Document {doc_id} to start ingestion.")
-                return
-
-            process_and_store_document(doc) 
-
-        except Exception as e:
-            error_logger.error(f"[BG_JOB] Ingestion failed for {doc_id}: {e}", exc_info=True)
-            try:
-                db.session.rollback() 
-                doc_to_fail = Document.query.get(doc_id)
-                if doc_to_fail:
-                    doc_to_fail.processing_status = "FAILED"
-                    doc_to_fail.processing_error = f"Background task error: {str(e)}"
-                    db.session.commit()
-            except Exception as db_e:
-                error_logger.error(f"[BG_JOB] FATAL: Failed to even update error status for {doc_id}: {db_e}")
-
-
 @api_bp.route("/document", methods=["POST"])
 @admin_required
 def create_document():
     """
-    Creates a new Document record and triggers ingestion IN THE BACKGROUND.
-    Expects JSON: { "source_url": "...", "display_name": "My Doc Name" }
+    Creates a new Document record and queues it for ingestion by the worker pool.
+    Expects JSON: { "source_url": "...", "display_name": "My Doc Name", "collection": "fees" }
+    ("collection" is optional and defaults to "general").
     """
     data = request.json
     if not all(k in data for k in ("source_url", "display_name")):
         return jsonify({"error": "Missing required fields: source_url and display_name"}), 400
+    try:
+        collection = normalize_collection(data.get("collection")) or DEFAULT_COLLECTION
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         new_doc = Document(
             source_url=data["source_url"],
             display_name=data["display_name"],
-            processing_status="PENDING"
+            collection=collection
         )
+        enqueue_document(new_doc)
         db.session.add(new_doc)
         db.session.commit() 
-        
-        app = current_app._get_current_object() 
-        
-        thread = threading.Thread(
-            target=run_ingestion_in_background, 
-            args=(app, new_doc.id)
-        )
-        thread.start()
+        notify_ingestion_workers()
      
         return jsonify({
             "message": "Document ingestion started.", 
             "status": new_doc.processing_status,
-            "document_id": new_doc.id
+            "document_id": new_doc.id,
+            "collection": new_doc.collection
         }), 201
 
     except Exception as e:
@@ -233,14 +297,22 @@ def create_document():
 @api_bp.route("/document_details", methods=["GET"])
 @jwt_required()
 def get_documents():
-    """Lists all documents and their processing status."""
+    """Lists all documents and their processing status, optionally filtered by ?collection=."""
     try:
-        documents = Document.query.all()
+        query = Document.query
+        try:
+            collection = normalize_collection(request.args.get("collection"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if collection:
+            query = query.filter_by(collection=collection)
+        documents = query.all()
         results = [
             {
                 "id": doc.id,
                 "display_name": doc.display_name,
                 "source_url": doc.source_url,
+                "collection": doc.collection,
                 "status": doc.processing_status,
                 "error": doc.processing_error,
                 "created_at": doc.created_at.isoformat(),
@@ -266,6 +338,7 @@ def get_document(doc_id):
         "id": doc.id,
         "display_name": doc.display_name,
         "source_url": doc.source_url,
+        "collection": doc.collection,
         "status": doc.processing_status,
         "error": doc.processing_error,
         "created_at": doc.created_at.isoformat(),
@@ -298,8 +371,9 @@ def delete_document(doc_id):
 @admin_required
 def re_ingest_document(doc_id):
     """
-    Re-processes a document. This deletes all old chunks and re-runs
-    the full ingestion pipeline IN THE BACKGROUND.
+    Re-processes a document. Queues it for the worker pool, which re-downloads
+    the source and re-embeds only new or changed chunks (nothing at all if the
+    file is unchanged).
     """
     try:
         doc_uuid = uuid.UUID(doc_id)
@@ -309,21 +383,12 @@ def re_ingest_document(doc_id):
     doc = Document.query.get_or_404(doc_uuid)
     
     try:
-        # 1. Delete all existing chunks (This is fast)
-        DocumentChunk.query.filter_by(document_id=doc.id).delete()
-        
-        # 2. Reset status
-        doc.processing_status = "PENDING_REINGEST"
-        doc.processing_error = None
+        if doc.processing_status in IN_FLIGHT_STATUSES:
+            return jsonify({"error": "Document is currently being ingested."}), 409
+
+        enqueue_document(doc, status="PENDING_REINGEST")
         db.session.commit()
-        
-        # 3. Get app context and run ingestion in background thread
-        app = current_app._get_current_object() 
-        thread = threading.Thread(
-            target=run_ingestion_in_background, 
-            args=(app, doc.id)
-        )
-        thread.start()
+        notify_ingestion_workers()
         
         app_logger.info(f"Admin '{get_jwt_identity()}' triggered re-ingestion for {doc_id}")
         
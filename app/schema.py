@@ -0,0 +1,70 @@
+import argparse
+import logging
+from sqlalchemy import text
+
+from .models import db
+
+app_logger = logging.getLogger('app')
+
+# db.create_all() only creates missing tables. Columns and indexes added to
+# existing tables after the first deployment are applied here, idempotently.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS locked_by VARCHAR(100)",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS locked_at TIMESTAMPTZ",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS documents_job_queue_idx ON documents (processing_status, next_attempt_at)",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS source_hash VARCHAR(64)",
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_content_hash ON document_chunks (content_hash)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id ON document_chunks (document_id)",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS collection VARCHAR(50) NOT NULL DEFAULT 'general'",
+    "CREATE INDEX IF NOT EXISTS ix_documents_collection ON documents (collection)",
+    # Lets a not-yet-partitioned table take writes until `python -m app.partitions migrate` runs.
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS collection VARCHAR(50) NOT NULL DEFAULT 'general'",
+    "ALTER TABLE answer_cache ADD COLUMN IF NOT EXISTS collection VARCHAR(50)",
+]
+
+
+def upgrade_schema() -> None:
+    """Applies SCHEMA_UPGRADES in one transaction, serialized across workers."""
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_upgrade'))"))
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+    app_logger.info("Database schema upgrades applied.")
+
+
+def setup_schema() -> bool:
+    """
+    Runs db.create_all() and upgrade_schema() in one worker at a time. Workers
+    starting together wait for the one that got there first and skip their own
+    run. Returns whether this worker ran them.
+    """
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(hashtext('schema_setup'))")).scalar():
+            conn.execute(text("SELECT pg_advisory_lock(hashtext('schema_setup'))"))
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext('schema_setup'))"))
+            app_logger.info("Database schema was set up by another worker.")
+            return False
+        try:
+            db.create_all()
+            upgrade_schema()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext('schema_setup'))"))
+    return True
+
+
+def main() -> None:
+    argparse.ArgumentParser(
+        description="Creates missing tables and applies schema upgrades (for SCHEMA_SETUP_ON_STARTUP=false)."
+    ).parse_args()
+    from . import create_app
+    app = create_app(start_background_tasks=False)
+    with app.app_context():
+        setup_schema()
+    print("Database schema is up to date.")
+
+
+if __name__ == "__main__":
+    main()
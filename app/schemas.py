@@ -1,4 +1,6 @@
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, fields, validate, post_load, ValidationError
+
+from .partitions import normalize_collection
 
 class LoginSchema(Schema):
     """Schema for login request validation."""
@@ -18,4 +20,14 @@ class QuestionSchema(Schema):
     model = fields.String(
         required=True,
         validate=validate.OneOf(["gemini", "deepseek", "openai"])
-    )
\ No newline at end of file
+    )
+    # Optional: restrict retrieval to one collection (ERP module)
+    collection = fields.String(load_default=None, allow_none=True)
+
+    @post_load
+    def normalize(self, data, **kwargs):
+        try:
+            data["collection"] = normalize_collection(data["collection"])
+        except ValueError as e:
+            raise ValidationError(str(e), field_name="collection")
+        return data
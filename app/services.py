@@ -1,56 +1,203 @@
 import asyncio
 import logging
-from google.adk.sessions import DatabaseSessionService
+import threading
+import time
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai.types import Content, Part
 
-from .agent import agents
+from .agent import get_agent, _get_sync_embedding, COLLECTION_STATE_KEY
+from .answer_cache import lookup_answer, store_answer
+from .cache import normalize_query
 from .config import Config
 from .exceptions import AgentError
+from .metrics import AGENT_TURN_SECONDS, timed, timed_pool_class
+from .session_compaction import SessionCompactor
+from .session_store import CachedDatabaseSessionService
+from .single_flight import SingleFlight, TEXT_CODEC, flight_key
 
 logger = logging.getLogger(__name__)
 
-# --- Initialize a runner for each agent ---
-try:
-    session_service = DatabaseSessionService(db_url=Config.DATABASE_URL)
-    
-    runners = {
-        name: Runner(agent=agent, app_name=Config.APP_NAME, session_service=session_service)
-        for name, agent in agents.items()
-    }
+answer_flight = SingleFlight("answer")
 
-except Exception as e:
-    logger.critical(f"Failed to initialize agent services: {e}")
-    raise
+# --- Session service and runners, created on first use ---
+# Constructing the session service connects to the database and a runner needs
+# its agent's model client, so neither happens at import time.
+session_service = None
+session_compactor = None
+runners = {}
+_init_lock = threading.Lock()
 
-async def run_agent_async(user_id: str, session_id: str, user_input: str, model: str = "gemini") -> str:
+def get_session_service():
+    """Returns the singleton session_service instance."""
+    global session_service, session_compactor
+    if session_service is None:
+        with _init_lock:
+            if session_service is None:
+                try:
+                    service = CachedDatabaseSessionService(
+                        db_url=Config.DATABASE_URL, poolclass=timed_pool_class('sessions')
+                    )
+                    session_compactor = SessionCompactor(service)
+                except Exception as e:
+                    logger.critical(f"Failed to initialize the session service: {e}")
+                    raise
+                session_service = service
+    return session_service
+
+def get_runner(model: str) -> Runner | None:
+    """Returns the runner for a model choice, creating it on first use; None if there is no such agent."""
+    runner = runners.get(model)
+    if runner is not None:
+        return runner
+    service = get_session_service()
+    with _init_lock:
+        if model not in runners:
+            agent = get_agent(model)
+            if agent is None:
+                return None
+            runners[model] = Runner(agent=agent, app_name=Config.APP_NAME, session_service=service)
+    return runners[model]
+
+async def run_agent_async(user_id: str, session_id: str, user_input: str, model: str = "gemini",
+                          collection: str | None = None) -> str:
     """
     Asynchronously runs the agent and returns the final response.
-    Selects the agent runner based on the 'model' parameter.
+    Selects the agent runner based on the 'model' parameter; 'collection'
+    restricts the retrieval tool to one collection for this turn.
     """
-    runner = runners.get(model)
+    content = Content(role="user", parts=[Part(text=user_input)])
+    final_response = ""
+
+    try:
+        runner = get_runner(model)
+        with timed(AGENT_TURN_SECONDS, model=model, streaming="false"):
+            async for event in runner.run_async(
+                user_id=user_id, session_id=session_id, new_message=content,
+                state_delta={COLLECTION_STATE_KEY: collection}
+            ):
+                if event.is_final_response() and event.content and event.content.parts:
+                    part = event.content.parts[0]
+                    if hasattr(part, 'text'):
+                        final_response = part.text.strip()
+
+        if not final_response:
+             raise AgentError("Agent failed to produce a final response.")
+
+        session_compactor.schedule(Config.APP_NAME, user_id, session_id)
+        return final_response
+    except Exception as e:
+        logger.error(
+            f"Error during agent execution for user '{user_id}' in session '{session_id}' with model '{model}': {e}",
+            exc_info=True
+        )
+        raise AgentError(f"The selected AI model ({model}) is currently unavailable or failed to process the request.")
 
+async def stream_agent_async(user_id: str, session_id: str, user_input: str, model: str = "gemini",
+                             collection: str | None = None):
+    """
+    Asynchronously runs the agent with SSE streaming enabled and yields
+    (event_name, payload) tuples as they are produced:
+    'delta' for partial text, 'tool_call' / 'tool_result' for tool progress and
+    'final' with the complete response.
+    """
     content = Content(role="user", parts=[Part(text=user_input)])
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE)
     final_response = ""
+    start = time.perf_counter()
 
     try:
-        async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
+        runner = get_runner(model)
+        async for event in runner.run_async(
+            user_id=user_id, session_id=session_id, new_message=content, run_config=run_config,
+            state_delta={COLLECTION_STATE_KEY: collection}
+        ):
+            if event.partial:
+                if event.content and event.content.parts:
+                    text = "".join(part.text for part in event.content.parts if getattr(part, 'text', None))
+                    if text:
+                        yield "delta", {"text": text}
+                continue
+
+            for call in event.get_function_calls():
+                yield "tool_call", {"name": call.name, "message": "Searching knowledge base\u2026"}
+            for function_response in event.get_function_responses():
+                status = (function_response.response or {}).get("status")
+                yield "tool_result", {"name": function_response.name, "status": status}
+
             if event.is_final_response() and event.content and event.content.parts:
                 part = event.content.parts[0]
-                if hasattr(part, 'text'):
+                if hasattr(part, 'text') and part.text:
                     final_response = part.text.strip()
-        
+
         if not final_response:
-             raise AgentError("Agent failed to produce a final response.")
-             
-        return final_response
+            raise AgentError("Agent failed to produce a final response.")
+
+        session_compactor.schedule(Config.APP_NAME, user_id, session_id)
+        yield "final", {"response": final_response}
     except Exception as e:
         logger.error(
-            f"Error during agent execution for user '{user_id}' in session '{session_id}' with model '{model}': {e}",
+            f"Error during streaming agent execution for user '{user_id}' in session '{session_id}' with model '{model}': {e}",
             exc_info=True
         )
         raise AgentError(f"The selected AI model ({model}) is currently unavailable or failed to process the request.")
+    finally:
+        AGENT_TURN_SECONDS.labels(model=model, streaming="true").observe(time.perf_counter() - start)
 
-def get_session_service():
-    """Returns the singleton session_service instance."""
-    return session_service
\ No newline at end of file
+async def _lookup_cached_answer(question: str, model: str, collection: str | None) -> tuple[str | None, list[float] | None, int | None]:
+    """Returns (cached answer, question vector, knowledge base version) for the answer cache."""
+    question_vector = await asyncio.to_thread(_get_sync_embedding, question)
+    if question_vector is None:
+        return None, None, None
+    cached_answer, kb_version = await asyncio.to_thread(lookup_answer, question_vector, model, collection)
+    return cached_answer, question_vector, kb_version
+
+async def _remember_answer(question_vector, model: str, kb_version, response: str, collection: str | None) -> None:
+    if question_vector is not None and kb_version is not None:
+        await asyncio.to_thread(store_answer, question_vector, model, kb_version, response, collection)
+
+async def answer_question(user_id: str, session_id: str, question: str, model: str = "gemini",
+                          collection: str | None = None) -> str:
+    """
+    Answers a question, consulting the semantic answer cache first when it is enabled.
+    A cache hit skips the agent entirely, so the turn is not added to the session history.
+    With ANSWER_COALESCING_ENABLED, identical questions asked concurrently (same model
+    and collection) share one agent run; only the leader's session records the turn.
+    """
+    if not Config.ANSWER_COALESCING_ENABLED:
+        return await _answer_question(user_id, session_id, question, model, collection)
+    key = flight_key(model, collection, normalize_query(question))
+    return await answer_flight.do_async(
+        key, lambda: _answer_question(user_id, session_id, question, model, collection), codec=TEXT_CODEC
+    )
+
+async def _answer_question(user_id: str, session_id: str, question: str, model: str,
+                           collection: str | None) -> str:
+    if not Config.ANSWER_CACHE_ENABLED:
+        return await run_agent_async(user_id, session_id, question, model=model, collection=collection)
+
+    cached_answer, question_vector, kb_version = await _lookup_cached_answer(question, model, collection)
+    if cached_answer is not None:
+        return cached_answer
+
+    response = await run_agent_async(user_id, session_id, question, model=model, collection=collection)
+    await _remember_answer(question_vector, model, kb_version, response, collection)
+    return response
+
+async def stream_answer(user_id: str, session_id: str, question: str, model: str = "gemini",
+                        collection: str | None = None):
+    """Streaming counterpart of answer_question; a cache hit yields only the 'final' event."""
+    if not Config.ANSWER_CACHE_ENABLED:
+        async for item in stream_agent_async(user_id, session_id, question, model=model, collection=collection):
+            yield item
+        return
+
+    cached_answer, question_vector, kb_version = await _lookup_cached_answer(question, model, collection)
+    if cached_answer is not None:
+        yield "final", {"response": cached_answer, "cached": True}
+        return
+
+    async for name, payload in stream_agent_async(user_id, session_id, question, model=model, collection=collection):
+        if name == "final":
+            await _remember_answer(question_vector, model, kb_version, payload["response"], collection)
+        yield name, payload
@@ -0,0 +1,238 @@
+"""
+Bounded ADK session history.
+
+Every /ask loads and replays a session's whole event history, including the
+retrieved context of every earlier tool call. After each agent turn the
+session is queued for a background thread; once it holds more than
+SESSION_COMPACTION_MAX_TURNS turns, all but the last
+SESSION_COMPACTION_KEEP_TURNS are replaced by a single summary event, and the
+retrieved context of tool results older than SESSION_KEEP_TOOL_OUTPUT_TURNS is
+blanked. Compaction only rewrites rows of the events table: the sessions row
+(and its update_time, which ADK uses to detect stale sessions) is left alone,
+so it never conflicts with a turn that is running at the same time.
+"""
+import logging
+import queue
+import threading
+import uuid
+
+import google.generativeai as genai
+from google.adk.events import Event
+from google.adk.sessions import Session
+from google.adk.sessions.database_session_service import StorageEvent
+from google.genai.types import Content, Part
+from sqlalchemy import func
+
+from .config import Config
+from .prompts import return_instructions_compaction
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+# Summary events are authored by "user" (every model accepts them as context)
+# and recognised by their invocation id, so they never count as a turn.
+COMPACTION_INVOCATION_PREFIX = "compaction-"
+SUMMARY_PREFIX = "[Summary of the earlier conversation]"
+STALE_CONTEXT = "[Retrieved context removed from history; search again if needed.]"
+_EXTRACTIVE_ANSWER_CHARS = 300
+
+
+def _is_summary(event: StorageEvent) -> bool:
+    return (event.invocation_id or "").startswith(COMPACTION_INVOCATION_PREFIX)
+
+
+def _text_of(content: dict | None) -> str:
+    if not content:
+        return ""
+    return "".join(
+        part["text"] for part in content.get("parts") or [] if part.get("text") and not part.get("thought")
+    ).strip()
+
+
+def _is_turn_start(event: StorageEvent) -> bool:
+    """A turn starts with a user message (tool results are authored by the agent)."""
+    return event.author == "user" and not _is_summary(event) and bool(_text_of(event.content))
+
+
+def _strip_tool_outputs(content: dict | None) -> dict | None:
+    """Returns the content with retrieved context blanked, or None if it has none."""
+    if not content:
+        return None
+    changed = False
+    parts = []
+    for part in content.get("parts") or []:
+        function_response = part.get("function_response") or {}
+        response = function_response.get("response")
+        if isinstance(response, dict) and response.get("retrieved_context") not in (None, STALE_CONTEXT):
+            part = {**part, "function_response": {**function_response, "response": {**response, "retrieved_context": STALE_CONTEXT}}}
+            changed = True
+        parts.append(part)
+    return {**content, "parts": parts} if changed else None
+
+
+def _transcript(events: list[StorageEvent]) -> list[tuple[str, str]]:
+    """(speaker, text) lines of the conversation, without tool traffic."""
+    lines = []
+    for event in events:
+        text = _text_of(event.content)
+        if not text:
+            continue
+        if _is_summary(event):
+            lines.append(("Earlier summary", text.removeprefix(SUMMARY_PREFIX).strip()))
+        else:
+            lines.append(("User" if event.author == "user" else "Assistant", text))
+    return lines
+
+
+def _extractive_summary(lines: list[tuple[str, str]], max_chars: int) -> str:
+    """Earlier summary, questions and shortened answers, keeping the most recent lines that fit."""
+    rendered = []
+    for speaker, text in lines:
+        if speaker == "Assistant" and len(text) > _EXTRACTIVE_ANSWER_CHARS:
+            text = text[:_EXTRACTIVE_ANSWER_CHARS].rstrip() + "..."
+        rendered.append(f"{speaker}: {text}")
+    kept, size = [], 0
+    for line in reversed(rendered):
+        if size + len(line) + 1 > max_chars:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    return "\n".join(reversed(kept)) or rendered[-1][:max_chars]
+
+
+def _llm_summary(lines: list[tuple[str, str]], max_chars: int) -> str:
+    transcript = "\n".join(f"{speaker}: {text}" for speaker, text in lines)
+    model = genai.GenerativeModel(
+        Config.SESSION_COMPACTION_MODEL, system_instruction=return_instructions_compaction(max_chars)
+    )
+    response = model.generate_content(transcript, request_options={"timeout": 60})
+    return response.text.strip()[:max_chars]
+
+
+def summarize(events: list[StorageEvent]) -> str:
+    """Summary of the given events with the configured summarizer (extractive if the model fails)."""
+    lines = _transcript(events)
+    if not lines:
+        return ""
+    max_chars = Config.SESSION_COMPACTION_SUMMARY_MAX_CHARS
+    if Config.SESSION_COMPACTION_SUMMARIZER == "llm" and Config.SESSION_COMPACTION_MODEL:
+        try:
+            return _llm_summary(lines, max_chars)
+        except Exception as e:
+            error_logger.error(f"Session summary by {Config.SESSION_COMPACTION_MODEL} failed, using an extractive one: {e}")
+    return _extractive_summary(lines, max_chars)
+
+
+class SessionCompactor:
+    """Compacts sessions queued by schedule() on one background thread per process."""
+
+    def __init__(self, session_service):
+        self.session_service = session_service
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _events_filter(self, app_name: str, user_id: str, session_id: str):
+        return (
+            StorageEvent.app_name == app_name,
+            StorageEvent.user_id == user_id,
+            StorageEvent.session_id == session_id,
+        )
+
+    def turn_count(self, app_name: str, user_id: str, session_id: str) -> int:
+        """Number of user turns in the session (summary events excluded)."""
+        with self.session_service.database_session_factory() as sql_session:
+            return sql_session.query(func.count(StorageEvent.id)).filter(
+                *self._events_filter(app_name, user_id, session_id),
+                StorageEvent.author == "user",
+                StorageEvent.invocation_id.notlike(f"{COMPACTION_INVOCATION_PREFIX}%"),
+            ).scalar()
+
+    def compact(self, app_name: str, user_id: str, session_id: str) -> bool:
+        """
+        Compacts one session if it is over the turn limit. The summary is only
+        written if every summarized event still exists, i.e. no other worker
+        compacted the session meanwhile. Returns True if the session was compacted.
+        """
+        keep_turns = max(1, Config.SESSION_COMPACTION_KEEP_TURNS)
+        if self.turn_count(app_name, user_id, session_id) <= max(keep_turns, Config.SESSION_COMPACTION_MAX_TURNS):
+            return False
+
+        event_filter = self._events_filter(app_name, user_id, session_id)
+        with self.session_service.database_session_factory() as sql_session:
+            events = sql_session.query(StorageEvent).filter(*event_filter).order_by(StorageEvent.timestamp).all()
+            sql_session.expunge_all()
+        turn_starts = [i for i, event in enumerate(events) if _is_turn_start(event)]
+        if len(turn_starts) <= keep_turns:
+            return False
+
+        cut = turn_starts[-keep_turns]
+        old_events = events[:cut]
+        keep_tool_turns = Config.SESSION_KEEP_TOOL_OUTPUT_TURNS
+        tool_cut = turn_starts[-min(keep_tool_turns, len(turn_starts))] if keep_tool_turns > 0 else len(events)
+        stripped = {}
+        for event in events[cut:tool_cut]:
+            content = _strip_tool_outputs(event.content)
+            if content is not None:
+                stripped[event.id] = content
+
+        # The model call runs outside any transaction.
+        summary = summarize(old_events)
+        summary_event = None
+        if summary:
+            event = Event(
+                invocation_id=f"{COMPACTION_INVOCATION_PREFIX}{uuid.uuid4()}",
+                author="user",
+                content=Content(role="user", parts=[Part(text=f"{SUMMARY_PREFIX}\n{summary}")]),
+            )
+            summary_event = StorageEvent.from_event(
+                Session(id=session_id, app_name=app_name, user_id=user_id), event
+            )
+            # Sorts where the summarized events were, before every kept event.
+            summary_event.timestamp = old_events[-1].timestamp
+
+        old_ids = [event.id for event in old_events]
+        with self.session_service.database_session_factory() as sql_session:
+            deleted = sql_session.query(StorageEvent).filter(
+                *event_filter, StorageEvent.id.in_(old_ids)
+            ).delete(synchronize_session=False)
+            if deleted != len(old_ids):
+                sql_session.rollback()
+                app_logger.info(f"Session {session_id} changed during compaction, skipping.")
+                return False
+            if summary_event is not None:
+                sql_session.add(summary_event)
+            if stripped:
+                for event in sql_session.query(StorageEvent).filter(*event_filter, StorageEvent.id.in_(list(stripped))):
+                    event.content = stripped[event.id]
+            sql_session.commit()
+        app_logger.info(
+            f"Compacted session {session_id}: {len(old_ids)} events summarized "
+            f"({len(summary)} chars), {len(stripped)} tool results trimmed."
+        )
+        return True
+
+    def schedule(self, app_name: str, user_id: str, session_id: str) -> None:
+        """Queues a session for a compaction check; never blocks the caller."""
+        if not Config.SESSION_COMPACTION_ENABLED:
+            return
+        key = (app_name, user_id, session_id)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="session-compactor", daemon=True)
+                self._thread.start()
+        self._queue.put(key)
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            with self._lock:
+                self._pending.discard(key)
+            try:
+                self.compact(*key)
+            except Exception as e:
+                error_logger.error(f"Session compaction failed for {key[2]}: {e}", exc_info=True)
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+from typing import Any, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import DatabaseSessionService, Session
+from google.adk.sessions.database_session_service import StorageSession, StorageAppState, StorageUserState
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import LRUCache, get_memcached_client
+from .config import Config
+from .metrics import SESSION_OPERATION_SECONDS, timed
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+
+class SessionMetadataCache:
+    """
+    Remembers which sessions exist: an in-process LRU in front of memcached.
+    Only existence is cached, never absence, so a session created by another
+    worker is found at once; a deleted one may be reported by other workers'
+    LRUs for up to SESSION_CACHE_LOCAL_TTL_SECONDS.
+    """
+
+    def __init__(self, local_size: int, local_ttl_seconds: float, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUCache(local_size, local_ttl_seconds)
+
+    def key(self, app_name: str, user_id: str, session_id: str) -> str:
+        raw = f"{app_name}|{user_id}|{session_id}"
+        return "sess:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def exists(self, app_name: str, user_id: str, session_id: str) -> bool:
+        key = self.key(app_name, user_id, session_id)
+        if self.local.get(key):
+            return True
+        client = get_memcached_client()
+        if client and client.get(key):
+            self.local.set(key, True)
+            return True
+        return False
+
+    def add(self, app_name: str, user_id: str, session_id: str) -> None:
+        key = self.key(app_name, user_id, session_id)
+        self.local.set(key, True)
+        client = get_memcached_client()
+        if client:
+            client.set(key, b"1", expire=self.ttl_seconds, noreply=True)
+
+    def discard(self, app_name: str, user_id: str, session_id: str) -> None:
+        key = self.key(app_name, user_id, session_id)
+        self.local.delete(key)
+        client = get_memcached_client()
+        if client:
+            client.delete(key, noreply=False)
+
+
+class CachedDatabaseSessionService(DatabaseSessionService):
+    """
+    DatabaseSessionService with a session metadata cache, so routes can check
+    that a session exists without loading it (the Runner loads it once per
+    turn anyway), and an atomic create-if-absent for /start_session.
+    """
+
+    def __init__(self, db_url: str, **kwargs: Any):
+        super().__init__(db_url=db_url, **kwargs)
+        self.metadata_cache = SessionMetadataCache(
+            local_size=Config.SESSION_CACHE_LOCAL_SIZE,
+            local_ttl_seconds=Config.SESSION_CACHE_LOCAL_TTL_SECONDS,
+            ttl_seconds=Config.SESSION_CACHE_TTL_SECONDS,
+        )
+
+    async def session_exists(self, *, app_name: str, user_id: str, session_id: str) -> bool:
+        """True if the session exists; reads only the sessions row on a cache miss."""
+        if Config.SESSION_CACHE_ENABLED and self.metadata_cache.exists(app_name, user_id, session_id):
+            return True
+        with timed(SESSION_OPERATION_SECONDS, operation="exists"), self.database_session_factory() as sql_session:
+            found = sql_session.execute(
+                select(StorageSession.id).where(
+                    StorageSession.app_name == app_name,
+                    StorageSession.user_id == user_id,
+                    StorageSession.id == session_id,
+                )
+            ).first() is not None
+        if found and Config.SESSION_CACHE_ENABLED:
+            self.metadata_cache.add(app_name, user_id, session_id)
+        return found
+
+    async def create_session_if_absent(self, *, app_name: str, user_id: str, session_id: str) -> bool:
+        """
+        Creates an empty session unless it already exists, in one transaction
+        that is safe against concurrent callers. Returns True if it was created.
+        """
+        if Config.SESSION_CACHE_ENABLED and self.metadata_cache.exists(app_name, user_id, session_id):
+            return False
+        with timed(SESSION_OPERATION_SECONDS, operation="create"), self.database_session_factory() as sql_session:
+            sql_session.execute(
+                insert(StorageAppState).values(app_name=app_name, state={}).on_conflict_do_nothing()
+            )
+            sql_session.execute(
+                insert(StorageUserState).values(app_name=app_name, user_id=user_id, state={}).on_conflict_do_nothing()
+            )
+            created = sql_session.execute(
+                insert(StorageSession)
+                .values(app_name=app_name, user_id=user_id, id=session_id, state={})
+                .on_conflict_do_nothing()
+                .returning(StorageSession.id)
+            ).first() is not None
+            sql_session.commit()
+        if Config.SESSION_CACHE_ENABLED:
+            self.metadata_cache.add(app_name, user_id, session_id)
+        return created
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session = await super().create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+        if Config.SESSION_CACHE_ENABLED:
+            self.metadata_cache.add(app_name, user_id, session.id)
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config=None) -> Optional[Session]:
+        with timed(SESSION_OPERATION_SECONDS, operation="load"):
+            session = await super().get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+        if session is None and Config.SESSION_CACHE_ENABLED:
+            self.metadata_cache.discard(app_name, user_id, session_id)
+        return session
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        with timed(SESSION_OPERATION_SECONDS, operation="append"):
+            return await super().append_event(session=session, event=event)
+
+    async def delete_session(self, app_name: str, user_id: str, session_id: str) -> None:
+        if Config.SESSION_CACHE_ENABLED:
+            self.metadata_cache.discard(app_name, user_id, session_id)
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        if Config.SESSION_CACHE_ENABLED:
+            # Again, in case a concurrent lookup re-cached it before the row was gone.
+            self.metadata_cache.discard(app_name, user_id, session_id)
@@ -0,0 +1,200 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+Within a process, the first caller for a key (the leader) runs the work and
+every concurrent caller with the same key (a follower) waits for the leader's
+result instead of repeating it; the shared result is a concurrent.futures.Future
+because Flask runs each async view on its own event loop and thread.
+
+Across workers, a leader first takes a memcached lease (`add`); leaders in
+other workers that lose the race poll memcached for the published result and
+only run the work themselves if it does not arrive in time or the lease holder
+disappears. Without memcached, coalescing is per process only.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from .cache import get_memcached_client
+from .config import Config
+from .metrics import SINGLE_FLIGHT_CALLS
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+
+class Codec(NamedTuple):
+    """How a result is published to memcached; encode returns None for results that must not be shared."""
+    encode: Callable[[Any], bytes | None]
+    decode: Callable[[bytes], Any]
+
+
+TEXT_CODEC = Codec(
+    encode=lambda value: value.encode("utf-8") if value else None,
+    decode=lambda data: data.decode("utf-8"),
+)
+
+
+def flight_key(*parts) -> str:
+    """Stable, memcached-safe key for the given parts."""
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key; see the module docstring."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0, "remote_hits": 0}
+        self._counters = {
+            stat: SINGLE_FLIGHT_CALLS.labels(flight=name, role=role)
+            for stat, role in (("leaders", "leader"), ("followers", "follower"), ("remote_hits", "remote_hit"))
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+        self._counters[name].inc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        """Returns (future, is_leader) for a key."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            role = "leaders" if leader else "followers"
+            self._stats[role] += 1
+        self._counters[role].inc()
+        return future, leader
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException | None = None) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # A cancelled leader must not look like a cancellation of its followers.
+            future.set_exception(RuntimeError(f"{self.name} single-flight leader was interrupted: {error!r}"))
+
+    def _remote_keys(self, key: str) -> tuple[str, str]:
+        return f"sf:{self.name}:{key}:result", f"sf:{self.name}:{key}:lease"
+
+    def _remote_client(self, codec: Codec | None):
+        if codec is None or not Config.SINGLE_FLIGHT_CROSS_WORKER:
+            return None
+        return get_memcached_client()
+
+    def _try_remote(self, client, key: str, codec: Codec) -> tuple[bool, Any]:
+        """
+        One step of the cross-worker protocol. Returns (True, result) if another
+        worker published the result, (True, None) once this worker should run
+        the work itself (it holds the lease, or the lease holder is gone), and
+        (False, None) while another worker is still running it.
+        """
+        result_key, lease_key = self._remote_keys(key)
+        data = client.get(result_key)
+        if data is not None:
+            self._count("remote_hits")
+            return True, codec.decode(data)
+        if client.add(lease_key, b"1", expire=int(Config.SINGLE_FLIGHT_LEASE_SECONDS), noreply=False):
+            return True, None
+        if client.get(lease_key) is None:
+            # Lease expired or memcached is unreachable; one last look for a result.
+            data = client.get(result_key)
+            return True, codec.decode(data) if data is not None else None
+        return False, None
+
+    def _publish(self, client, key: str, codec: Codec, result) -> None:
+        result_key, lease_key = self._remote_keys(key)
+        try:
+            data = codec.encode(result) if result is not None else None
+            if data is not None:
+                client.set(result_key, data, expire=int(Config.SINGLE_FLIGHT_RESULT_TTL_SECONDS), noreply=True)
+        finally:
+            client.delete(lease_key, noreply=True)
+
+    def _lead(self, key: str, fn: Callable[[], Any], codec: Codec | None):
+        client = self._remote_client(codec)
+        if client is None:
+            return fn()
+        deadline = time.monotonic() + Config.SINGLE_FLIGHT_WAIT_SECONDS
+        while True:
+            done, result = self._try_remote(client, key, codec)
+            if done and result is not None:
+                return result
+            if done or time.monotonic() >= deadline:
+                break
+            time.sleep(Config.SINGLE_FLIGHT_POLL_SECONDS)
+        result = None
+        try:
+            result = fn()
+        finally:
+            self._publish(client, key, codec, result)
+        return result
+
+    async def _lead_async(self, key: str, fn: Callable[[], Awaitable[Any]], codec: Codec | None):
+        client = self._remote_client(codec)
+        if client is None:
+            return await fn()
+        # pymemcache blocks; its calls run in a thread so a slow memcached does not stall the loop.
+        deadline = time.monotonic() + Config.SINGLE_FLIGHT_WAIT_SECONDS
+        while True:
+            done, result = await asyncio.to_thread(self._try_remote, client, key, codec)
+            if done and result is not None:
+                return result
+            if done or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(Config.SINGLE_FLIGHT_POLL_SECONDS)
+        result = None
+        try:
+            result = await fn()
+        finally:
+            await asyncio.to_thread(self._publish, client, key, codec, result)
+        return result
+
+    def do(self, key: str, fn: Callable[[], Any], codec: Codec | None = None):
+        """Runs fn() once per key among concurrent callers (blocking); `codec` enables cross-worker sharing."""
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return fn()
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = self._lead(key, fn, codec)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]], codec: Codec | None = None):
+        """Async counterpart of do(); followers on any event loop await the leader's future."""
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return await fn()
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await self._lead_async(key, fn, codec)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
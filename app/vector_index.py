@@ -0,0 +1,242 @@
+import logging
+import math
+import re
+import threading
+from sqlalchemy import text
+
+from .config import Config
+from .models import db
+from .partitions import is_partitioned, list_partitions
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+INDEX_TYPES = ("hnsw", "ivfflat")
+STORAGE_TYPES = ("vector", "halfvec")
+SEARCH_MODES = ("direct", "binary_rescore", "matryoshka")
+# Modes whose index only yields candidates that are then re-ranked by the full embeddings.
+TWO_STAGE_MODES = ("binary_rescore", "matryoshka")
+
+# Guards against two threads of the same worker building at once; the advisory
+# lock below does the same across worker processes.
+_build_lock = threading.Lock()
+
+
+def storage_type() -> str:
+    """pgvector type of the chunk embeddings (PG_VECTOR_STORAGE)."""
+    return Config.PG_VECTOR_STORAGE if Config.PG_VECTOR_STORAGE in STORAGE_TYPES else "vector"
+
+
+def search_mode() -> str:
+    return Config.RETRIEVAL_SEARCH_MODE if Config.RETRIEVAL_SEARCH_MODE in SEARCH_MODES else "direct"
+
+
+def index_target() -> tuple[str, str, str]:
+    """
+    (name part, indexed expression, operator class) of the ANN index for the
+    active search mode. Queries must order by exactly this expression for the
+    planner to use the index.
+    """
+    column = Config.PG_VECTOR_COLUMN
+    storage = storage_type()
+    mode = search_mode()
+    if mode == "binary_rescore":
+        return "bq", f"binary_quantize({column})::bit({Config.PG_EMBEDDING_DIMENSION})", "bit_hamming_ops"
+    if mode == "matryoshka":
+        prefix = prefix_dimension()
+        return f"p{prefix}", f"subvector({column}, 1, {prefix})::{storage}({prefix})", f"{storage}_cosine_ops"
+    return column, column, f"{storage}_cosine_ops"
+
+
+def prefix_dimension() -> int:
+    """Leading embedding dimensions searched by the matryoshka candidate pass."""
+    return max(1, min(Config.RETRIEVAL_PREFIX_DIMENSION, Config.PG_EMBEDDING_DIMENSION))
+
+
+def vector_index_name(index_type: str, table: str | None = None, kind: str | None = None) -> str:
+    """
+    Name of the managed ANN index of the given type on a table (default: the
+    chunk table), for the active search mode unless `kind` is given.
+    """
+    return f"{table or Config.PG_TABLE_NAME}_{kind or index_target()[0]}_{index_type}_idx"
+
+
+def managed_vector_indexes(conn, table: str) -> list[str]:
+    """Names of every ANN index on a table that this module manages, whatever its mode or type."""
+    pattern = re.compile(
+        rf"{re.escape(table)}_({re.escape(Config.PG_VECTOR_COLUMN)}|bq|p\d+)_({'|'.join(INDEX_TYPES)})_idx"
+    )
+    names = conn.execute(
+        text(
+            """
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = to_regclass(:table)
+            """
+        ),
+        {"table": table}
+    ).scalars().all()
+    return [name for name in names if pattern.fullmatch(name)]
+
+
+def vector_index_tables(conn) -> list[str]:
+    """
+    Tables that carry an ANN index: each collection partition when the chunk
+    table is partitioned (indexes cannot be built concurrently on the parent),
+    otherwise the chunk table itself.
+    """
+    if is_partitioned(conn):
+        return [row[0] for row in list_partitions(conn)]
+    return [Config.PG_TABLE_NAME]
+
+
+def _ivfflat_lists(conn, table: str) -> int:
+    """Number of IVFFlat lists: configured, or rows/1000 (sqrt(rows) above 1M rows)."""
+    if Config.PG_IVFFLAT_LISTS > 0:
+        return Config.PG_IVFFLAT_LISTS
+    rows = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar() or 0
+    if rows > 1_000_000:
+        return max(1, int(math.sqrt(rows)))
+    return max(1, rows // 1000)
+
+
+def _index_options(index_type: str, conn, table: str) -> str:
+    if index_type == "hnsw":
+        return f"m = {Config.PG_HNSW_M}, ef_construction = {Config.PG_HNSW_EF_CONSTRUCTION}"
+    return f"lists = {_ivfflat_lists(conn, table)}"
+
+
+def _index_state(conn, name: str) -> bool | None:
+    """True if the index exists and is valid, False if invalid (failed build), None if missing."""
+    return conn.execute(
+        text(
+            """
+            SELECT i.indisvalid
+            FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = :name
+            """
+        ),
+        {"name": name}
+    ).scalar()
+
+
+def _drop_other_indexes(conn, table: str, keep: str) -> None:
+    for other in managed_vector_indexes(conn, table):
+        if other != keep:
+            app_logger.info(f"Dropping vector index '{other}' of another index type or search mode.")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {other}"))
+
+
+def _ensure_table_index(conn, index_type: str, table: str) -> bool:
+    """
+    Builds the ANN index on one table if it is missing. Indexes of another
+    type or search mode are only dropped once it is ready, so a switch never
+    leaves the table unindexed. Returns True if a valid index exists afterwards.
+    """
+    name = vector_index_name(index_type, table)
+    state = _index_state(conn, name)
+    if state is True:
+        _drop_other_indexes(conn, table, name)
+        return True
+    if state is False:
+        app_logger.warning(f"Dropping invalid vector index '{name}' left by a failed build.")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    if index_type == "ivfflat":
+        # IVFFlat centroids are trained on existing rows; an index built
+        # on an empty table has useless lists.
+        has_rows = conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table})")).scalar()
+        if not has_rows:
+            app_logger.info(f"Skipping IVFFlat index build on '{table}' until it has data.")
+            return False
+
+    _, expression, opclass = index_target()
+    options = _index_options(index_type, conn, table)
+    app_logger.info(f"Building vector index '{name}' ({index_type}, {opclass}, {options})...")
+    conn.execute(text(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+        f"ON {table} USING {index_type} "
+        f"(({expression}) {opclass}) WITH ({options})"
+    ))
+    app_logger.info(f"Vector index '{name}' is ready.")
+    _drop_other_indexes(conn, table, name)
+    return True
+
+
+def ensure_vector_index() -> bool:
+    """
+    Creates the configured ANN index on the vector column (or, in the two-stage
+    search modes, on its binary quantization or leading dimensions) if it is
+    missing, on every collection partition when the chunk table is partitioned.
+    Uses CREATE INDEX CONCURRENTLY so inserts and searches keep running during the
+    build. Leftovers of failed builds and indexes of another type or mode are dropped.
+    Returns True if every table has a valid index afterwards.
+    """
+    index_type = Config.PG_VECTOR_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        return False
+    if not _build_lock.acquire(blocking=False):
+        app_logger.info("Vector index build already running in this worker, skipping.")
+        return False
+
+    lock_name = vector_index_name(index_type)
+    try:
+        engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+        with engine.connect() as conn:
+            got_lock = conn.execute(
+                text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": lock_name}
+            ).scalar()
+            if not got_lock:
+                app_logger.info(f"Vector index '{lock_name}' is being built by another worker, skipping.")
+                return False
+            try:
+                if Config.PG_INDEX_MAINTENANCE_WORK_MEM:
+                    conn.execute(
+                        text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                        {"value": Config.PG_INDEX_MAINTENANCE_WORK_MEM}
+                    )
+                ready = True
+                for table in vector_index_tables(conn):
+                    ready = _ensure_table_index(conn, index_type, table) and ready
+                return ready
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": lock_name})
+    except Exception as e:
+        error_logger.error(f"Failed to build vector index '{lock_name}': {e}", exc_info=True)
+        return False
+    finally:
+        _build_lock.release()
+
+
+def search_settings() -> dict[str, str]:
+    """ANN search parameters (GUC name -> value) for the configured index type."""
+    index_type = Config.PG_VECTOR_INDEX_TYPE
+    if index_type == "hnsw":
+        # ef_search below the LIMIT would silently return fewer rows; in the
+        # two-stage modes the index scan's LIMIT is the candidate count.
+        limit = Config.RETRIEVAL_TOP_K
+        if search_mode() in TWO_STAGE_MODES:
+            limit = max(limit, Config.RETRIEVAL_RERANK_CANDIDATES)
+        return {"hnsw.ef_search": str(max(Config.PG_HNSW_EF_SEARCH, limit))}
+    if index_type == "ivfflat":
+        return {"ivfflat.probes": str(Config.PG_IVFFLAT_PROBES)}
+    return {}
+
+
+def apply_search_params(conn) -> None:
+    """
+    Sets the per-query ANN search parameters for the current transaction.
+    Must be called inside a transaction (SET LOCAL semantics).
+    """
+    for name, value in search_settings().items():
+        conn.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+
+
+def build_vector_index_in_background(app) -> threading.Thread:
+    """Runs ensure_vector_index in a daemon thread with its own app context."""
+    def _run():
+        with app.app_context():
+            ensure_vector_index()
+
+    thread = threading.Thread(target=_run, name="vector-index-builder", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,288 @@
+"""
+In-process mirror of the chunk vectors, so retrieval can rank chunks without a
+database round trip and only goes to Postgres to fetch the winning chunks' text.
+
+Each knowledge base version is snapshotted once per host into
+VECTOR_MIRROR_DIR: unit-normalized float32 vectors sorted by collection, their
+chunk ids and each collection's row range. Workers memory-map the snapshot, so
+they share one copy in the page cache. A background thread polls the
+knowledge_base_state version; when it moves, one worker (holding a file lock)
+exports the next snapshot and the others load it once it appears. The mirror
+only answers while its snapshot matches the current version, otherwise
+retrieval falls back to Postgres.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+
+import numpy as np
+from sqlalchemy import text
+
+from .config import Config
+from .models import db
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+_SNAPSHOT_PREFIX = "snapshot-"
+_INT16 = struct.Struct(">h")
+_INT32 = struct.Struct(">i")
+# Signature, flags and header extension length of a binary COPY stream.
+_COPY_HEADER_SIZE = 19
+_NORMALIZE_BLOCK_ROWS = 65536
+
+
+def current_kb_version(conn) -> int:
+    return conn.execute(
+        text("SELECT COALESCE((SELECT version FROM knowledge_base_state WHERE id = 1), 1)")
+    ).scalar()
+
+
+class _SnapshotSink:
+    """
+    File-like target for COPY (id, collection, embedding) TO STDOUT (FORMAT binary).
+    Parses rows as they stream in and writes the vectors straight into the
+    snapshot's memory-mapped array, so the export never holds the table in memory.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: np.ndarray):
+        self.vectors = vectors
+        self.ids = ids
+        self.ranges = {}
+        self.rows = 0
+        self._buffer = bytearray()
+        self._header_done = False
+        self._collection = None
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._parse()
+        return len(data)
+
+    def _parse(self) -> None:
+        buf = self._buffer
+        pos = 0
+        if not self._header_done:
+            if len(buf) < _COPY_HEADER_SIZE:
+                return
+            (extension,) = _INT32.unpack_from(buf, _COPY_HEADER_SIZE - 4)
+            pos = _COPY_HEADER_SIZE + extension
+            self._header_done = True
+
+        while len(buf) - pos >= 2:
+            (field_count,) = _INT16.unpack_from(buf, pos)
+            if field_count == -1:
+                pos += 2
+                break
+            fields, end = self._read_fields(buf, pos + 2, field_count)
+            if fields is None:
+                break
+            self._store(*fields)
+            pos = end
+        del buf[:pos]
+
+    @staticmethod
+    def _read_fields(buf, pos: int, field_count: int):
+        """Returns (fields, end position), or (None, pos) if the row is not complete yet."""
+        fields = []
+        for _ in range(field_count):
+            if len(buf) - pos < 4:
+                return None, pos
+            (length,) = _INT32.unpack_from(buf, pos)
+            pos += 4
+            if len(buf) - pos < length:
+                return None, pos
+            fields.append(bytes(buf[pos:pos + length]))
+            pos += length
+        return fields, pos
+
+    def _store(self, chunk_id: bytes, collection: bytes, embedding: bytes) -> None:
+        row = self.rows
+        self.ids[row] = _INT32.unpack(chunk_id)[0]
+        # pgvector binary format: int16 dimension, int16 unused, big-endian float4 values
+        self.vectors[row] = np.frombuffer(embedding, dtype=">f4", offset=4)
+        name = collection.decode("utf-8")
+        if name != self._collection:
+            self._collection = name
+            self.ranges[name] = [row, row]
+        self.ranges[name][1] = row + 1
+        self.rows += 1
+
+
+class _Snapshot:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.version = meta["version"]
+        self.dimension = meta["dimension"]
+        self.ranges = meta["ranges"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"))
+
+
+class VectorMirror:
+    """Exact cosine top-k over a memory-mapped snapshot of document_chunks."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._snapshot = None
+        self._db_version = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def _snapshot_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"{_SNAPSHOT_PREFIX}{version}")
+
+    def ready(self) -> bool:
+        """True if a snapshot is loaded and matches the last seen knowledge base version."""
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot.version == self._db_version
+
+    def search(self, query_vector: list[float], top_k: int, collection: str | None = None) -> list[int]:
+        """Returns the ids of the top_k chunks by cosine similarity, best first."""
+        snapshot = self._snapshot
+        start, end = 0, len(snapshot.ids)
+        if collection:
+            start, end = snapshot.ranges.get(collection, (0, 0))
+        if end <= start:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query /= norm
+        scores = snapshot.vectors[start:end] @ query
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return snapshot.ids[best + start].tolist()
+
+    def _export_snapshot(self) -> None:
+        """Exports the current chunk table into a new snapshot directory."""
+        engine = db.engine.execution_options(isolation_level="REPEATABLE READ")
+        tmp = None
+        try:
+            with engine.connect() as conn:
+                # Version, row count and rows all come from the same database snapshot.
+                version = current_kb_version(conn)
+                path = self._snapshot_path(version)
+                if os.path.isdir(path):
+                    return
+                rows = conn.execute(
+                    text(f"SELECT count(*) FROM {Config.PG_TABLE_NAME} WHERE {Config.PG_VECTOR_COLUMN} IS NOT NULL")
+                ).scalar()
+
+                tmp = f"{path}.tmp-{os.getpid()}"
+                shutil.rmtree(tmp, ignore_errors=True)
+                os.makedirs(tmp)
+                dimension = Config.PG_EMBEDDING_DIMENSION
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(tmp, "vectors.npy"), mode="w+", dtype=np.float32, shape=(rows, dimension)
+                )
+                ids = np.empty(rows, dtype=np.int64)
+                sink = _SnapshotSink(vectors, ids)
+                cursor = conn.connection.cursor()
+                try:
+                    cursor.copy_expert(
+                        # ::vector so halfvec storage also arrives as float4
+                        f"COPY (SELECT id, collection, {Config.PG_VECTOR_COLUMN}::vector FROM {Config.PG_TABLE_NAME} "
+                        f"WHERE {Config.PG_VECTOR_COLUMN} IS NOT NULL ORDER BY collection, id) "
+                        f"TO STDOUT WITH (FORMAT binary)",
+                        sink
+                    )
+                finally:
+                    cursor.close()
+            if sink.rows != rows:
+                raise RuntimeError(f"Vector mirror export expected {rows} rows, got {sink.rows}.")
+
+            for start in range(0, rows, _NORMALIZE_BLOCK_ROWS):
+                block = vectors[start:start + _NORMALIZE_BLOCK_ROWS]
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                np.divide(block, norms, out=block, where=norms > 0)
+            vectors.flush()
+            del vectors
+            np.save(os.path.join(tmp, "ids.npy"), ids)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"version": version, "dimension": dimension, "rows": rows, "ranges": sink.ranges}, f)
+            # Readers only ever see complete snapshots.
+            os.rename(tmp, path)
+        except Exception:
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        app_logger.info(f"Vector mirror snapshot {version} written ({rows} chunks).")
+
+    def _snapshot_versions(self) -> dict[int, str]:
+        """Maps version -> path of every complete snapshot on disk."""
+        versions = {}
+        for name in os.listdir(self.directory):
+            if name.startswith(_SNAPSHOT_PREFIX) and ".tmp-" not in name:
+                versions[int(name[len(_SNAPSHOT_PREFIX):])] = os.path.join(self.directory, name)
+        return versions
+
+    def _prune_snapshots(self, loaded_version: int) -> None:
+        """Removes snapshots older than the loaded one; workers still mapping them keep their pages."""
+        for version, path in self._snapshot_versions().items():
+            if version < loaded_version:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def refresh(self) -> None:
+        """Polls the knowledge base version and loads (exporting first if needed) its snapshot."""
+        with db.engine.connect() as conn:
+            self._db_version = current_kb_version(conn)
+        if self.ready():
+            return
+
+        path = self._snapshot_path(self._db_version)
+        if not os.path.isdir(path):
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # another worker is exporting; load it on the next poll
+                try:
+                    self._export_snapshot()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            # The export may have seen a newer version than the one polled above.
+            versions = self._snapshot_versions()
+            if not versions:
+                return
+            path = versions[max(versions)]
+
+        snapshot = _Snapshot(path)
+        if snapshot.dimension != Config.PG_EMBEDDING_DIMENSION:
+            error_logger.error(f"Vector mirror snapshot {path} has dimension {snapshot.dimension}, ignoring it.")
+            return
+        self._snapshot = snapshot
+        app_logger.info(f"Vector mirror loaded snapshot {snapshot.version} ({len(snapshot.ids)} chunks).")
+        self._prune_snapshots(snapshot.version)
+
+    def start(self, app) -> None:
+        """Starts the background refresh thread (once)."""
+        if self._thread is not None:
+            return
+
+        def _run():
+            with app.app_context():
+                while True:
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        error_logger.error(f"Vector mirror refresh failed: {e}", exc_info=True)
+                    if self._stopping.wait(Config.VECTOR_MIRROR_REFRESH_SECONDS):
+                        return
+
+        self._thread = threading.Thread(target=_run, name="vector-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+
+vector_mirror = VectorMirror(Config.VECTOR_MIRROR_DIR)
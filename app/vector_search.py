@@ -0,0 +1,183 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy.engine import make_url
+
+from .config import Config
+from .metrics import DB_POOL_WAIT_SECONDS
+from .vector_index import search_settings, search_mode, storage_type, index_target, prefix_dimension, TWO_STAGE_MODES
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+
+def similarity_query(vector_param: str, collection_param: str | None = None) -> str:
+    """
+    Top-k cosine similarity query over the chunk table. `vector_param` is the
+    driver-specific placeholder for the query vector (":query_vec", "$1", ...);
+    with `collection_param` the search is restricted to one collection, which
+    lets the planner prune every other partition.
+
+    In the two-stage modes the index ranks RETRIEVAL_RERANK_CANDIDATES chunks
+    ("binary_rescore": Hamming distance between binary-quantized vectors,
+    "matryoshka": cosine distance between the leading embedding dimensions), and
+    only those are re-ranked by exact cosine distance on the stored embeddings.
+    """
+    where = f"WHERE collection = {collection_param} " if collection_param else ""
+    storage = storage_type()
+    query_vector = f"CAST({vector_param} AS vector)"
+    stored_query_vector = query_vector if storage == "vector" else f"CAST({query_vector} AS {storage})"
+    mode = search_mode()
+    if mode in TWO_STAGE_MODES:
+        _, expression, _ = index_target()
+        if mode == "binary_rescore":
+            candidate_order = f"{expression} <~> binary_quantize({query_vector})"
+        else:
+            prefix = prefix_dimension()
+            candidate_order = f"{expression} <=> subvector({stored_query_vector}, 1, {prefix})::{storage}({prefix})"
+        return (
+            f"SELECT {Config.PG_CONTENT_COLUMN} FROM ("
+            f"SELECT {Config.PG_CONTENT_COLUMN}, {Config.PG_VECTOR_COLUMN} "
+            f"FROM {Config.PG_TABLE_NAME} "
+            f"{where}"
+            f"ORDER BY {candidate_order} "
+            f"LIMIT {max(Config.RETRIEVAL_RERANK_CANDIDATES, Config.RETRIEVAL_TOP_K)}"
+            f") candidates "
+            f"ORDER BY {Config.PG_VECTOR_COLUMN} <=> {stored_query_vector} "
+            f"LIMIT {Config.RETRIEVAL_TOP_K}"
+        )
+    return (
+        f"SELECT {Config.PG_CONTENT_COLUMN} "
+        f"FROM {Config.PG_TABLE_NAME} "
+        f"{where}"
+        f"ORDER BY {Config.PG_VECTOR_COLUMN} <=> {stored_query_vector} "
+        f"LIMIT {Config.RETRIEVAL_TOP_K}"
+    )
+
+
+def chunk_contents_query(ids_param: str) -> str:
+    """Content of the chunks with the given ids (a driver-specific array placeholder)."""
+    return (
+        f"SELECT id, {Config.PG_CONTENT_COLUMN} "
+        f"FROM {Config.PG_TABLE_NAME} "
+        f"WHERE id = ANY({ids_param})"
+    )
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    """Turns a SQLAlchemy URL (e.g. postgresql+psycopg2://...) into a plain libpq-style DSN."""
+    url = make_url(database_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+class AsyncVectorSearch:
+    """
+    Similarity search over a shared asyncpg pool.
+
+    Flask runs every async view in a fresh event loop, and an asyncpg pool is
+    bound to the loop that created it. The pool therefore lives on one dedicated
+    loop thread per process; callers on any loop await the result through
+    run_coroutine_threadsafe. Vectors are sent with pgvector's binary codec, and
+    asyncpg's per-connection statement cache keeps the query prepared.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._pool = None
+        self._pool_lock = None
+        self._start_lock = threading.Lock()
+        self._query = similarity_query("$1")
+        self._collection_query = similarity_query("$1", "$2")
+        self._contents_query = chunk_contents_query("$1::int[]")
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name="pgvector-async-loop", daemon=True)
+                    thread.start()
+                    self._loop = loop
+        return self._loop
+
+    async def _init_connection(self, conn) -> None:
+        from pgvector.asyncpg import register_vector
+        await register_vector(conn)
+
+    async def _setup_connection(self, conn) -> None:
+        # The pool runs RESET ALL when a connection is released, so the search
+        # parameters are set again on every checkout.
+        settings = search_settings()
+        if settings:
+            calls = ", ".join(f"set_config(${2 * i + 1}, ${2 * i + 2}, false)" for i in range(len(settings)))
+            await conn.execute(f"SELECT {calls}", *[arg for item in settings.items() for arg in item])
+
+    async def _get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                import asyncpg
+                self._pool = await asyncpg.create_pool(
+                    asyncpg_dsn(Config.DATABASE_URL),
+                    min_size=Config.ASYNC_DB_POOL_MIN_SIZE,
+                    max_size=Config.ASYNC_DB_POOL_MAX_SIZE,
+                    command_timeout=Config.ASYNC_DB_COMMAND_TIMEOUT_SECONDS,
+                    init=self._init_connection,
+                    setup=self._setup_connection,
+                )
+                app_logger.info(
+                    f"asyncpg retrieval pool ready (size {Config.ASYNC_DB_POOL_MIN_SIZE}-{Config.ASYNC_DB_POOL_MAX_SIZE})."
+                )
+        return self._pool
+
+    @asynccontextmanager
+    async def _connection(self):
+        """Checks a connection out of the pool, recording the wait."""
+        pool = await self._get_pool()
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            DB_POOL_WAIT_SECONDS.labels(pool="asyncpg").observe(time.perf_counter() - start)
+            yield conn
+
+    async def _search(self, query_vector: list[float], collection: str | None) -> list[str]:
+        async with self._connection() as conn:
+            if collection:
+                rows = await conn.fetch(self._collection_query, query_vector, collection)
+            else:
+                rows = await conn.fetch(self._query, query_vector)
+        return [row[0] for row in rows]
+
+    async def search(self, query_vector: list[float], collection: str | None = None) -> list[str]:
+        """Returns the content of the top-k chunks closest to the query vector, optionally within one collection."""
+        future = asyncio.run_coroutine_threadsafe(self._search(query_vector, collection), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    async def _fetch_contents(self, ids: list[int]) -> dict[int, str]:
+        async with self._connection() as conn:
+            rows = await conn.fetch(self._contents_query, ids)
+        return {row[0]: row[1] for row in rows}
+
+    async def fetch_contents(self, ids: list[int]) -> dict[int, str]:
+        """Maps chunk id -> content for the given ids (missing ids were deleted meanwhile)."""
+        future = asyncio.run_coroutine_threadsafe(self._fetch_contents(ids), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    def close(self) -> None:
+        """Closes the pool; safe to call if it was never opened."""
+        if self._loop is None or self._pool is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._pool.close(), self._loop).result(timeout=5)
+        except Exception as e:
+            error_logger.error(f"Failed to close asyncpg retrieval pool: {e}")
+        self._pool = None
+
+
+vector_search = AsyncVectorSearch()
+atexit.register(vector_search.close)
@@ -0,0 +1,131 @@
+"""
+Storage precision of the chunk embeddings.
+
+PG_VECTOR_STORAGE picks the column type: "vector" (float32) or "halfvec"
+(float16, half the table and index size). RETRIEVAL_SEARCH_MODE
+"binary_rescore" indexes the embeddings' binary quantization instead, and
+"matryoshka" their first RETRIEVAL_PREFIX_DIMENSION dimensions (the embedding
+model's Matryoshka training keeps a prefix meaningful on its own); both
+re-rank their candidates against the stored vectors (see vector_search.py)
+and need no extra column or re-embedding. All of these need pgvector 0.7 or
+newer.
+
+Changing PG_VECTOR_STORAGE for an existing table converts the stored vectors
+in place (no re-embedding):
+
+    python -m app.vector_storage status
+    python -m app.vector_storage migrate
+"""
+import argparse
+import logging
+import re
+from sqlalchemy import text
+
+from .config import Config
+from .models import db, bump_kb_version
+from .vector_index import (
+    ensure_vector_index, managed_vector_indexes, vector_index_tables, storage_type, search_mode
+)
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+# halfvec, binary_quantize, bit_hamming_ops and subvector
+_MIN_PGVECTOR_VERSION = (0, 7)
+
+
+def pgvector_version(conn) -> tuple[int, ...] | None:
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    if version is None:
+        return None
+    return tuple(int(part) for part in re.findall(r"\d+", version))
+
+
+def check_pgvector_support(conn) -> None:
+    """Raises RuntimeError if the configured storage or search mode needs a newer pgvector."""
+    if storage_type() == "vector" and search_mode() == "direct":
+        return
+    version = pgvector_version(conn)
+    if version is None or version < _MIN_PGVECTOR_VERSION:
+        found = ".".join(map(str, version)) if version else "not installed"
+        raise RuntimeError(
+            f"PG_VECTOR_STORAGE={storage_type()} / RETRIEVAL_SEARCH_MODE={search_mode()} "
+            f"need pgvector >= 0.7 (found {found})."
+        )
+
+
+def column_type(conn) -> str | None:
+    """Current type of the embedding column, e.g. "vector(768)" or "halfvec(768)"."""
+    return conn.execute(
+        text(
+            """
+            SELECT format_type(a.atttypid, a.atttypmod)
+            FROM pg_attribute a
+            WHERE a.attrelid = to_regclass(:table) AND a.attname = :column AND NOT a.attisdropped
+            """
+        ),
+        {"table": Config.PG_TABLE_NAME, "column": Config.PG_VECTOR_COLUMN}
+    ).scalar()
+
+
+def migrate_storage() -> bool:
+    """
+    Converts the embedding column to the configured storage type, dropping the
+    ANN indexes first (their operator class is type-specific) and rebuilding
+    them afterwards. The conversion rewrites the table under an exclusive lock.
+    Returns False if the column already has the configured type.
+    """
+    target = f"{storage_type()}({Config.PG_EMBEDDING_DIMENSION})"
+    table = Config.PG_TABLE_NAME
+    column = Config.PG_VECTOR_COLUMN
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_upgrade'))"))
+        check_pgvector_support(conn)
+        current = column_type(conn)
+        if current is None:
+            raise RuntimeError(f"Column '{table}.{column}' does not exist.")
+        if current == target:
+            return False
+        dimension = re.search(r"\((\d+)\)", current)
+        if dimension and int(dimension.group(1)) != Config.PG_EMBEDDING_DIMENSION:
+            raise ValueError(
+                f"'{table}.{column}' is {current}; changing the dimension to "
+                f"{Config.PG_EMBEDDING_DIMENSION} needs re-embedding every document, not a type conversion."
+            )
+
+        for index_table in vector_index_tables(conn):
+            for index in managed_vector_indexes(conn, index_table):
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {target} USING {column}::{target}"))
+        # Stored values changed precision; snapshots of the old ones are stale.
+        bump_kb_version(conn)
+    app_logger.info(f"Converted '{table}.{column}' from {current} to {target}.")
+    ensure_vector_index()
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chunk embedding storage maintenance.")
+    parser.add_argument("command", choices=("migrate", "status"))
+    args = parser.parse_args()
+
+    from . import create_app
+    app = create_app(start_background_tasks=False)
+    with app.app_context():
+        if args.command == "migrate":
+            if migrate_storage():
+                print(f"'{Config.PG_TABLE_NAME}.{Config.PG_VECTOR_COLUMN}' now stores {storage_type()}.")
+            else:
+                print(f"'{Config.PG_TABLE_NAME}.{Config.PG_VECTOR_COLUMN}' already stores {storage_type()}.")
+        else:
+            with db.engine.connect() as conn:
+                version = pgvector_version(conn)
+                print(f"pgvector: {'.'.join(map(str, version)) if version else 'not installed'}")
+                print(f"column: {column_type(conn)} (configured: {storage_type()}({Config.PG_EMBEDDING_DIMENSION}))")
+                print(f"search mode: {search_mode()}")
+                for table in vector_index_tables(conn):
+                    print(f"{table}: {', '.join(managed_vector_indexes(conn, table)) or 'no ANN index'}")
+
+
+if __name__ == "__main__":
+    main()
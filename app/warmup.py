@@ -0,0 +1,124 @@
+"""
+Start-up warm-up of an API worker.
+
+A background thread opens the database pools and loads the ANN index pages
+into shared buffers. It also builds the runners of the WARMUP_MODELS, which
+imports their model client libraries. /health answers 503 until the warm-up
+has finished, so a load balancer only routes to warm workers. A failed step
+is logged and skipped; the worker still reports healthy afterwards.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from .config import Config
+from .models import db
+
+app_logger = logging.getLogger('app')
+error_logger = logging.getLogger('error')
+
+_ready = threading.Event()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def mark_ready() -> None:
+    _ready.set()
+
+
+def _prime_engine(engine) -> None:
+    """Opens WARMUP_DB_CONNECTIONS pooled connections at once, so they are pooled afterwards."""
+    connections = []
+    try:
+        for _ in range(Config.WARMUP_DB_CONNECTIONS):
+            conn = engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def _prime_database_pools() -> None:
+    from .services import get_session_service
+    _prime_engine(db.engine)
+    _prime_engine(get_session_service().db_engine)
+
+
+def _prewarm_vector_indexes() -> None:
+    """Loads the active ANN index of every chunk table (or partition) with pg_prewarm, if installed."""
+    from .vector_index import vector_index_name, vector_index_tables
+    if Config.PG_VECTOR_INDEX_TYPE == "none":
+        return
+    with db.engine.connect() as conn:
+        if not conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")).scalar():
+            app_logger.info("pg_prewarm is not installed; ANN index pages are only warmed by the sample search.")
+            return
+        for table in vector_index_tables(conn):
+            name = vector_index_name(Config.PG_VECTOR_INDEX_TYPE, table)
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                continue
+            blocks = conn.execute(text("SELECT pg_prewarm(CAST(:name AS regclass))"), {"name": name}).scalar()
+            app_logger.info(f"Prewarmed {blocks} blocks of index {name}.")
+        conn.commit()
+
+
+def _sample_search() -> None:
+    """
+    One unscoped search through the retrieval path: opens the asyncpg pool,
+    prepares its statements and touches the entry pages of every partition's index.
+    """
+    from .agent import _run_search
+    asyncio.run(_run_search([1.0] * Config.PG_EMBEDDING_DIMENSION, None))
+
+
+def _prime_models() -> None:
+    from .services import get_runner
+    for model in Config.WARMUP_MODELS:
+        runner = get_runner(model)
+        if runner is None:
+            error_logger.error(f"Warm-up: no agent for model '{model}'.")
+            continue
+        llm = runner.agent.canonical_model
+        # Gemini creates its API client on first use.
+        getattr(llm, "api_client", None)
+
+
+WARMUP_STEPS = (
+    ("database pools", _prime_database_pools),
+    ("vector index", _prewarm_vector_indexes),
+    ("sample search", _sample_search),
+    ("models", _prime_models),
+)
+
+
+def warm_up(app) -> None:
+    """Runs every warm-up step, then marks the worker ready."""
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            for name, step in WARMUP_STEPS:
+                step_start = time.perf_counter()
+                try:
+                    step()
+                    app_logger.info(f"Warm-up: {name} done in {time.perf_counter() - step_start:.2f}s.")
+                except Exception as e:
+                    error_logger.error(f"Warm-up step '{name}' failed: {e}", exc_info=True)
+    finally:
+        mark_ready()
+        app_logger.info(f"Worker warm-up finished in {time.perf_counter() - start:.2f}s.")
+
+
+def start_warm_up(app) -> threading.Thread | None:
+    """Runs warm_up in a daemon thread (or marks the worker ready at once when WARMUP_ENABLED is false)."""
+    if not Config.WARMUP_ENABLED:
+        mark_ready()
+        return None
+    thread = threading.Thread(target=warm_up, args=(app,), name="worker-warm-up", daemon=True)
+    thread.start()
+    return thread
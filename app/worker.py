@@ -0,0 +1,39 @@
+"""
+Standalone ingestion worker, so ingestion can be scaled separately from the API:
+
+    python -m app.worker
+
+Run the API with INGESTION_WORKER_MODE=external to leave all ingestion to these processes.
+Its Prometheus metrics are served on METRICS_WORKER_PORT (default 9100).
+"""
+import signal
+import threading
+
+from . import create_app, app_logger
+from .job_queue import start_ingestion_workers
+from .metrics import serve_worker_metrics
+
+
+def main() -> None:
+    app = create_app(warm_up=False)
+    pool = start_ingestion_workers(app)
+    serve_worker_metrics()
+
+    stop = threading.Event()
+
+    def _handle_signal(signum, frame):
+        app_logger.info(f"Ingestion worker received signal {signum}, shutting down...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    stop.wait()
+    # Running jobs are left to finish up to the timeout; anything still in flight
+    # is reclaimed by another worker once its visibility timeout expires.
+    pool.stop(timeout=30)
+    app_logger.info("Ingestion worker stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: rows/sec of the chunk write paths (binary COPY, executemany, ORM).
+
+Needs DATABASE_URL pointing at a PostgreSQL database with pgvector. Every run
+happens in a transaction that is rolled back, so nothing is left behind:
+
+    python -m benchmarks.chunk_writer --rows 5000 --repeat 3
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+
+for _name in ("GOOGLE_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+
+from flask import Flask
+
+from app.config import Config
+from app.models import db, Document, DEFAULT_COLLECTION
+from app.chunk_writer import write_chunks
+from app.partitions import ensure_collection_partition
+
+MODES = ("orm", "executemany", "copy")
+
+
+def make_app() -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = Config.DATABASE_URL
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def synthetic_rows(count: int, dimension: int, seed: int = 0) -> tuple[list[str], list[list[float]]]:
+    rng = random.Random(seed)
+    chunks = [f"chunk {i} " + "lorem ipsum " * 80 for i in range(count)]
+    embeddings = [[rng.uniform(-1, 1) for _ in range(dimension)] for _ in range(count)]
+    return chunks, embeddings
+
+
+def time_mode(mode: str, chunks, embeddings, repeat: int) -> float:
+    """Best-of-`repeat` seconds to write all rows with the given mode (rolled back each time)."""
+    best = float("inf")
+    for _ in range(repeat):
+        doc = Document(display_name=f"benchmark-{uuid.uuid4()}", source_url="benchmark://", processing_status="BENCHMARK")
+        db.session.add(doc)
+        db.session.flush()
+        start = time.perf_counter()
+        write_chunks(db.session, doc.id, chunks, embeddings, mode=mode)
+        db.session.flush()
+        best = min(best, time.perf_counter() - start)
+        db.session.rollback()
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    chunks, embeddings = synthetic_rows(args.rows, Config.PG_EMBEDDING_DIMENSION)
+    app = make_app()
+    with app.app_context():
+        db.create_all()
+        ensure_collection_partition(DEFAULT_COLLECTION)
+        results = {mode: time_mode(mode, chunks, embeddings, args.repeat) for mode in args.modes}
+
+    baseline = results.get("orm")
+    print(f"{'mode':<12} {'seconds':>9} {'rows/sec':>10} {'vs orm':>7}")
+    for mode, seconds in results.items():
+        ratio = f"{baseline / seconds:.1f}x" if baseline else "-"
+        print(f"{mode:<12} {seconds:>9.3f} {args.rows / seconds:>10.0f} {ratio:>7}")
+
+
+if __name__ == "__main__":
+    main()
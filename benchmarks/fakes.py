@@ -0,0 +1,178 @@
+"""
+Deterministic local stand-ins for the external services, shared by the
+benchmarks: a hashing embedding provider, an ADK model that drives the RAG
+agent's tool call, a static file server for synthetic PDFs and a stage timer.
+"""
+import asyncio
+import functools
+import hashlib
+import http.server
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncGenerator
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai.types import Content, FunctionCall, Part
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def percentiles(samples: list[float]) -> dict:
+    """count, mean, p50/p95/p99 and max (nearest rank) of a list of milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(rank(50), 3),
+        "p95": round(rank(95), 3),
+        "p99": round(rank(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+class StageTimer:
+    """Thread-safe collection of per-stage durations (milliseconds)."""
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, milliseconds: float) -> None:
+        with self._lock:
+            self._samples[stage].append(milliseconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {stage: percentiles(samples) for stage, samples in sorted(self._samples.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def wrap(self, owner, name: str, stage: str) -> None:
+        """Replaces owner.name (a function or coroutine function) with a timed version."""
+        original = getattr(owner, name)
+        if asyncio.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, (time.perf_counter() - start) * 1000)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, (time.perf_counter() - start) * 1000)
+        setattr(owner, name, timed)
+
+
+@functools.lru_cache(maxsize=65536)
+def _token_slot(token: str, dimension: int) -> tuple[int, float]:
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % dimension, 1.0 if digest[4] & 1 else -1.0
+
+
+def hashing_embedding(text: str, dimension: int) -> list[float]:
+    """Normalized bag-of-words vector, so texts sharing words are close under cosine distance."""
+    vector = [0.0] * dimension
+    for token in _TOKEN_RE.findall(text.lower()):
+        index, sign = _token_slot(token, dimension)
+        vector[index] += sign
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        vector[0] = 1.0
+        return vector
+    return [value / norm for value in vector]
+
+
+class FakeEmbeddingProvider:
+    """Drop-in for genai.embed_content with latency of base_ms + per_item_ms per text."""
+
+    def __init__(self, base_ms: float, per_item_ms: float = 0.0, timer: StageTimer | None = None):
+        self.base_ms = base_ms
+        self.per_item_ms = per_item_ms
+        self.timer = timer
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model: str, content, task_type: str | None = None, output_dimensionality: int = 768, **kwargs):
+        texts = content if isinstance(content, list) else [content]
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        delay_ms = self.base_ms + self.per_item_ms * len(texts)
+        time.sleep(delay_ms / 1000)
+        if self.timer:
+            self.timer.record(f"provider_embedding_{task_type or 'default'}", delay_ms)
+        embeddings = [hashing_embedding(text, output_dimensionality) for text in texts]
+        return {"embedding": embeddings if isinstance(content, list) else embeddings[0]}
+
+
+class FakeRagLlm(BaseLlm):
+    """
+    ADK model for the RAG agent: the first call of a turn asks for the retrieval
+    tool with the user's question, the second answers from the retrieved context.
+    Streaming calls yield the answer in partial chunks.
+    """
+
+    latency_ms: float = 300.0
+    stream_chunks: int = 8
+    timer: Any = None
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        start = time.perf_counter()
+        await asyncio.sleep(self.latency_ms / 1000)
+        last = llm_request.contents[-1] if llm_request.contents else None
+        parts = (last.parts or []) if last else []
+        function_response = next((part.function_response for part in parts if part.function_response), None)
+
+        if function_response is None:
+            question = " ".join(part.text for part in parts if part.text) or "help"
+            call = FunctionCall(name="retrieve_pgvector_documents", args={"query": question})
+            response = LlmResponse(content=Content(role="model", parts=[Part(function_call=call)]))
+            self._record(start)
+            yield response
+            return
+
+        context = (function_response.response or {}).get("retrieved_context", "")
+        answer = f"<p>{context[:400]}</p>"
+        self._record(start)
+        if stream:
+            size = max(1, math.ceil(len(answer) / self.stream_chunks))
+            for offset in range(0, len(answer), size):
+                yield LlmResponse(content=Content(role="model", parts=[Part(text=answer[offset:offset + size])]), partial=True)
+        yield LlmResponse(content=Content(role="model", parts=[Part(text=answer)]), turn_complete=True)
+
+    def _record(self, start: float) -> None:
+        if self.timer:
+            self.timer.record("llm_call", (time.perf_counter() - start) * 1000)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory: str) -> tuple[http.server.ThreadingHTTPServer, str]:
+    """Serves a directory over HTTP on a free local port; returns (server, base URL)."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="benchmark-http", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
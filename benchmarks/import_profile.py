@@ -0,0 +1,147 @@
+"""
+Benchmark: worker start-up time, split into imports, create_app, runner
+construction and warm-up, plus the modules that dominate the import time.
+
+Every run starts a fresh interpreter with `python -X importtime`, so nothing
+is cached in sys.modules, and times these stages:
+
+    import app            config, logging, metrics, models
+    import app.routes     services, session store, agents (ADK)
+    create_app            Flask app and schema setup (no background tasks)
+    runner <model>        first use of each --models runner (loads its model client)
+    warm-up <step>        each app.warmup step, with --warm-up
+
+    python -m benchmarks.import_profile --runs 3 --models gemini openai --top 25 --output startup.json
+
+Stage times are the median over --runs. The module table comes from the last
+run's importtime report. It lists the largest modules by cumulative import
+time, and import time grouped by top-level package (self time, so nested
+imports are not counted twice). Needs DATABASE_URL for create_app.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+for _name in ("GOOGLE_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("DEMO_USER", "benchmark")
+os.environ.setdefault("DEMO_PASSWORD", "benchmark")
+os.environ.setdefault("GOOGLE_MODEL_NAME", "gemini-2.5-flash")
+
+# Runs in the child interpreter; prints the stage times as JSON after STAGES_MARKER.
+STAGES_MARKER = "STAGES "
+CHILD = """
+import json, sys, time
+models, warm = json.loads(sys.argv[1]), sys.argv[2] == "1"
+stages = []
+def stage(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    stages.append((name, time.perf_counter() - start))
+    return result
+stage("import app", lambda: __import__("app"))
+stage("import app.routes", lambda: __import__("app.routes"))
+from app import create_app
+app = stage("create_app", lambda: create_app(start_background_tasks=False))
+from app.services import get_runner
+for model in models:
+    stage(f"runner {model}", lambda: get_runner(model))
+if warm:
+    from app.warmup import WARMUP_STEPS
+    with app.app_context():
+        for name, step in WARMUP_STEPS:
+            stage(f"warm-up {name}", step)
+print("STAGES " + json.dumps(stages), flush=True)
+"""
+
+
+def run_once(models: list[str], warm_up: bool) -> tuple[list[tuple[str, float]], str]:
+    """(stage timings, importtime report) of one fresh interpreter."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, json.dumps(models), "1" if warm_up else "0"],
+        capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if completed.returncode != 0:
+        tail = "\n".join(line for line in completed.stderr.splitlines() if not line.startswith("import time:"))
+        raise SystemExit(f"Start-up run failed:\n{tail[-2000:]}")
+    line = next(line for line in completed.stdout.splitlines() if line.startswith(STAGES_MARKER))
+    return json.loads(line[len(STAGES_MARKER):]), completed.stderr
+
+
+def parse_importtime(report: str) -> list[dict]:
+    """Rows of `-X importtime` output: module, self and cumulative seconds, nesting depth."""
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        depth = (len(module) - len(module.lstrip(" "))) // 2
+        rows.append({
+            "module": module.strip(),
+            "self_s": int(self_us) / 1e6,
+            "cumulative_s": int(cumulative_us) / 1e6,
+            "depth": depth,
+        })
+    return rows
+
+
+def by_package(rows: list[dict]) -> list[tuple[str, float, int]]:
+    """(top-level package, summed self seconds, module count), largest first."""
+    totals = {}
+    for row in rows:
+        top = row["module"].split(".")[0]
+        seconds, count = totals.get(top, (0.0, 0))
+        totals[top] = (seconds + row["self_s"], count + 1)
+    return sorted(((name, seconds, count) for name, (seconds, count) in totals.items()),
+                  key=lambda item: item[1], reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--models", nargs="*", default=["gemini"], help="runners to build after create_app")
+    parser.add_argument("--warm-up", action="store_true", help="also time the app.warmup steps")
+    parser.add_argument("--top", type=int, default=20, help="modules and packages to list")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = []
+    report = ""
+    for _ in range(args.runs):
+        stages, report = run_once(args.models, args.warm_up)
+        runs.append(stages)
+
+    names = [name for name, _ in runs[0]]
+    medians = {name: statistics.median(dict(run)[name] for run in runs) for name in names}
+    rows = parse_importtime(report)
+    total_import = sum(row["cumulative_s"] for row in rows if row["depth"] == 0)
+    packages = by_package(rows)
+    largest = sorted(rows, key=lambda row: row["cumulative_s"], reverse=True)[:args.top]
+
+    print(f"Start-up stages (median of {args.runs} runs):")
+    for name in names:
+        print(f"  {name:<32} {medians[name]:8.3f}s")
+    print(f"  {'total':<32} {sum(medians.values()):8.3f}s")
+    print(f"\nImport time by top-level package ({len(rows)} modules, {total_import:.3f}s):")
+    for name, seconds, count in packages[:args.top]:
+        print(f"  {name:<32} {seconds:8.3f}s  {count:5d} modules")
+    print("\nLargest modules (cumulative):")
+    for row in largest:
+        print(f"  {row['module']:<60} {row['cumulative_s']:8.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "stages": medians,
+                "runs": [dict(run) for run in runs],
+                "import_total_s": total_import,
+                "packages": [{"package": name, "self_s": seconds, "modules": count} for name, seconds, count in packages],
+                "modules": rows,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Benchmark: offline end-to-end load test of ingestion, /start_session, /ask and
+/ask/stream.
+
+Boots create_app() against DATABASE_URL (PostgreSQL with pgvector) with the
+embedding provider and both agent models (Gemini and LiteLLM) replaced by the
+deterministic stand-ins in benchmarks.fakes, serves synthetic PDFs from a local
+HTTP server and drives concurrent requests through Flask test clients. Prints
+a JSON report with p50/p95/p99 latency, throughput and per-stage timings:
+
+    python -m benchmarks.load_test --concurrency 16 --requests 200 --output report.json
+
+Everything is written to the "loadtest" collection and to sessions of the
+DEMO_USER, and removed afterwards unless --keep-data is given.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+for _name in ("GOOGLE_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("DEMO_USER", "loadtest")
+os.environ.setdefault("DEMO_PASSWORD", "loadtest")
+os.environ.setdefault("GOOGLE_MODEL_NAME", "gemini-2.5-flash")
+os.environ.setdefault("MEMCACHED_URL", "memory://")
+# Compaction must not call a real model either.
+os.environ.setdefault("SESSION_COMPACTION_SUMMARIZER", "extractive")
+
+import google.generativeai as genai
+from prometheus_client import REGISTRY
+
+from app import create_app
+from app import agent as agent_module, ingestion_service, job_queue, routes
+from app.config import Config
+from app.models import Document
+from app.partitions import drop_collection
+from app.services import answer_flight, get_session_service
+from benchmarks.fakes import FakeEmbeddingProvider, FakeRagLlm, StageTimer, percentiles, serve_directory
+from benchmarks.pdf_extraction import WORDS, generate_pdf
+
+SCENARIOS = ("ingest", "start_session", "ask", "ask_stream")
+COLLECTION = "loadtest"
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+
+def install_fakes(args, timer: StageTimer) -> FakeEmbeddingProvider:
+    """Swaps the external providers for the stand-ins and times the internal stages."""
+    provider = FakeEmbeddingProvider(args.embed_latency_ms, args.embed_item_latency_ms, timer)
+    genai.embed_content = provider
+    agent_module.get_agent(args.model).model = FakeRagLlm(
+        model="fake-rag", latency_ms=args.llm_latency_ms, stream_chunks=args.stream_chunks, timer=timer
+    )
+
+    session_service = get_session_service()
+
+    timer.wrap(session_service, "session_exists", "session_lookup")
+    timer.wrap(session_service, "create_session_if_absent", "session_create")
+    timer.wrap(session_service, "get_session", "session_load")
+    timer.wrap(session_service, "append_event", "session_append")
+    timer.wrap(routes, "answer_question", "agent_turn")
+    timer.wrap(agent_module, "_get_sync_embedding", "query_embedding")
+    timer.wrap(agent_module, "_search_chunks", "retrieval")
+    timer.wrap(ingestion_service, "download_pdf", "ingest_download")
+    timer.wrap(ingestion_service, "get_embeddings_with_store", "ingest_embed_batch")
+    timer.wrap(ingestion_service, "write_chunks", "ingest_write_batch")
+    timer.wrap(job_queue, "process_and_store_document", "ingest_document")
+    return provider
+
+
+class Scenario:
+    """Latency samples and error count of one scenario."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.first_event = []
+        self.errors = {}
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, milliseconds: float, status: int | None = None, error: str | None = None,
+               first_event_ms: float | None = None) -> None:
+        with self._lock:
+            if error is None:
+                self.latencies.append(milliseconds)
+                if first_event_ms is not None:
+                    self.first_event.append(first_event_ms)
+            else:
+                label = f"{status}: {error}" if status else error
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def report(self, stages: dict) -> dict:
+        completed = len(self.latencies)
+        report = {
+            "requests": completed + sum(self.errors.values()),
+            "errors": sum(self.errors.values()),
+            "error_samples": dict(list(self.errors.items())[:5]),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "throughput_rps": round(completed / self.wall_seconds, 2) if self.wall_seconds else 0.0,
+            "latency_ms": percentiles(self.latencies),
+            "stages": stages,
+        }
+        if self.first_event:
+            report["first_event_ms"] = percentiles(self.first_event)
+        return report
+
+
+class LoadTest:
+    def __init__(self, app, args, timer: StageTimer):
+        self.app = app
+        self.args = args
+        self.timer = timer
+        self.run_id = uuid.uuid4().hex[:8]
+        self.user = Config.DEMO_USER
+        self.sessions = [f"loadtest-{self.run_id}-{i}" for i in range(max(args.sessions, args.concurrency))]
+        rng = random.Random(args.seed)
+        self.questions = [
+            "What about " + " ".join(rng.sample(WORDS, 4)) + "?" for _ in range(args.distinct_questions)
+        ]
+        self._local = threading.local()
+        self._slot_lock = threading.Lock()
+        self._next_slot = 0
+        with app.test_client() as client:
+            # One login for all threads: /login is rate limited.
+            response = client.post("/login", json={"username": self.user, "password": Config.DEMO_PASSWORD})
+            if response.status_code != 200:
+                raise SystemExit(f"Login failed ({response.status_code}): {response.get_json()}")
+            self.headers = {"Authorization": f"Bearer {response.get_json()['access_token']}"}
+
+    def client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def drive(self, scenario: Scenario, count: int, request_fn) -> Scenario:
+        """Runs request_fn(i, start) for i in range(count) on `concurrency` threads."""
+        self.timer.reset()
+        self._next_slot = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency, thread_name_prefix="loadtest") as executor:
+            for _ in executor.map(lambda i: self._timed(scenario, request_fn, i), range(count)):
+                pass
+        scenario.wall_seconds = time.perf_counter() - start
+        return scenario
+
+    def _timed(self, scenario: Scenario, request_fn, i: int) -> None:
+        start = time.perf_counter()
+        try:
+            status, error, first_event = request_fn(i, start)
+        except Exception as e:
+            status, error, first_event = None, f"{type(e).__name__}: {e}", None
+        scenario.record((time.perf_counter() - start) * 1000, status, error, first_event)
+
+    def run_ingest(self) -> Scenario:
+        scenario = Scenario("ingest")
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(self.args.documents):
+                generate_pdf(os.path.join(directory, f"doc-{i}.pdf"), self.args.pages, seed=f"{self.run_id}-{i}")
+            server, base_url = serve_directory(directory)
+            try:
+                self.drive(scenario, self.args.documents, lambda i, start: self._ingest_one(base_url, i))
+            finally:
+                server.shutdown()
+                server.server_close()
+        return scenario
+
+    def _ingest_one(self, base_url: str, i: int):
+        response = self.client().post("/document", headers=self.headers, json={
+            "source_url": f"{base_url}/doc-{i}.pdf",
+            "display_name": f"loadtest-{self.run_id}-{i}",
+            "collection": COLLECTION,
+        })
+        if response.status_code != 201:
+            return response.status_code, str(response.get_json()), None
+        document_id = response.get_json()["document_id"]
+        deadline = time.monotonic() + self.args.ingest_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            with self.app.app_context():
+                document = Document.query.get(document_id)
+                status, error = document.processing_status, document.processing_error
+            if status in TERMINAL_STATUSES:
+                return (None, error, None) if status == "FAILED" else (None, None, None)
+        return None, "timed out", None
+
+    def run_start_session(self) -> Scenario:
+        def start_one(i, start):
+            # The first len(sessions) requests create the sessions used by /ask; the rest repeat them.
+            name = self.sessions[i % len(self.sessions)]
+            response = self.client().post("/start_session", headers=self.headers,
+                                          json={"username": self.user, "session_name": name})
+            return response.status_code, None if response.status_code in (200, 201) else str(response.get_json()), None
+
+        return self.drive(Scenario("start_session"), max(self.args.requests, len(self.sessions)), start_one)
+
+    def _session(self) -> str:
+        """
+        Next session of the calling thread. Each thread owns sessions[k::concurrency],
+        so a session never runs two turns at once (ADK rejects that as a stale session).
+        """
+        local = self._local
+        if not hasattr(local, "slot"):
+            with self._slot_lock:
+                local.slot, self._next_slot = self._next_slot, self._next_slot + 1
+                local.turns = 0
+        owned = self.sessions[local.slot::self.args.concurrency]
+        local.turns += 1
+        return owned[local.turns % len(owned)]
+
+    def _question(self, i: int) -> dict:
+        return {
+            "username": self.user,
+            "session_name": self._session(),
+            "question": self.questions[i % len(self.questions)],
+            "model": self.args.model,
+            "collection": COLLECTION,
+        }
+
+    def run_ask(self) -> Scenario:
+        def ask_one(i, start):
+            response = self.client().post("/ask", headers=self.headers, json=self._question(i))
+            ok = response.status_code == 200 and response.get_json().get("response")
+            return response.status_code, None if ok else str(response.get_json()), None
+
+        return self.drive(Scenario("ask"), self.args.requests, ask_one)
+
+    def run_ask_stream(self) -> Scenario:
+        def stream_one(i, start):
+            response = self.client().post("/ask/stream", headers=self.headers, json=self._question(i), buffered=False)
+            if response.status_code != 200:
+                return response.status_code, str(response.get_json()), None
+            first_event, body = None, b""
+            for chunk in response.response:
+                if first_event is None:
+                    first_event = (time.perf_counter() - start) * 1000
+                body += chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+            response.close()
+            text = body.decode("utf-8")
+            if "event: final" not in text:
+                return 200, text[-200:] or "empty stream", None
+            return 200, None, first_event
+
+        return self.drive(Scenario("ask_stream"), self.args.requests, stream_one)
+
+    def cleanup(self) -> None:
+        async def delete_sessions():
+            for name in self.sessions:
+                await get_session_service().delete_session(app_name=Config.APP_NAME, user_id=self.user, session_id=name)
+
+        asyncio.run(delete_sessions())
+        with self.app.app_context():
+            drop_collection(COLLECTION)
+
+
+def query_embedding_batches() -> dict:
+    """Batch count, batch size and queueing delay of the query embedding batcher, from its histograms."""
+    def sample(name: str) -> float:
+        return REGISTRY.get_sample_value(name) or 0.0
+
+    batches = sample("chatbot_query_embedding_batch_size_count")
+    queries = sample("chatbot_query_embedding_batch_size_sum")
+    delay_total = sample("chatbot_query_embedding_queue_delay_seconds_sum")
+    return {
+        "batches": int(batches),
+        "queries": int(queries),
+        "avg_batch_size": round(queries / batches, 2) if batches else 0.0,
+        "avg_queue_delay_ms": round(delay_total * 1000 / queries, 3) if queries else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per /start_session, /ask and /ask/stream scenario")
+    parser.add_argument("--sessions", type=int, default=0, help="sessions the questions are spread over (at least concurrency)")
+    parser.add_argument("--distinct-questions", type=int, default=50)
+    parser.add_argument("--model", default="gemini", choices=("gemini", "openai"))
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--ingest-timeout", type=float, default=300)
+    parser.add_argument("--embed-latency-ms", type=float, default=40)
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0.5)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--stream-chunks", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--keep-data", action="store_true")
+    args = parser.parse_args()
+
+    app = create_app(start_background_tasks="ingest" in args.scenarios, warm_up=False)
+    for name in ("app", "access", "security"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    timer = StageTimer()
+    provider = install_fakes(args, timer)
+    load_test = LoadTest(app, args, timer)
+    # Sessions must exist before /ask, whether or not their creation is measured.
+    order = [name for name in SCENARIOS if name in args.scenarios or name == "start_session"]
+
+    results = {}
+    try:
+        for name in order:
+            scenario = getattr(load_test, f"run_{name}")()
+            if name in args.scenarios:
+                results[name] = scenario.report(timer.summary())
+    finally:
+        if not args.keep_data:
+            load_test.cleanup()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep_data")},
+        "scenarios": results,
+        "internals": {
+            "embedding_provider": {"calls": provider.calls, "texts": provider.texts},
+            "query_embedding_batcher": query_embedding_batches(),
+            "single_flight": {
+                flight.name: flight.stats()
+                for flight in (agent_module.embedding_flight, agent_module.retrieval_flight, answer_flight)
+            },
+        },
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark: serial vs multi-process PDF text extraction.
+
+Generates a multi-hundred-page PDF and times iter_pdf_pages with extraction
+forced serial and forced parallel:
+
+    python -m benchmarks.pdf_extraction --pages 600 --workers 4
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+# Config validates these at import time; the benchmark never uses them.
+for _name in ("GOOGLE_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/benchmark")
+
+import fitz
+
+from app.config import Config
+from app import ingestion_service
+
+WORDS = (
+    "fees exam hall ticket library module admission payment portal student "
+    "login report attendance timetable semester marks certificate"
+).split()
+
+
+def generate_pdf(path: str, pages: int, seed: int = 0) -> None:
+    """Writes a PDF with `pages` pages of dense pseudo-random text."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        body = " ".join(rng.choice(WORDS) for _ in range(700))
+        page.insert_textbox(fitz.Rect(36, 36, 560, 806), f"Page {number + 1}. {body}", fontsize=7)
+    doc.save(path)
+    doc.close()
+
+
+def time_extraction(pdf_path: str, workers: int, min_pages: int, repeat: int) -> tuple[float, int]:
+    """Best-of-`repeat` wall time for extracting every page; also returns the text length."""
+    Config.PDF_EXTRACT_WORKERS = workers
+    Config.PDF_PARALLEL_MIN_PAGES = min_pages
+    best, length = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        length = sum(len(text) for text in ingestion_service.iter_pdf_pages(pdf_path))
+        best = min(best, time.perf_counter() - start)
+    return best, length
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "benchmark.pdf")
+        generate_pdf(pdf_path, args.pages)
+
+        serial, serial_len = time_extraction(pdf_path, workers=1, min_pages=args.pages + 1, repeat=args.repeat)
+        # Warm the process pool so worker start-up is not counted.
+        time_extraction(pdf_path, workers=args.workers, min_pages=1, repeat=1)
+        parallel, parallel_len = time_extraction(pdf_path, workers=args.workers, min_pages=1, repeat=args.repeat)
+
+    if serial_len != parallel_len:
+        raise SystemExit(f"Extracted text differs: serial={serial_len} chars, parallel={parallel_len} chars")
+
+    print(f"pages:     {args.pages}")
+    print(f"serial:    {serial:.3f}s ({args.pages / serial:.0f} pages/s)")
+    print(f"parallel:  {parallel:.3f}s ({args.pages / parallel:.0f} pages/s) with {args.workers} processes")
+    print(f"speedup:   {serial / parallel:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
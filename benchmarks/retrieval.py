@@ -0,0 +1,274 @@
+"""
+Benchmark: recall@k, QPS and latency of the retrieval query per index type,
+search mode and search parameter.
+
+Loads a synthetic corpus of --chunks embeddings (random, or clustered like
+real document chunks) into its own collection partition of the chunk table,
+takes an exact scan of that partition as ground truth and runs the production
+similarity query (vector_search.similarity_query) under every configuration:
+
+    python -m benchmarks.retrieval --chunks 100000 --queries 200 \\
+        --index-types hnsw ivfflat --modes direct binary_rescore matryoshka \\
+        --ef-search 40 100 200 --probes 10 30 --output retrieval.json
+
+Needs DATABASE_URL with pgvector and a partitioned chunk table (the indexes
+are built on the benchmark partition only). The corpus is kept for the next
+run with --keep-data and reused when --chunks, --distribution and --seed match.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+for _name in ("GOOGLE_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+
+import numpy as np
+from sqlalchemy import text
+
+from app.config import Config
+from app.models import db, Document
+from app.chunk_writer import write_chunks
+from app.partitions import ensure_collection_partition, drop_collection, is_partitioned, partition_name
+from app.vector_index import _ensure_table_index, _index_state, vector_index_name, search_settings, storage_type, TWO_STAGE_MODES
+from app.vector_search import similarity_query
+from app.vector_storage import check_pgvector_support
+from benchmarks.chunk_writer import make_app
+from benchmarks.fakes import percentiles
+
+COLLECTION = "retrieval_bench"
+DISTRIBUTIONS = ("random", "clustered")
+WRITE_BATCH = 2000
+
+
+def synthetic_vectors(count: int, dimension: int, distribution: str, rng: np.random.Generator,
+                      centroids: np.ndarray | None = None, spread: float = 0.35) -> np.ndarray:
+    """Unit vectors, uniformly random or scattered around the given centroids."""
+    if distribution == "clustered":
+        vectors = centroids[rng.integers(len(centroids), size=count)]
+        vectors = vectors + rng.normal(scale=spread / np.sqrt(dimension), size=(count, dimension))
+    else:
+        vectors = rng.normal(size=(count, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def corpus_name(args) -> str:
+    return f"retrieval-benchmark n={args.chunks} {args.distribution} clusters={args.clusters} seed={args.seed}"
+
+
+def load_corpus(args, dimension: int, rng: np.random.Generator, centroids) -> bool:
+    """Writes the corpus unless a matching one is already stored; returns True if it was reused."""
+    name = corpus_name(args)
+    existing = [
+        (doc.display_name, doc.processing_status) for doc in Document.query.filter_by(collection=COLLECTION)
+    ]
+    # No open transaction may hold locks while partitions are detached or attached.
+    db.session.rollback()
+    if existing == [(name, "COMPLETED")]:
+        return True
+    if existing:
+        drop_collection(COLLECTION)
+    ensure_collection_partition(COLLECTION)
+
+    document = Document(display_name=name, source_url="benchmark://", collection=COLLECTION, processing_status="BENCHMARK")
+    db.session.add(document)
+    db.session.flush()
+    for start in range(0, args.chunks, WRITE_BATCH):
+        size = min(WRITE_BATCH, args.chunks - start)
+        vectors = synthetic_vectors(size, dimension, args.distribution, rng, centroids)
+        contents = [f"benchmark chunk {start + i}" for i in range(size)]
+        write_chunks(db.session, document.id, contents, vectors.tolist(), mode="copy", collection=COLLECTION)
+    document.processing_status = "COMPLETED"
+    db.session.commit()
+    with db.engine.connect() as conn:
+        conn.execute(text(f"ANALYZE {partition_name(COLLECTION)}"))
+    return False
+
+
+def exact_results(queries: list[str], top_k: int) -> tuple[list[list[str]], list[float]]:
+    """
+    Ground truth: exact top-k by cosine distance over the stored embeddings
+    (sequential scan), and the latency of each query in milliseconds.
+    """
+    table = partition_name(COLLECTION)
+    query_cast = "CAST(:query_vec AS vector)"
+    if storage_type() != "vector":
+        query_cast = f"CAST({query_cast} AS {storage_type()})"
+    sql = text(
+        f"SELECT {Config.PG_CONTENT_COLUMN} FROM {table} "
+        f"ORDER BY {Config.PG_VECTOR_COLUMN} <=> {query_cast} LIMIT {top_k}"
+    )
+    truth, latencies = [], []
+    with db.engine.begin() as conn:
+        conn.execute(text("SET LOCAL enable_indexscan = off"))
+        conn.execute(text("SET LOCAL enable_bitmapscan = off"))
+        for query in queries:
+            start = time.perf_counter()
+            truth.append([row[0] for row in conn.execute(sql, {"query_vec": query})])
+            latencies.append((time.perf_counter() - start) * 1000)
+    return truth, latencies
+
+
+def configurations(args):
+    """(label, Config overrides) for every combination to measure."""
+    for mode, index_type in itertools.product(args.modes, args.index_types):
+        if index_type == "hnsw":
+            params = [("PG_HNSW_EF_SEARCH", f"ef_search={value}", value) for value in args.ef_search]
+        else:
+            params = [("PG_IVFFLAT_PROBES", f"probes={value}", value) for value in args.probes]
+        candidates = args.rerank_candidates if mode in TWO_STAGE_MODES else [None]
+        prefixes = args.prefix_dimensions if mode == "matryoshka" else [None]
+        # Prefix dimension outermost: each prefix index is measured in one block before the next replaces it.
+        for prefix, (key, param_label, value), candidate in itertools.product(prefixes, params, candidates):
+            overrides = {"RETRIEVAL_SEARCH_MODE": mode, "PG_VECTOR_INDEX_TYPE": index_type, key: value}
+            label = [mode, index_type, param_label]
+            if candidate is not None:
+                overrides["RETRIEVAL_RERANK_CANDIDATES"] = candidate
+                label.append(f"candidates={candidate}")
+            if prefix is not None:
+                overrides["RETRIEVAL_PREFIX_DIMENSION"] = prefix
+                label.append(f"prefix={prefix}")
+            yield " ".join(label), overrides
+
+
+def build_index(index_type: str) -> tuple[float, int]:
+    """Builds the index for the active mode on the benchmark partition; returns (seconds, bytes)."""
+    table = partition_name(COLLECTION)
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        check_pgvector_support(conn)
+        if Config.PG_INDEX_MAINTENANCE_WORK_MEM:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                         {"value": Config.PG_INDEX_MAINTENANCE_WORK_MEM})
+        name = vector_index_name(index_type, table)
+        start = time.perf_counter()
+        if not _ensure_table_index(conn, index_type, table):
+            raise RuntimeError(f"Index '{name}' could not be built.")
+        seconds = time.perf_counter() - start
+        size = conn.execute(text("SELECT pg_relation_size(to_regclass(:name))"), {"name": name}).scalar()
+    return seconds, size
+
+
+def index_exists(name: str) -> bool:
+    """Whether a cached index is still there: building another mode's index drops the others."""
+    with db.engine.connect() as conn:
+        return _index_state(conn, name) is True
+
+
+def measure(queries: list[str], truth: list[list[str]], top_k: int, warmup: int) -> dict:
+    """Runs every query once on one connection with the configured search settings."""
+    sql = text(similarity_query(":query_vec", ":collection"))
+    latencies, hits = [], 0
+    with db.engine.connect() as conn:
+        for name, value in search_settings().items():
+            conn.execute(text("SELECT set_config(:name, :value, false)"), {"name": name, "value": value})
+        plan = "\n".join(row[0] for row in conn.execute(
+            text(f"EXPLAIN {sql.text}"), {"query_vec": queries[0], "collection": COLLECTION}
+        ))
+        for query in queries[:warmup]:
+            conn.execute(sql, {"query_vec": query, "collection": COLLECTION}).fetchall()
+        start = time.perf_counter()
+        for query, expected in zip(queries, truth):
+            query_start = time.perf_counter()
+            found = [row[0] for row in conn.execute(sql, {"query_vec": query, "collection": COLLECTION})]
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            hits += len(set(found) & set(expected))
+        elapsed = time.perf_counter() - start
+        conn.rollback()
+    return {
+        f"recall@{top_k}": round(hits / (len(queries) * top_k), 4),
+        "qps": round(len(queries) / elapsed, 1),
+        "latency_ms": percentiles(latencies),
+        "index_scan": " Index Scan using " in plan,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="clustered")
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=Config.RETRIEVAL_TOP_K)
+    parser.add_argument("--index-types", nargs="+", default=["hnsw", "ivfflat"], choices=("hnsw", "ivfflat"))
+    parser.add_argument("--modes", nargs="+", default=["direct"], choices=("direct", "binary_rescore", "matryoshka"))
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[Config.PG_HNSW_EF_SEARCH])
+    parser.add_argument("--probes", type=int, nargs="+", default=[Config.PG_IVFFLAT_PROBES])
+    parser.add_argument("--rerank-candidates", type=int, nargs="+", default=[Config.RETRIEVAL_RERANK_CANDIDATES])
+    parser.add_argument("--prefix-dimensions", type=int, nargs="+", default=[Config.RETRIEVAL_PREFIX_DIMENSION])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--keep-data", action="store_true")
+    args = parser.parse_args()
+
+    dimension = Config.PG_EMBEDDING_DIMENSION
+    rng = np.random.default_rng(args.seed)
+    centroids = rng.normal(size=(args.clusters, dimension))
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+    # Queries come from the corpus distribution but are not corpus members.
+    query_rng = np.random.default_rng([args.seed, 1])
+    queries = [str(vector.tolist()) for vector in
+               synthetic_vectors(args.queries, dimension, args.distribution, query_rng, centroids)]
+
+    app = make_app()
+    results = []
+    with app.app_context():
+        with db.engine.connect() as conn:
+            if not is_partitioned(conn):
+                raise SystemExit("The chunk table is not partitioned; run `python -m app.partitions migrate` first.")
+
+        start = time.perf_counter()
+        reused = load_corpus(args, dimension, rng, centroids)
+        print(f"Corpus: {args.chunks} {args.distribution} chunks of {dimension} dims "
+              f"({'reused' if reused else f'loaded in {time.perf_counter() - start:.1f}s'}).")
+
+        top_k = Config.RETRIEVAL_TOP_K = args.top_k
+        start = time.perf_counter()
+        truth, exact_latencies = exact_results(queries, top_k)
+        results.append({"config": "exact (sequential scan)", "build_seconds": 0.0, "index_mb": 0.0,
+                        f"recall@{top_k}": 1.0, "qps": round(len(queries) / (time.perf_counter() - start), 1),
+                        "latency_ms": percentiles(exact_latencies), "index_scan": None})
+
+        built = {}
+        try:
+            for label, overrides in configurations(args):
+                for key, value in overrides.items():
+                    setattr(Config, key, value)
+                index_key = vector_index_name(Config.PG_VECTOR_INDEX_TYPE, partition_name(COLLECTION))
+                row = {"config": label}
+                try:
+                    if index_key not in built or not index_exists(index_key):
+                        built[index_key] = build_index(Config.PG_VECTOR_INDEX_TYPE)
+                    seconds, size = built[index_key]
+                    row.update(build_seconds=round(seconds, 2), index_mb=round(size / 2**20, 1))
+                    row.update(measure(queries, truth, top_k, args.warmup))
+                except Exception as e:
+                    row["error"] = str(e).splitlines()[0]
+                results.append(row)
+                print(f"  {label}: {row.get(f'recall@{top_k}', row.get('error'))}")
+        finally:
+            db.session.rollback()
+            if not args.keep_data:
+                drop_collection(COLLECTION)
+
+    print()
+    print(f"{'configuration':<60} {'build s':>8} {'idx MB':>7} {'recall':>7} {'QPS':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in results:
+        if "error" in row:
+            print(f"{row['config']:<60} {row['error']}")
+            continue
+        print(
+            f"{row['config']:<60} {row['build_seconds']:>8.2f} {row['index_mb']:>7.1f} "
+            f"{row[f'recall@{top_k}']:>7.3f} {row['qps']:>8.1f} {row['latency_ms']['p50']:>8.2f} "
+            f"{row['latency_ms']['p99']:>8.2f}{'  (no index scan)' if row['index_scan'] is False else ''}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"corpus": corpus_name(args), "dimension": dimension, "results": results}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# app.config refuses to load without these; nothing here connects to them.
+for _name in ("GOOGLE_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY", "DEMO_USER", "DEMO_PASSWORD"):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+os.environ.setdefault("MEMCACHED_URL", "memory://")
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("LOG_DIR", os.path.join(tempfile.gettempdir(), "college_rag_test_logs"))
@@ -0,0 +1,72 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import answer_cache
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="needs TEST_DATABASE_URL (PostgreSQL with pgvector)")
+
+
+@pytest.fixture
+def conn():
+    """A transaction on a throwaway schema (rolled back) with answer_cache and knowledge_base_state (8 dimensions)."""
+    engine = create_engine(DATABASE_URL)
+    schema = f"test_answer_cache_{uuid.uuid4().hex[:8]}"
+    with engine.connect() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.execute(text(f"SET search_path = {schema}, public"))
+        connection.execute(text("CREATE TABLE knowledge_base_state (id integer PRIMARY KEY, version bigint NOT NULL)"))
+        connection.execute(text(
+            """
+            CREATE TABLE answer_cache (
+                id serial PRIMARY KEY, question_embedding vector(8) NOT NULL, model varchar(50) NOT NULL,
+                kb_version bigint NOT NULL, collection varchar(50), answer text NOT NULL,
+                created_at timestamptz DEFAULT now()
+            )
+            """
+        ))
+        connection.execute(text(
+            "CREATE INDEX ON answer_cache USING hnsw (question_embedding vector_cosine_ops)"
+        ))
+        try:
+            yield connection
+        finally:
+            # The schema was created in the same transaction.
+            connection.rollback()
+    engine.dispose()
+
+
+def vector(*head):
+    return list(head) + [0.0] * (8 - len(head))
+
+
+def test_finds_the_answer_of_a_collection_outnumbered_by_closer_entries(conn):
+    # 1000 entries of another collection lie closer to the question than the one match.
+    conn.execute(
+        text(
+            "INSERT INTO answer_cache (question_embedding, model, kb_version, collection, answer) "
+            "VALUES (CAST(:vec AS vector), 'gemini', 1, 'exam_control', 'other collection')"
+        ),
+        [{"vec": str(vector(1.0, 0.001 * i))} for i in range(1000)],
+    )
+    conn.execute(
+        text(
+            "INSERT INTO answer_cache (question_embedding, model, kb_version, collection, answer) "
+            "VALUES (CAST(:vec AS vector), 'gemini', 1, 'fees', 'fees answer')"
+        ),
+        {"vec": str(vector(1.0, 0.0, 0.2))},
+    )
+    conn.execute(text("ANALYZE answer_cache"))
+    # Make sure the lookup goes through the HNSW index, as it does on a large table.
+    conn.execute(text("SET LOCAL enable_seqscan = off"))
+
+    version, answer, similarity = answer_cache._find_answer(conn, vector(1.0), "gemini", "fees")
+
+    assert (version, answer) == (1, "fees answer")
+    assert similarity == pytest.approx(0.98, abs=0.01)
+    assert answer_cache._find_answer(conn, vector(1.0), "gemini", "hostel")[1] is None
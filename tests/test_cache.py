@@ -0,0 +1,22 @@
+from prometheus_client import REGISTRY
+
+from app import cache
+from app.cache import EmbeddingCache
+
+
+def lookups(result):
+    return REGISTRY.get_sample_value("chatbot_embedding_cache_lookups_total", {"result": result}) or 0.0
+
+
+def test_lookups_are_exported_as_metrics(monkeypatch):
+    monkeypatch.setattr(cache, "get_memcached_client", lambda: None)
+    embedding_cache = EmbeddingCache(local_size=8, ttl_seconds=60)
+    before = {result: lookups(result) for result in ("local_hit", "remote_hit", "miss")}
+
+    assert embedding_cache.get("what are the fees?") is None
+    embedding_cache.set("what are the fees?", [0.5, 0.25])
+    assert embedding_cache.get("What are  the fees?") == [0.5, 0.25]
+
+    assert lookups("miss") == before["miss"] + 1
+    assert lookups("local_hit") == before["local_hit"] + 1
+    assert lookups("remote_hit") == before["remote_hit"]
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import google.generativeai as genai
+import pytest
+
+from app.config import Config
+from app.embedding_batcher import QueryEmbeddingBatcher
+from app.exceptions import ExternalApiError
+
+
+class FakeEmbedContent:
+    """Stand-in for genai.embed_content: records each call's texts and embeds a text as [len(text), first char]."""
+
+    def __init__(self, error: Exception | None = None, drop_last: bool = False):
+        self.calls = []
+        self.error = error
+        self.drop_last = drop_last
+        self.lock = threading.Lock()
+
+    def __call__(self, model, content, task_type, output_dimensionality):
+        with self.lock:
+            self.calls.append(list(content))
+        assert task_type == "retrieval_query"
+        if self.error is not None:
+            raise self.error
+        embeddings = [[float(len(text)), float(ord(text[0]))] for text in content]
+        return {"embedding": embeddings[:-1] if self.drop_last else embeddings}
+
+
+@pytest.fixture
+def embed_content(monkeypatch):
+    fake = FakeEmbedContent()
+    monkeypatch.setattr(genai, "embed_content", fake)
+    return fake
+
+
+def submit_all(batcher, texts):
+    return [batcher.submit(text) for text in texts]
+
+
+def test_queries_within_the_window_share_one_call(embed_content):
+    batcher = QueryEmbeddingBatcher(window_ms=200, max_size=32, concurrency=2)
+
+    futures = submit_all(batcher, ["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert [future.result(5) for future in futures] == [
+        [1.0, ord("a")], [2.0, ord("b")], [3.0, ord("c")], [4.0, ord("d")], [5.0, ord("e")]
+    ]
+    assert embed_content.calls == [["a", "bb", "ccc", "dddd", "eeeee"]]
+
+
+def test_window_cuts_off_a_batch(embed_content):
+    batcher = QueryEmbeddingBatcher(window_ms=30, max_size=32, concurrency=2)
+
+    first = submit_all(batcher, ["a", "b"])
+    for future in first:
+        future.result(5)
+    time.sleep(0.1)
+    second = submit_all(batcher, ["c", "d"])
+
+    assert [future.result(5) for future in second] == [[1.0, ord("c")], [1.0, ord("d")]]
+    assert embed_content.calls == [["a", "b"], ["c", "d"]]
+
+
+def test_max_size_cuts_off_a_batch(embed_content):
+    batcher = QueryEmbeddingBatcher(window_ms=500, max_size=4, concurrency=2)
+    texts = [chr(ord("a") + index) for index in range(10)]
+
+    futures = submit_all(batcher, texts)
+
+    assert [future.result(5) for future in futures] == [[1.0, ord(text)] for text in texts]
+    assert sorted(len(call) for call in embed_content.calls) == [2, 4, 4]
+    assert sorted(text for call in embed_content.calls for text in call) == texts
+
+
+def test_max_chars_splits_a_batch(embed_content, monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_BATCH_MAX_CHARS", 10)
+    batcher = QueryEmbeddingBatcher(window_ms=200, max_size=32, concurrency=2)
+    texts = ["aaaa", "bbbb", "cccc", "dddd", "eeee"]
+
+    futures = submit_all(batcher, texts)
+
+    assert [future.result(5) for future in futures] == [[4.0, ord(text[0])] for text in texts]
+    assert sorted(embed_content.calls) == [["aaaa", "bbbb"], ["cccc", "dddd"], ["eeee"]]
+    assert all(sum(len(text) for text in call) <= 10 for call in embed_content.calls)
+
+
+def test_each_caller_gets_its_own_vector_across_threads(embed_content):
+    batcher = QueryEmbeddingBatcher(window_ms=50, max_size=8, concurrency=4)
+    texts = [chr(ord("a") + index % 26) * (index + 1) for index in range(40)]
+    results = {}
+
+    def ask(text):
+        results[text] = batcher.embed(text, timeout=5)
+
+    threads = [threading.Thread(target=ask, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results == {text: [float(len(text)), float(ord(text[0]))] for text in texts}
+    assert len(embed_content.calls) < len(texts)
+
+
+def test_provider_error_reaches_every_caller(monkeypatch):
+    monkeypatch.setattr(genai, "embed_content", FakeEmbedContent(error=ConnectionError("quota exceeded")))
+    batcher = QueryEmbeddingBatcher(window_ms=100, max_size=32, concurrency=2)
+
+    futures = submit_all(batcher, ["a", "b", "c"])
+
+    for future in futures:
+        with pytest.raises(ConnectionError, match="quota exceeded"):
+            future.result(5)
+
+
+def test_short_response_fails_every_caller(monkeypatch):
+    monkeypatch.setattr(genai, "embed_content", FakeEmbedContent(drop_last=True))
+    batcher = QueryEmbeddingBatcher(window_ms=100, max_size=32, concurrency=2)
+
+    futures = submit_all(batcher, ["a", "b", "c"])
+
+    for future in futures:
+        with pytest.raises(ExternalApiError):
+            future.result(5)
+
+
+def test_batches_are_exported_as_metrics(embed_content):
+    from prometheus_client import REGISTRY
+
+    def sample(name):
+        return REGISTRY.get_sample_value(name) or 0.0
+
+    batches = sample("chatbot_query_embedding_batch_size_count")
+    batched_queries = sample("chatbot_query_embedding_batch_size_sum")
+    delays = sample("chatbot_query_embedding_queue_delay_seconds_count")
+    batcher = QueryEmbeddingBatcher(window_ms=100, max_size=32, concurrency=2)
+
+    for future in submit_all(batcher, ["a", "b", "c"]):
+        future.result(5)
+
+    assert sample("chatbot_query_embedding_batch_size_count") == batches + 1
+    assert sample("chatbot_query_embedding_batch_size_sum") == batched_queries + 3
+    assert sample("chatbot_query_embedding_queue_delay_seconds_count") == delays + 3
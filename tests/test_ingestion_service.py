@@ -0,0 +1,26 @@
+import google.generativeai as genai
+import pytest
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+from app.exceptions import ExternalApiError, PermanentIngestionError
+from app.ingestion_service import get_embeddings_batch, is_retryable_ingestion_error
+
+
+def test_no_texts_embed_to_nothing_without_a_provider_call(monkeypatch):
+    def embed_content(**kwargs):
+        raise AssertionError("embed_content was called")
+
+    monkeypatch.setattr(genai, "embed_content", embed_content)
+    assert get_embeddings_batch([]) == []
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (ExternalApiError("The embedding service failed."), True),
+    (OperationalError("SELECT 1", {}, Exception("server closed the connection")), True),
+    (DBAPIError("SELECT 1", {}, Exception("connection reset"), connection_invalidated=True), True),
+    (PermanentIngestionError("Text was extracted but resulted in no chunks."), False),
+    (IntegrityError("INSERT", {}, Exception("duplicate key")), False),
+    (RuntimeError("cannot open broken document"), False),
+])
+def test_only_transient_errors_are_retried(error, retryable):
+    assert is_retryable_ingestion_error(error) is retryable
@@ -0,0 +1,326 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app import single_flight
+from app.config import Config
+from app.single_flight import SingleFlight, TEXT_CODEC
+
+
+class FakeMemcached:
+    """Dict-backed stand-in for the pymemcache client calls SingleFlight makes."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self.lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def add(self, key, value, expire=0, noreply=True):
+        with self.lock:
+            if self._live(key) is not None:
+                return False
+            self.data[key] = (value, time.monotonic() + expire if expire else None)
+            return True
+
+    def set(self, key, value, expire=0, noreply=True):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + expire if expire else None)
+        return True
+
+    def delete(self, key, noreply=True):
+        with self.lock:
+            self.data.pop(key, None)
+        return True
+
+
+class SlowMemcached(FakeMemcached):
+    """FakeMemcached whose calls block like a client waiting on a slow server."""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def get(self, key):
+        time.sleep(self.delay)
+        return super().get(key)
+
+    def add(self, key, value, expire=0, noreply=True):
+        time.sleep(self.delay)
+        return super().add(key, value, expire, noreply)
+
+
+class DownMemcached:
+    """What the client (ignore_exc=True) returns while memcached is unreachable."""
+
+    def get(self, key):
+        return None
+
+    def add(self, key, value, expire=0, noreply=True):
+        return False
+
+    def set(self, key, value, expire=0, noreply=True):
+        return False
+
+    def delete(self, key, noreply=True):
+        return False
+
+
+@pytest.fixture(autouse=True)
+def flight_config(monkeypatch):
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_ENABLED", True)
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_CROSS_WORKER", True)
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_LEASE_SECONDS", 30.0)
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_WAIT_SECONDS", 5.0)
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_RESULT_TTL_SECONDS", 10.0)
+
+
+@pytest.fixture
+def memcached(monkeypatch):
+    client = FakeMemcached()
+    monkeypatch.setattr(single_flight, "get_memcached_client", lambda: client)
+    return client
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def run_in_threads(count, make_coroutine):
+    """Runs make_coroutine() on its own event loop in each of `count` threads; returns results or exceptions."""
+    outcomes = [None] * count
+
+    def run(index):
+        try:
+            outcomes[index] = asyncio.run(make_coroutine())
+        except BaseException as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return outcomes
+
+
+def test_one_call_among_threads_on_separate_loops():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.to_thread(wait_for, lambda: flight.stats()["followers"] == 7)
+        return "answer"
+
+    outcomes = run_in_threads(8, lambda: flight.do_async("key", work))
+
+    assert outcomes == ["answer"] * 8
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "followers": 7, "remote_hits": 0, "in_flight": 0}
+
+
+def test_blocking_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+    outcomes = []
+
+    def work():
+        calls.append(1)
+        wait_for(lambda: flight.stats()["followers"] == 4)
+        return [0.5, 0.25]
+
+    threads = [threading.Thread(target=lambda: outcomes.append(flight.do("key", work))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert outcomes == [[0.5, 0.25]] * 5
+    assert len(calls) == 1
+
+
+def test_leader_exception_reaches_followers():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.to_thread(wait_for, lambda: flight.stats()["followers"] == 3)
+        raise ValueError("provider failed")
+
+    outcomes = run_in_threads(4, lambda: flight.do_async("key", work))
+
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_leader_fails_followers_with_runtime_error():
+    flight = SingleFlight("test")
+    leader_outcome = []
+
+    async def lead():
+        task = asyncio.create_task(flight.do_async("key", lambda: asyncio.sleep(60)))
+        await asyncio.to_thread(wait_for, lambda: flight.stats()["followers"] == 2)
+        task.cancel()
+        try:
+            await task
+        except BaseException as e:
+            leader_outcome.append(e)
+
+    leader = threading.Thread(target=asyncio.run, args=(lead(),))
+    leader.start()
+    wait_for(lambda: flight.stats()["leaders"] == 1)
+    outcomes = run_in_threads(2, lambda: flight.do_async("key", lambda: asyncio.sleep(0, "follower ran")))
+    leader.join(10)
+
+    assert isinstance(leader_outcome[0], asyncio.CancelledError)
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    # The next caller is a new leader.
+    assert asyncio.run(flight.do_async("key", lambda: asyncio.sleep(0, "fresh"))) == "fresh"
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight("test")
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.stats()["leaders"] == 2
+
+
+def test_lease_holder_publishes_result(memcached):
+    flight = SingleFlight("test")
+
+    assert flight.do("key", lambda: "answer", codec=TEXT_CODEC) == "answer"
+
+    result_key, lease_key = flight._remote_keys("key")
+    assert memcached.get(result_key) == b"answer"
+    assert memcached.get(lease_key) is None
+
+
+def test_published_result_is_a_remote_hit(memcached):
+    flight = SingleFlight("test")
+    result_key, _ = flight._remote_keys("key")
+    memcached.set(result_key, b"from another worker")
+
+    result = asyncio.run(flight.do_async("key", lambda: pytest.fail("work ran"), codec=TEXT_CODEC))
+
+    assert result == "from another worker"
+    assert flight.stats()["remote_hits"] == 1
+
+
+def test_waits_for_the_lease_holder_of_another_worker(memcached):
+    flight = SingleFlight("test")
+    result_key, lease_key = flight._remote_keys("key")
+    memcached.add(lease_key, b"1", expire=30)
+
+    def other_worker():
+        time.sleep(0.1)
+        memcached.set(result_key, b"shared")
+        memcached.delete(lease_key)
+
+    threading.Thread(target=other_worker).start()
+    result = flight.do("key", lambda: pytest.fail("work ran"), codec=TEXT_CODEC)
+
+    assert result == "shared"
+
+
+def test_stale_lease_runs_the_work_after_the_wait(memcached, monkeypatch):
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_WAIT_SECONDS", 0.2)
+    flight = SingleFlight("test")
+    _, lease_key = flight._remote_keys("key")
+    memcached.add(lease_key, b"1", expire=30)
+    calls = []
+
+    start = time.monotonic()
+    result = flight.do("key", lambda: calls.append(1) or "own", codec=TEXT_CODEC)
+
+    assert result == "own"
+    assert calls == [1]
+    assert time.monotonic() - start >= 0.2
+
+
+def test_expired_lease_runs_the_work_without_waiting_out_the_deadline(memcached, monkeypatch):
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_LEASE_SECONDS", 1.0)
+    flight = SingleFlight("test")
+    _, lease_key = flight._remote_keys("key")
+    memcached.add(lease_key, b"1", expire=0.1)
+
+    start = time.monotonic()
+    result = asyncio.run(flight.do_async("key", lambda: asyncio.sleep(0, "own"), codec=TEXT_CODEC))
+
+    assert result == "own"
+    assert time.monotonic() - start < Config.SINGLE_FLIGHT_WAIT_SECONDS
+
+
+def test_slow_memcached_does_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(single_flight, "get_memcached_client", lambda: SlowMemcached(delay=0.1))
+    flight = SingleFlight("test")
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.create_task(tick())
+        result = await flight.do_async("key", lambda: asyncio.sleep(0, "own"), codec=TEXT_CODEC)
+        ticker.cancel()
+        return result
+
+    assert asyncio.run(main()) == "own"
+    # The lease takes two 0.1s memcached calls; the loop kept running meanwhile.
+    assert len(ticks) >= 10
+
+
+def test_memcached_down_falls_back_to_running_locally(monkeypatch):
+    monkeypatch.setattr(single_flight, "get_memcached_client", lambda: DownMemcached())
+    flight = SingleFlight("test")
+    calls = []
+
+    start = time.monotonic()
+    assert flight.do("key", lambda: calls.append(1) or "own", codec=TEXT_CODEC) == "own"
+
+    assert calls == [1]
+    assert time.monotonic() - start < 1
+
+
+def test_disabled_runs_every_call(monkeypatch):
+    monkeypatch.setattr(Config, "SINGLE_FLIGHT_ENABLED", False)
+    flight = SingleFlight("test")
+    calls = []
+    flight.do("key", lambda: calls.append(1))
+    flight.do("key", lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_roles_are_exported_as_metrics(memcached):
+    from prometheus_client import REGISTRY
+
+    def sample(role):
+        return REGISTRY.get_sample_value("chatbot_single_flight_calls_total", {"flight": "metrics", "role": role}) or 0.0
+
+    flight = SingleFlight("metrics")
+    result_key, _ = flight._remote_keys("published")
+    memcached.set(result_key, b"shared")
+
+    flight.do("local", lambda: "own")
+    flight.do("published", lambda: pytest.fail("work ran"), codec=TEXT_CODEC)
+
+    assert sample("leader") == 2
+    assert sample("remote_hit") == 1
+    assert sample("follower") == 0